@@ -0,0 +1,83 @@
+"""Measures the rows per second SheetsAdaptor ingests CSVs at.
+
+Compares the bulk-load mode against the chunked multi-row inserts
+for narrow and wide files, and bulk loading through a memory map.
+Execute it with ``make bench`` or ``python -m benchmarks.ingest [rows]``.
+"""
+from __future__ import annotations
+
+import csv
+import sys
+import tempfile
+import time
+import typing as t
+from pathlib import Path
+
+from bigsheets.adapters.sheets.sheets import EngineFactory, SheetRegistry, SheetsAdaptor
+
+FILES = {"narrow": 5, "wide": 40}
+"""The name of the generated CSV and its number of columns."""
+
+
+class ChunkedSheetsAdaptor(SheetsAdaptor):
+    bulk_load = False
+    sheets = SheetRegistry()
+    import_cache = None
+
+
+class BulkSheetsAdaptor(SheetsAdaptor):
+    bulk_load = True
+    memory_map = False
+    sheets = SheetRegistry()
+    import_cache = None
+
+
+class MappedSheetsAdaptor(SheetsAdaptor):
+    bulk_load = True
+    memory_map = True
+    sheets = SheetRegistry()
+    import_cache = None
+
+
+def write_csv(filepath: Path, rows: int, cols: int):
+    with filepath.open("w") as f:
+        writer = csv.writer(f)
+        writer.writerow(f"column {i}" for i in range(cols))
+        for row in range(rows):
+            writer.writerow(
+                (row, f"text {row}", row * 1.5, "", row % 7)[i % 5]
+                for i in range(cols)
+            )
+
+
+def measure(Sheets: t.Type[SheetsAdaptor], filepath: Path, run: int) -> float:
+    """Opens filepath in a new database and returns the rows per second."""
+    session = EngineFactory(f"file:bench{run}?mode=memory&cache=shared")()
+    start = time.perf_counter()
+    sheet, _ = Sheets(session).open_sheet(filepath)
+    session.commit()
+    elapsed = time.perf_counter() - start
+    rows = session.execute(f"SELECT count(*) FROM {sheet.name}").fetchone()[0]
+    session.close()
+    return rows / elapsed
+
+
+def main(rows: int = 200_000):
+    with tempfile.TemporaryDirectory() as directory:
+        print(
+            f"{'file':<8}{'columns':>8}{'chunked rows/s':>18}{'bulk rows/s':>16}"
+            f"{'mapped rows/s':>16}"
+        )
+        adaptors = ChunkedSheetsAdaptor, BulkSheetsAdaptor, MappedSheetsAdaptor
+        for run, (name, cols) in enumerate(FILES.items()):
+            filepath = Path(directory) / f"{name}.csv"
+            write_csv(filepath, rows, cols)
+            chunked, bulk, mapped = (
+                measure(Sheets, filepath, run * len(adaptors) + i)
+                for i, Sheets in enumerate(adaptors)
+            )
+            print(f"{name:<8}{cols:>8}{chunked:>18,.0f}{bulk:>16,.0f}{mapped:>16,.0f}")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
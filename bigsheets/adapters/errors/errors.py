@@ -1,11 +1,10 @@
 from __future__ import annotations
 
 import abc
+import threading
 import typing as t
 from collections import defaultdict
 
-from ordered_set_37 import OrderedSet
-
 from bigsheets.domain import error as model
 
 
@@ -14,22 +13,63 @@ class Errors(abc.ABC):
 
     This class gets and saves errors.
     """
-    def get(self) -> t.Dict[str, OrderedSet[model.Error]]:
+    def get(self) -> t.Dict[str, t.List[model.Error]]:
         raise NotImplementedError
 
     def add(self, *error: model.Error):
         raise NotImplementedError
 
+    def counts(self) -> t.Dict[str, int]:
+        """The number of errors per filename."""
+        raise NotImplementedError
+
+    def page(self, filename: str, page: int, limit: int) -> t.List[dict]:
+        """The errors of the file in the page, as dicts."""
+        raise NotImplementedError
+
 
 class ErrorsAdapter(Errors):
     def __init__(self):
-        self._errors: t.Dict[str, OrderedSet[model.Error]] = defaultdict(
-            OrderedSet
-        )
+        self._errors: t.Dict[str, t.List[model.Error]] = defaultdict(list)
+        self._lock = threading.Lock()
 
     def get(self):
         return self._errors
 
     def add(self, *error: model.Error):
-        for e in error:
-            self._errors[e.filename].add(e)
+        with self._lock:
+            for e in error:
+                if not len(e):
+                    continue
+                errors = self._errors[e.filename]
+                if isinstance(e, model.WrongRows):
+                    # Keep the wrong rows of a sheet together
+                    same = (
+                        o
+                        for o in errors
+                        if isinstance(o, model.WrongRows)
+                        and o.sheet_name == e.sheet_name
+                    )
+                    if wrong_rows := next(same, None):
+                        wrong_rows.extend(e)
+                        continue
+                errors.append(e)
+
+    def counts(self):
+        with self._lock:
+            return {
+                filename: sum(map(len, errors))
+                for filename, errors in self._errors.items()
+            }
+
+    def page(self, filename: str, page: int, limit: int):
+        start = page * limit
+        records = []
+        with self._lock:
+            for e in self._errors.get(filename, ()):
+                if start < len(e):
+                    records.extend(e.records(start, start + limit - len(records)))
+                    if len(records) == limit:
+                        break
+                start = max(start - len(e), 0)
+        return records
@@ -0,0 +1,122 @@
+"""Splits the rows we insert in batches whose size is tuned by the
+throughput we measure, and reports the progress of the inserts
+every some time instead of every batch.
+"""
+from __future__ import annotations
+
+import logging
+import time
+import typing as t
+from itertools import islice
+
+from bigsheets.adapters.sheets.file import Row, Rows
+
+log = logging.getLogger(__name__)
+
+
+class Batcher:
+    """Splits rows in batches, tuning their size to the one inserting
+    the most rows per second.
+
+    The time of a batch is the time from starting to read its rows
+    until we are asked for the next batch, so it includes parsing
+    and inserting the rows. After each batch the size climbs towards
+    the best throughput: it keeps growing, or shrinking, by FACTOR
+    while the throughput improves, and turns around when it worsens.
+    """
+
+    FACTOR = 1.5
+
+    def __init__(
+        self,
+        size: int,
+        minimum: int,
+        maximum: int,
+        position: t.Callable[[], int] = lambda: 0,
+        name: str = "",
+    ):
+        """
+        :param size: The size of the first batch.
+        :param minimum: The min size of a batch.
+        :param maximum: The max size of a batch.
+        :param position: Returns the bytes read so far, to measure
+        the bytes per second.
+        :param name: To identify the batcher in the logs.
+        """
+        self.minimum = minimum
+        self.maximum = maximum
+        self.size = self._clamp(size)
+        self.position = position
+        self.name = name
+        self.rows = self.bytes = 0
+        self.seconds = 0.0
+        self._direction = 1
+        self._rate: t.Optional[float] = None
+        """The rows per second of the last full batch."""
+
+    def __call__(self, rows: t.Iterable[Row]) -> t.Iterator[Rows]:
+        rows = iter(rows)
+        start, position = time.perf_counter(), self.position()
+        while batch := list(islice(rows, self.size)):
+            yield batch
+            now, read = time.perf_counter(), self.position()
+            self._tune(len(batch), read - position, now - start)
+            start, position = now, read
+        if self.seconds:
+            log.info(
+                "%s: %s rows in %.2fs, %.0f rows/s, %.2f MB/s; batch size tuned to %s",
+                self.name,
+                self.rows,
+                self.seconds,
+                self.rows / self.seconds,
+                self.bytes / self.seconds / 2 ** 20,
+                self.size,
+            )
+
+    def _tune(self, rows: int, read: int, seconds: float):
+        self.rows += rows
+        self.bytes += read
+        self.seconds += seconds
+        if rows < self.size or not seconds:  # The last batch is not comparable
+            return
+        rate = rows / seconds
+        if self._rate is not None and rate < self._rate:
+            self._direction = -self._direction
+        self._rate = rate
+        size = self._clamp(round(self.size * self.FACTOR ** self._direction))
+        log.debug(
+            "%s: %s rows/s, %.2f MB/s with batches of %s; next batch of %s",
+            self.name,
+            round(rate),
+            read / seconds / 2 ** 20,
+            self.size,
+            size,
+        )
+        self.size = size
+
+    def _clamp(self, size: int) -> int:
+        return min(max(size, self.minimum), self.maximum)
+
+
+class Progress:
+    """Reports the progress every interval seconds at most,
+    accumulating the progress in-between.
+    """
+
+    def __init__(self, report: t.Callable[[int], None], interval: float):
+        self.report = report
+        self.interval = interval
+        self._pending = 0
+        self._last = time.monotonic()
+
+    def add(self, n: int):
+        self._pending += n
+        if time.monotonic() - self._last >= self.interval:
+            self.flush()
+
+    def flush(self):
+        """Reports the progress accumulated so far."""
+        if self._pending:
+            self.report(self._pending)
+            self._pending = 0
+        self._last = time.monotonic()
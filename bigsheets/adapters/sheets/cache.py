@@ -0,0 +1,156 @@
+"""Caches the sheets we import as sqlite databases in the disk, so
+opening again a file that did not change copies its table instead
+of parsing the file.
+
+Each database is named after the fingerprint of the file it was
+imported from. The last time we used a database is its
+modification time, which we use to evict the least recently used
+databases when the cache grows over its budget.
+"""
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import sys
+import tempfile
+import threading
+import typing as t
+from contextlib import contextmanager
+from pathlib import Path
+
+import decouple
+
+log = logging.getLogger(__name__)
+
+SUFFIX = ".sqlite"
+
+
+def directory() -> Path:
+    """The directory of the cache, which can be set through the
+    IMPORT_CACHE_DIR environment variable, and is in the caches of
+    the user of the platform by default.
+    """
+    if sys.platform == "darwin":
+        default = Path.home() / "Library" / "Caches" / "com.bustawin.big-sheets"
+    elif sys.platform == "win32":
+        local = os.environ.get("LOCALAPPDATA") or Path.home() / "AppData" / "Local"
+        default = Path(local) / "big-sheets" / "Cache"
+    else:
+        caches = os.environ.get("XDG_CACHE_HOME", "")
+        if not os.path.isabs(caches):  # Which XDG says to ignore
+            caches = Path.home() / ".cache"
+        default = Path(caches) / "big-sheets"
+    return Path(decouple.config("IMPORT_CACHE_DIR", default=str(default)))
+
+
+def budget() -> int:
+    """The max bytes of the cache, which can be set through the
+    IMPORT_CACHE_BYTES environment variable.
+    """
+    return decouple.config("IMPORT_CACHE_BYTES", default=8 * 2 ** 30, cast=int)
+
+
+class ImportCache:
+    """The sqlite databases of the files we imported, by the
+    fingerprint of the files.
+    """
+
+    SAMPLES = 16
+    """The number of places of a file we hash for its fingerprint."""
+    SAMPLE_BYTES = 4096
+
+    def __init__(self, directory: Path, budget: int):
+        """
+        :param directory: Where to keep the databases, which is
+        created when storing the first one.
+        :param budget: The max bytes of the databases together.
+        """
+        self.directory = directory
+        self.budget = budget
+        self._lock = threading.Lock()
+
+    def fingerprint(self, filepath: Path) -> str:
+        """Identifies the file by its path, size, modification time, and
+        the hash of some bytes spread through it, as hashing a whole big
+        file takes as long as parsing it.
+        """
+        stat = filepath.stat()
+        h = hashlib.sha1(
+            f"{filepath.resolve()}\0{stat.st_size}\0{stat.st_mtime_ns}".encode()
+        )
+        with filepath.open("rb") as f:
+            step = max(stat.st_size - self.SAMPLE_BYTES, 0) / (self.SAMPLES - 1)
+            for i in range(self.SAMPLES):
+                f.seek(int(i * step))
+                h.update(f.read(self.SAMPLE_BYTES))
+        return h.hexdigest()
+
+    def get(self, fingerprint: str) -> t.Optional[Path]:
+        """The database of the file with the fingerprint, if cached,
+        setting it as the most recently used.
+        """
+        path = self._path(fingerprint)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            log.info("Import cache miss of %s", fingerprint)
+            return None
+        log.info("Import cache hit of %s", fingerprint)
+        return path
+
+    @contextmanager
+    def storing(self, fingerprint: str) -> t.Iterator[Path]:
+        """Yields the path where to write the database of the file with
+        the fingerprint, which is cached once the block finishes, evicting
+        the least recently used databases if the cache is over budget.
+
+        The database is not cached if the block fails.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        fd, name = tempfile.mkstemp(SUFFIX + ".tmp", dir=self.directory)
+        os.close(fd)
+        tmp = Path(name)
+        try:
+            yield tmp
+            os.replace(tmp, self._path(fingerprint))
+        finally:
+            tmp.unlink(missing_ok=True)
+        self._evict()
+
+    def discard(self, fingerprint: str):
+        self._path(fingerprint).unlink(missing_ok=True)
+
+    def clear(self):
+        """Removes all the databases of the cache."""
+        with self._lock:
+            for path in self._databases():
+                path.unlink(missing_ok=True)
+        log.info("Import cache cleared")
+
+    @property
+    def size(self) -> int:
+        """The bytes of the databases."""
+        return sum(path.stat().st_size for path in self._databases())
+
+    def _evict(self):
+        with self._lock:
+            databases = sorted(
+                ((path, path.stat()) for path in self._databases()),
+                key=lambda database: database[1].st_mtime_ns,
+            )
+            size = sum(stat.st_size for _, stat in databases)
+            for path, stat in databases:  # From least to most recently used
+                if size <= self.budget:
+                    break
+                log.info("Import cache over budget; evicting %s", path.name)
+                path.unlink(missing_ok=True)
+                size -= stat.st_size
+
+    def _databases(self) -> t.List[Path]:
+        if not self.directory.exists():
+            return []
+        return list(self.directory.glob(f"*{SUFFIX}"))
+
+    def _path(self, fingerprint: str) -> Path:
+        return self.directory / f"{fingerprint}{SUFFIX}"
@@ -0,0 +1,105 @@
+"""Opens CSVs that are compressed, decompressing them as we read them,
+so they do not need to be decompressed into the disk first.
+"""
+from __future__ import annotations
+
+import bz2
+import gzip
+import io
+import logging
+import lzma
+import typing as t
+import zipfile
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+
+log = logging.getLogger(__name__)
+
+MAGIC_NUMBERS = {
+    b"\x1f\x8b": gzip.open,
+    b"BZh": bz2.open,
+    b"\xfd7zXZ\x00": lzma.open,
+    b"PK\x03\x04": zipfile.ZipFile,
+}
+"""The bytes compressed files start with, and how to open them."""
+HEAD = max(map(len, MAGIC_NUMBERS))
+CSV_SUFFIXES = (".csv", ".tsv", ".tab", ".txt")
+"""The suffixes of the CSVs we look for inside zips."""
+
+
+class Compressed:
+    """A compressed file in the filesystem, to know how much of it
+    we decompressed.
+    """
+
+    def __init__(self, name: str, fp: t.BinaryIO, start: int, size: int):
+        """
+        :param name: The name of the decompressed file.
+        :param fp: The file with the compressed bytes.
+        :param start: The offset in fp where the compressed bytes start.
+        :param size: The number of compressed bytes.
+        """
+        self.name = name
+        self.fp = fp
+        self.start = start
+        self.size = size
+
+    @property
+    def position(self) -> int:
+        """The compressed bytes decompressed so far."""
+        return min(max(self.fp.tell() - self.start, 0), self.size)
+
+
+@contextmanager
+def open_text(filepath: Path) -> t.Iterator[t.Tuple[t.TextIO, t.Optional[Compressed]]]:
+    """Opens the file in text mode, decompressing it if it is compressed.
+
+    Yields the file and, if compressed, the Compressed file.
+    A zip is opened through its first CSV.
+    """
+    with ExitStack() as stack:
+        fp = stack.enter_context(filepath.open("rb"))
+        Decompressor = decompressor(fp.read(HEAD))
+        fp.seek(0)
+        if not Decompressor:
+            yield stack.enter_context(io.TextIOWrapper(fp)), None
+            return
+        if Decompressor is zipfile.ZipFile:
+            zip = stack.enter_context(zipfile.ZipFile(fp))
+            member = _csv_member(zip)
+            log.info("File %s: opening member %s", filepath, member.filename)
+            inner = stack.enter_context(zip.open(member))
+            # Skip the local header of the member
+            start = member.header_offset + len(member.FileHeader())
+            name = str(filepath / member.filename)
+            compressed = Compressed(name, fp, start, member.compress_size)
+        else:
+            inner = stack.enter_context(Decompressor(fp))
+            compressed = Compressed(str(filepath), fp, 0, filepath.stat().st_size)
+        log.info("File %s: decompressing with %s", filepath, Decompressor.__module__)
+        yield stack.enter_context(io.TextIOWrapper(inner)), compressed
+
+
+def is_compressed(filepath: Path) -> bool:
+    with filepath.open("rb") as fp:
+        return bool(decompressor(fp.read(HEAD)))
+
+
+def decompressor(head: bytes) -> t.Optional[t.Callable[..., t.BinaryIO]]:
+    """The class that opens the file starting with the head bytes,
+    if the file is compressed.
+    """
+    for magic, Decompressor in MAGIC_NUMBERS.items():
+        if head.startswith(magic):
+            return Decompressor
+    return None
+
+
+def _csv_member(zip: zipfile.ZipFile) -> zipfile.ZipInfo:
+    members = [m for m in zip.infolist() if not m.is_dir()]
+    if not members:
+        raise ValueError(f"{zip.filename} has no files.")
+    csvs = [m for m in members if Path(m.filename).suffix.lower() in CSV_SUFFIXES]
+    if len(csvs) > 1:
+        log.info("Zip %s has several CSVs; opening the first one", zip.filename)
+    return (csvs or members)[0]
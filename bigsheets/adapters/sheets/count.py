@@ -0,0 +1,118 @@
+"""Counts and estimates the records of a CSV from its bytes.
+
+A newline only ends a record when it is not inside quotes, which is
+when an even number of quotes precede it —this works with double
+quotes too, as they come in pairs.
+"""
+from __future__ import annotations
+
+import typing as t
+
+BLOCK = 2 ** 20
+"""Bytes read per block when scanning a file."""
+
+
+class Scanner:
+    """Counts the records of a CSV fed in blocks of bytes, and
+    finds where records start approximately every some bytes.
+    """
+
+    def __init__(self, quotechar: t.Optional[str], every: t.Optional[int] = None):
+        """
+        :param quotechar: The quote char of the dialect of the CSV.
+        :param every: Find where a record starts approximately every
+        these bytes. If None, do not find them.
+        """
+        self.quote = quotechar.encode() if quotechar else None
+        self.every = every
+        self.records = 0
+        self.boundaries = [0]
+        """The offsets where records start, plus the offset of the
+        end of the file once closed.
+        """
+        self.size = 0
+        """The bytes scanned."""
+        self._odd_quotes = False
+        self._last_byte = b"\n"
+
+    def feed(self, block: bytes):
+        if self.every:
+            self._find_boundaries(block)
+        if not self.quote or (not self._odd_quotes and self.quote not in block):
+            self.records += block.count(b"\n")
+        else:
+            parts = block.split(self.quote)
+            outside = 1 if self._odd_quotes else 0
+            self.records += sum(p.count(b"\n") for p in parts[outside::2])
+            self._odd_quotes ^= len(parts) % 2 == 0
+        self.size += len(block)
+        self._last_byte = block[-1:] or self._last_byte
+
+    def _find_boundaries(self, block: bytes):
+        odd_quotes = self._odd_quotes
+        counted = 0  # Quotes are counted up to here in the block
+        start = self.boundaries[-1] + self.every - self.size
+        while max(start, 0) < len(block):
+            i = block.find(b"\n", max(start, 0))
+            if i == -1:
+                break
+            if self.quote:
+                odd_quotes ^= block.count(self.quote, counted, i) % 2 == 1
+                counted = i
+            if odd_quotes:  # The newline is inside a quoted cell
+                start = i + 1
+            else:
+                self.boundaries.append(self.size + i + 1)
+                start = i + 1 + self.every
+
+    def close(self) -> Scanner:
+        """Finishes scanning."""
+        if self._last_byte != b"\n":  # The last record has no newline
+            self.records += 1
+        if self.boundaries[-1] >= self.size:  # The file ends with a newline
+            self.boundaries.pop()
+        self.boundaries.append(self.size)
+        return self
+
+
+def scan(
+    fp: t.BinaryIO, quotechar: t.Optional[str], every: t.Optional[int] = None
+) -> Scanner:
+    """Scans the whole file in blocks of bytes."""
+    scanner = Scanner(quotechar, every)
+    while block := fp.read(BLOCK):
+        scanner.feed(block)
+    return scanner.close()
+
+
+def estimate(size: int, sample: bytes, quotechar: t.Optional[str]) -> int:
+    """Estimates the records of a file of size bytes from the average
+    length of the records in the sample of its first bytes.
+    """
+    scanner = Scanner(quotechar)
+    scanner.feed(sample)
+    if len(sample) >= size:  # The sample is the whole file
+        return scanner.close().records
+    if not scanner.records:
+        return 1
+    # Do not count the last record of the sample as it is incomplete
+    return round(size * scanner.records / (sample.rfind(b"\n") + 1))
+
+
+def refine(records: int, position: int, size: int) -> int:
+    """Estimates the records of a file of size bytes knowing that
+    until position there are records.
+    """
+    return round(records * size / position) if position else records
+
+
+def last_boundary(data: bytes, quotechar: t.Optional[str]) -> int:
+    """The offset after the last record that data, starting at the
+    beginning of a record, has complete; 0 if none.
+    """
+    quote = quotechar.encode() if quotechar else None
+    i = len(data)
+    while (i := data.rfind(b"\n", 0, i)) != -1:
+        if not quote or data.count(quote, 0, i) % 2 == 0:
+            return i + 1
+    return 0
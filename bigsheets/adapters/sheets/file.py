@@ -1,12 +1,16 @@
 from __future__ import annotations
 
 import csv
+import io
 import logging
-import subprocess
 import typing as t
 from decimal import Decimal
 from functools import cached_property
 from itertools import islice
+from pathlib import Path
+
+from bigsheets.adapters.sheets import count
+from bigsheets.adapters.sheets.compression import Compressed
 
 Cell = t.Union[int, float, str, None]
 Cells = Row = Column = t.Collection[Cell]
@@ -22,20 +26,39 @@ class CSVFile:
 
     SAMPLE = 50
     KB_SAMPLE = 4092 * 4
+    BYTES_SAMPLE = 2 ** 20
+    """The bytes used to estimate the number of rows."""
+    RANGE_BYTES = 8 * 2 ** 20
+    """The default range_size."""
 
     def __init__(
-        self, f: t.TextIO, headers: t.Optional[t.List[str]] = None
+        self,
+        f: t.TextIO,
+        headers: t.Optional[t.List[str]] = None,
+        exact_count: bool = False,
+        range_size: int = RANGE_BYTES,
+        compressed: t.Optional[Compressed] = None,
     ):
         """
         :param f: The CSV file.
         :param headers: The headers of the CSV. If not provided,
         they are guessed from the file.
-        :param binary: Whether the file the path opens is in binary
-        or str mode. Unless the docs says otherwise, it is usually
-        in text.
+        :param exact_count: Whether to count the rows by reading the
+        whole file (with big reads), instead of estimating them.
+        :param range_size: When scanning the file, find where a row
+        starts approximately every these bytes.
+        :param compressed: The compressed file f decompresses, if any.
+        Then, we estimate the number of rows from the compressed bytes.
         """
         self.f = f
+        self.compressed = compressed
         self.headers: t.List[str] = headers
+        self.exact_count = exact_count
+        self.range_size = range_size
+        self.header_row = False
+        """Whether the first row of the file is the header."""
+        self._scanner: t.Optional[count.Scanner] = None
+        self._estimate: t.Optional[int] = None
         sniffer = csv.Sniffer()
         line = self.f.readline()
         self.dialect = sniffer.sniff(line)
@@ -51,6 +74,7 @@ class CSVFile:
         if not self.headers:
             if sniffer.has_header(self.f.read(self.KB_SAMPLE)):
                 self.headers = self.rows.pop(0)  # Remove first row when is header
+                self.header_row = True
             else:
                 self.headers = tuple(f"C{i}" for i in range(self.num_cells))
             self.f.seek(0)
@@ -67,10 +91,98 @@ class CSVFile:
     @property
     def name(self):
         """The name of the file."""
-        return self.f.name
+        return self.compressed.name if self.compressed else self.f.name
+
+    @property
+    def filepath(self) -> t.Optional[Path]:
+        """The path of the file, if the file is in the filesystem
+        (ex. it is not inside a zip) and it is not compressed.
+        """
+        if self.compressed:
+            return None
+        try:
+            self.f.fileno()
+        except io.UnsupportedOperation:
+            return None
+        return Path(self.name)
+
+    @property
+    def encoding(self) -> str:
+        return self.f.encoding
 
     @cached_property
-    def num_lines(self) -> int:
-        return int(
-            subprocess.check_output(f"wc -l '{self.name}'", shell=True).split()[0]
-        )
+    def size(self) -> t.Optional[int]:
+        """The size in bytes of the file, if the file is in the filesystem.
+        For compressed files, the compressed size.
+        """
+        if self.compressed:
+            return self.compressed.size
+        filepath = self.filepath
+        return filepath.stat().st_size if filepath else None
+
+    def scan(self) -> count.Scanner:
+        """Reads the whole file in big blocks counting the rows and
+        finding where rows start approximately every range_size bytes.
+
+        The file must be in the filesystem. The scan is only done once.
+        """
+        if not self._scanner:
+            with self.filepath.open("rb") as fp:
+                self._scanner = count.scan(
+                    fp, self.dialect.quotechar, self.range_size
+                )
+        return self._scanner
+
+    @property
+    def num_lines(self) -> t.Optional[int]:
+        """The number of rows of the file, without the header.
+
+        This number is exact if the file has been scanned or we
+        count exactly, otherwise it is an estimation that
+        update_num_lines refines. It is None for files that are not
+        in the filesystem.
+        """
+        if self.exact_count and self.filepath:
+            self.scan()
+        if self._scanner:
+            return self._scanner.records - self.header_row
+        if self._estimate is None and self.compressed:
+            self._estimate = self._estimate_compressed() - self.header_row
+        elif self._estimate is None and self.size is not None:
+            sample = self._sample()
+            estimate = count.estimate(self.size, sample, self.dialect.quotechar)
+            self._estimate = estimate - self.header_row
+        return self._estimate
+
+    def _estimate_compressed(self) -> int:
+        # Decompress a sample and see how many compressed bytes it took
+        sample = self.f.buffer.read(self.BYTES_SAMPLE)
+        scanner = count.Scanner(self.dialect.quotechar)
+        scanner.feed(sample)
+        if len(sample) < self.BYTES_SAMPLE:  # The sample is the whole file
+            estimate = scanner.close().records
+        else:
+            estimate = count.refine(
+                scanner.records, self.compressed.position, self.size
+            )
+        self.f.seek(0)
+        return estimate
+
+    def update_num_lines(self, parsed: int) -> t.Optional[int]:
+        """Refines num_lines knowing that we iterated parsed rows."""
+        if not self._scanner and not self.exact_count and self.size:
+            position = self.position
+            self._estimate = count.refine(parsed, position, self.size)
+        return self.num_lines
+
+    def _sample(self) -> bytes:
+        """The first BYTES_SAMPLE bytes of the file in the filesystem."""
+        with self.filepath.open("rb") as fp:
+            return fp.read(self.BYTES_SAMPLE)
+
+    @property
+    def position(self) -> int:
+        """The bytes of the file in the filesystem read so far."""
+        if self.compressed:
+            return self.compressed.position
+        return self.f.buffer.tell()
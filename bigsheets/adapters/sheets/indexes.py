@@ -0,0 +1,126 @@
+"""Advises the indexes of the sheets from the queries the user runs.
+
+Sqlite tells through EXPLAIN QUERY PLAN the tables a query scans
+whole, and the automatic indexes it builds for a join each time the
+query runs. The columns of a scanned table that the query compares
+or joins on are candidates for an index, and once a query repeats a
+candidate we index it.
+"""
+from __future__ import annotations
+
+import re
+import sqlite3
+import threading
+import typing as t
+from collections import Counter
+
+import decouple
+
+Candidate = t.Tuple[str, str]
+"""The table and the column to index."""
+
+KEYWORDS = (
+    "WHERE JOIN ON USING LEFT RIGHT FULL INNER OUTER CROSS NATURAL GROUP ORDER "
+    "LIMIT HAVING WINDOW UNION INTERSECT EXCEPT"
+).split()
+"""The words that can follow a table instead of its alias."""
+
+_IDENTIFIER = r'(?:"(?:[^"]|"")+"|\[[^\]]+\]|`[^`]+`|\w+)'
+_COLUMN = rf"(?:({_IDENTIFIER})\s*\.\s*)?({_IDENTIFIER})"
+_OPERATOR = r"(?:==?|<>|!=|<=?|>=?|\bIN\b|\bBETWEEN\b|\bGLOB\b|\bIS\b)"
+_COMPARED = (
+    re.compile(rf"{_COLUMN}\s*{_OPERATOR}", re.IGNORECASE),
+    re.compile(rf"(?:==?|<>|!=|<=?|>=?)\s*{_COLUMN}"),
+)
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_TABLE = re.compile(
+    rf"\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(?!{'|'.join(KEYWORDS)}\b)(\w+))?",
+    re.IGNORECASE,
+)
+_SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)")
+_AUTOMATIC = re.compile(
+    r"^SEARCH (?:TABLE )?(\w+)(?: AS \w+)? USING AUTOMATIC .*INDEX \((.+?)=\?"
+)
+
+
+def budget() -> int:
+    """The max bytes of the indexes we create, which can be set
+    through the INDEX_BUDGET environment variable.
+    """
+    return decouple.config("INDEX_BUDGET", default=2 ** 30, cast=int)
+
+
+def candidates(session: sqlite3.Connection, q: str) -> t.Set[Candidate]:
+    """The columns the query would use through an index, were there one.
+
+    Raises sqlite3.Error if the query is wrong.
+    """
+    text = _STRING.sub("''", q)  # Values could look like columns
+    tables = {alias or table: table for table, alias in _TABLE.findall(text)}
+    """The tables by the names the query gives them."""
+    scanned = set()
+    found = set()
+    for *_, detail in session.execute(f"EXPLAIN QUERY PLAN {q}"):
+        if match := _AUTOMATIC.match(detail):
+            found.add((tables.get(match[1], match[1]), match[2]))
+        elif match := _SCAN.match(detail):
+            scanned.add(tables.get(match[1], match[1]))
+    compared = {
+        (qualifier and _unquote(qualifier), _unquote(column))
+        for regex in _COMPARED
+        for qualifier, column in regex.findall(text)
+    }
+    for table in scanned:
+        names = {table} | {n for n, of in tables.items() if of == table}
+        columns = {c for _, c, *_ in session.execute(f"PRAGMA table_info({table})")}
+        found.update(
+            (table, column)
+            for qualifier, column in compared
+            if column in columns and (not qualifier or qualifier in names)
+        )
+    return found
+
+
+def name(table: str, column: str) -> str:
+    return f"{table}_{column}"
+
+
+class Advisor:
+    """Counts the candidates of the queries, to index the ones
+    that repeat.
+    """
+
+    REPEATS = 2
+    """The queries that need a candidate before we index it."""
+
+    def __init__(self):
+        self._seen: t.Counter[Candidate] = Counter()
+        self._lock = threading.Lock()
+
+    def observe(self, candidates: t.Iterable[Candidate]) -> t.List[Candidate]:
+        """Counts the candidates of a query, returning the ones that
+        just repeated enough to index them.
+
+        A candidate is returned only once, so we do not index again
+        a column whose index the user dropped.
+        """
+        candidates = set(candidates)
+        with self._lock:
+            self._seen.update(candidates)
+            return [c for c in candidates if self._seen[c] == self.REPEATS]
+
+    def forget(self, table: str):
+        """Forgets the candidates of a table, like when the sheet is
+        removed and its name reused.
+        """
+        with self._lock:
+            for candidate in [c for c in self._seen if c[0] == table]:
+                del self._seen[candidate]
+
+
+def _unquote(identifier: str) -> str:
+    if identifier[0] == '"':
+        return identifier[1:-1].replace('""', '"')
+    if identifier[0] in "[`":
+        return identifier[1:-1]
+    return identifier
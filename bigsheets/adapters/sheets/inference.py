@@ -0,0 +1,219 @@
+"""Infers the types of the columns of a CSV and converts its values.
+
+The types are inferred from a sample of rows, and refined with the
+values we convert when loading: a value that does not fit in the type
+of its column demotes the column to a more generic type.
+"""
+from __future__ import annotations
+
+import logging
+import math
+import re
+import typing as t
+from datetime import datetime
+
+from bigsheets.adapters.sheets.file import Cell, Row, Rows
+
+log = logging.getLogger(__name__)
+
+INTEGER = "INTEGER"
+REAL = "REAL"
+TEXT = "TEXT"
+DATE = "DATE"
+"""Dates are stored as ISO 8601 text, so they sort and work with
+the date functions of sqlite.
+"""
+
+DATE_FORMATS = (
+    "%Y-%m-%d",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%dT%H:%M:%S",
+    "%Y/%m/%d",
+    "%d/%m/%Y",
+    "%m/%d/%Y",
+    "%d-%m-%Y",
+    "%d.%m.%Y",
+    "%d/%m/%Y %H:%M:%S",
+    "%m/%d/%Y %H:%M:%S",
+    "%d/%m/%Y %H:%M",
+    "%m/%d/%Y %H:%M",
+)
+"""The formats of the dates we recognize. A column whose dates fit in
+several, like 01/02/2020, is text, as we cannot tell which date it is.
+"""
+THOUSANDS = re.compile(r"^\s*[-+]?\d{1,3}(,\d{3})+(\.\d*)?\s*$")
+"""A number with commas separating the thousands."""
+LEADING_ZERO = re.compile(r"^\s*[-+]?0\d")
+"""A number with zeros before its digits, like the id 007, which is
+text, as a number would lose the zeros.
+"""
+
+
+class Column:
+    """The type of a column, which converts the values of the column
+    from the CSV into the type.
+    """
+
+    def __init__(self, type: str, date_format: t.Optional[str] = None):
+        """
+        :param type: INTEGER, REAL, TEXT, or DATE.
+        :param date_format: For DATE, the strptime format of the dates
+        in the CSV. If None, dates are in ISO 8601.
+        """
+        self.type = type
+        self.date_format = date_format
+        self.convert: t.Callable[[str], Cell] = {
+            INTEGER: self._integer,
+            REAL: self._real,
+            TEXT: self._text,
+            DATE: self._date,
+        }[type]
+        """Converts a value of the CSV into the type, raising
+        ValueError when the value does not fit in the type.
+        """
+
+    @classmethod
+    def infer(cls, values: t.Collection[str]) -> Column:
+        """The most specific column where all the values fit."""
+        values = [v for v in values if v and not v.isspace()]
+        if values:
+            for column in (cls(INTEGER), cls(REAL)):
+                if column.fits(values):
+                    return column
+            dates = [c for c in map(cls.date, DATE_FORMATS) if c.fits(values)]
+            if len(dates) == 1:
+                return dates[0]
+        return cls(TEXT)
+
+    @classmethod
+    def date(cls, date_format: str) -> Column:
+        return cls(DATE, date_format)
+
+    def fits(self, values: t.Iterable[str]) -> bool:
+        try:
+            for value in values:
+                self.convert(value)
+        except ValueError:
+            return False
+        return True
+
+    def demote(self, value: str) -> Column:
+        """The column to use when value does not fit in this one."""
+        if self.type == INTEGER and Column(REAL).fits((value,)):
+            return Column(REAL)
+        return Column(TEXT)
+
+    def as_text(self, name: str) -> t.Optional[str]:
+        """The SQL that turns the values of the column we converted
+        back into the text of the CSV, for when the column is demoted
+        to TEXT, or None if sqlite keeps them as they were anyway.
+
+        :param name: The quoted name of the column.
+        """
+        if self.type == DATE and self.date_format:
+            return f"strftime('{self.date_format}', {name})"
+        # Numbers stay numbers, as the column keeps its affinity
+        return None
+
+    @staticmethod
+    def _integer(value: str) -> t.Optional[int]:
+        if not value or value.isspace():
+            return None
+        # Which python reads as a separator, or whose zeros int drops
+        if "_" in value or LEADING_ZERO.match(value):
+            raise ValueError(f"Not an integer: {value!r}")
+        try:
+            return int(value)
+        except ValueError:
+            if THOUSANDS.match(value) and "." not in value:
+                return int(value.replace(",", ""))
+            raise
+
+    @staticmethod
+    def _real(value: str) -> t.Optional[float]:
+        if not value or value.isspace():
+            return None
+        if LEADING_ZERO.match(value):
+            raise ValueError(f"Not a number: {value!r}")
+        try:
+            number = float(value)
+        except ValueError:
+            if THOUSANDS.match(value):
+                return float(value.replace(",", ""))
+            raise
+        # Like nan, inf, or 1_000, which are words or ids rather than numbers
+        if "_" in value or not math.isfinite(number):
+            raise ValueError(f"Not a number: {value!r}")
+        return number
+
+    @staticmethod
+    def _text(value: str) -> str:
+        return value
+
+    def _date(self, value: str) -> t.Optional[str]:
+        if not value or value.isspace():
+            return None
+        value = value.strip()
+        if self.date_format:
+            date = datetime.strptime(value, self.date_format)
+        else:
+            date = datetime.fromisoformat(value)
+        if date.hour or date.minute or date.second or ":" in value:
+            return date.isoformat(sep=" ")
+        return date.date().isoformat()
+
+    def __repr__(self):
+        return f"<Column {self.type} {self.date_format or ''}>"
+
+
+class Schema:
+    """The columns of a CSV."""
+
+    def __init__(self, columns: t.List[Column]):
+        self.columns = columns
+        self.demoted: t.Dict[int, Column] = {}
+        """The columns convert demoted, by their index, as they were
+        before, so the caller converts back the rows it already has
+        (see Column.as_text). The caller clears them.
+        """
+
+    @classmethod
+    def infer(cls, rows: Rows, num_cells: int) -> Schema:
+        """Infers the schema from a sample of rows."""
+        rows = [row for row in rows if len(row) == num_cells]
+        if not rows:
+            return cls([Column(TEXT) for _ in range(num_cells)])
+        return cls([Column.infer(values) for values in zip(*rows)])
+
+    @classmethod
+    def from_types(cls, types: t.Iterable[str]) -> Schema:
+        """The schema of a CSV whose dates are in ISO 8601, as when
+        we export a sheet.
+        """
+        return cls([Column(type) for type in types])
+
+    @property
+    def types(self) -> t.List[str]:
+        return [column.type for column in self.columns]
+
+    def convert(self, rows: Rows) -> Rows:
+        """Converts the values of the rows into the types of the columns,
+        demoting the columns where some value does not fit, in which
+        case all the rows are converted into the demoted types.
+        """
+        while True:
+            try:
+                converters = [column.convert for column in self.columns]
+                return [[c(v) for c, v in zip(converters, row)] for row in rows]
+            except ValueError:
+                # A column needs to be demoted so convert carefully
+                for row in rows:
+                    self._demote(row)
+
+    def _demote(self, row: Row):
+        """Demotes the columns until the values of the row fit."""
+        for i, value in enumerate(row):
+            while not self.columns[i].fits((value,)):
+                self.demoted.setdefault(i, self.columns[i])
+                column = self.columns[i] = self.columns[i].demote(value)
+                log.info("Column %s demoted to %s by %r", i, column.type, value)
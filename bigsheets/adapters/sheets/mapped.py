@@ -0,0 +1,150 @@
+"""Reads CSVs by memory-mapping the file.
+
+The records are split on the raw bytes of the map in blocks ending
+at a record boundary (see the count module). Each block is decoded
+once, and blocks without quotes are split with str.split instead
+of the csv module.
+"""
+from __future__ import annotations
+
+import csv
+import io
+import locale
+import logging
+import mmap
+import typing as t
+from itertools import islice
+from pathlib import Path
+
+from bigsheets.adapters.sheets import parallel
+from bigsheets.adapters.sheets.file import CSVFile, Row, Rows
+
+
+class MappedCSVFile(CSVFile):
+    """A CSV in the filesystem read through a memory map.
+
+    It behaves as CSVFile, but the file is not read for sniffing the
+    dialect, the header, and the sample rows: the first bytes of the
+    map are reused for all of them.
+    """
+
+    BLOCK = 2 ** 20
+    """The approx. bytes of the blocks the records are split in."""
+
+    def __init__(
+        self,
+        filepath: Path,
+        headers: t.Optional[t.List[str]] = None,
+        exact_count: bool = False,
+        range_size: int = CSVFile.RANGE_BYTES,
+    ):
+        self.path = filepath
+        self._encoding = locale.getpreferredencoding(False)  # As open() does
+        self._fp = filepath.open("rb")
+        self.map = mmap.mmap(self._fp.fileno(), 0, access=mmap.ACCESS_READ)
+        self.headers: t.List[str] = headers
+        self.exact_count = exact_count
+        self.range_size = range_size
+        self.compressed = None
+        self.header_row = False
+        """Whether the first row of the file is the header."""
+        self._scanner = None
+        self._estimate = None
+        self._position = 0
+        """The offset in the map up to where we split the records."""
+
+        sample = self.map[: self.BYTES_SAMPLE]
+        text = sample.decode(self.encoding, errors="ignore")
+        sniffer = csv.Sniffer()
+        self.dialect = sniffer.sniff(text.partition("\n")[0])
+        logging.info("File %s: dialect %s", self.name, vars(self.dialect))
+        sample_rows = csv.reader(io.StringIO(text, newline=""), self.dialect)
+        self.rows = list(islice(sample_rows, self.SAMPLE))
+        self.num_cells = len(self.rows[0])
+
+        # Compute column info
+        if not self.headers:
+            if sniffer.has_header(text[: self.KB_SAMPLE]):
+                self.headers = self.rows.pop(0)  # Remove first row when is header
+                self.header_row = True
+            else:
+                self.headers = tuple(f"C{i}" for i in range(self.num_cells))
+
+    def __iter__(self) -> t.Iterator[Row]:
+        first_row = True
+        for rows in self._blocks():
+            if first_row and rows and rows[0] == self.headers:
+                # Do not return the first row if it is a header
+                rows = rows[1:]
+            first_row = False
+            yield from rows
+
+    def _blocks(self) -> t.Iterator[Rows]:
+        if not parallel.can_split(self.dialect):
+            # We cannot find where records end, so parse it as a whole
+            with self.path.open(newline="") as f:
+                yield from ([row] for row in csv.reader(f, self.dialect))
+            return
+        quote = (self.dialect.quotechar or "").encode()
+        while self._position < len(self.map):
+            end = self._block_end(self._position, quote)
+            data = self.map[self._position : end]
+            self._position = end
+            yield self._split(data, quote)
+
+    def _block_end(self, start: int, quote: bytes) -> int:
+        """The offset where the block starting at start ends, which is
+        after a newline outside quotes or the end of the map.
+        """
+        end = min(start + self.BLOCK, len(self.map))
+        quotes = self.map[start:end].count(quote) if quote else 0
+        while end < len(self.map):
+            newline = self.map.find(b"\n", end)
+            if newline == -1:
+                break
+            if quote:
+                quotes += self.map[end:newline].count(quote)
+            end = newline + 1
+            if quotes % 2 == 0:
+                return end
+        return len(self.map)
+
+    def _split(self, data: bytes, quote: bytes) -> Rows:
+        text = data.decode(self.encoding)
+        if (quote and quote in data) or self.dialect.skipinitialspace or "\r" in text:
+            return list(csv.reader(io.StringIO(text, newline=""), self.dialect))
+        delimiter = self.dialect.delimiter
+        lines = text.split("\n")
+        if not lines[-1]:  # The block ends with a newline
+            lines.pop()
+        # As csv.reader, empty lines are empty rows
+        return [line.split(delimiter) if line else [] for line in lines]
+
+    def close(self):
+        self.map.close()
+        self._fp.close()
+
+    def __enter__(self) -> MappedCSVFile:
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def name(self):
+        return str(self.path)
+
+    @property
+    def filepath(self) -> Path:
+        return self.path
+
+    @property
+    def encoding(self) -> str:
+        return self._encoding
+
+    def _sample(self) -> bytes:
+        return self.map[: self.BYTES_SAMPLE]
+
+    @property
+    def position(self) -> int:
+        return self._position
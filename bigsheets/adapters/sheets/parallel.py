@@ -0,0 +1,113 @@
+"""Parses a CSV file in several processes.
+
+The file is split into byte ranges that start at the beginning of a
+record (see the count module), the ranges are parsed by a pool of
+processes, and the parsed rows are returned in the same order they
+are in the file, so a single writer can insert them.
+"""
+from __future__ import annotations
+
+import csv
+import io
+import logging
+import os
+import typing as t
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+
+from more_itertools import pairwise
+
+from bigsheets.adapters.sheets.file import Rows
+
+log = logging.getLogger(__name__)
+
+DIALECT_PARAMS = (
+    "delimiter",
+    "doublequote",
+    "escapechar",
+    "lineterminator",
+    "quotechar",
+    "quoting",
+    "skipinitialspace",
+    "strict",
+)
+
+
+def dialect_params(dialect: t.Type[csv.Dialect]) -> t.Dict[str, t.Any]:
+    """The parameters of the dialect as a dict, as the dialects
+    the sniffer creates cannot be pickled.
+    """
+    return {
+        param: getattr(dialect, param)
+        for param in DIALECT_PARAMS
+        if hasattr(dialect, param)
+    }
+
+
+def can_split(dialect: t.Type[csv.Dialect]) -> bool:
+    """Whether we can find the boundaries of records with dialect.
+
+    We find them counting quotes (see the count module), which does
+    not work when quotes are escaped.
+    """
+    return not dialect.escapechar
+
+
+def parse_range(
+    filepath: Path, start: int, end: int, encoding: str, dialect: t.Dict[str, t.Any]
+) -> Rows:
+    """Parses the rows between the start and end offsets of the file."""
+    with filepath.open("rb") as fp:
+        fp.seek(start)
+        data = fp.read(end - start)
+    return list(csv.reader(io.TextIOWrapper(io.BytesIO(data), encoding), **dialect))
+
+
+def parse(
+    filepath: Path,
+    boundaries: t.Sequence[int],
+    encoding: str,
+    dialect: t.Type[csv.Dialect],
+    headers: t.Sequence[str],
+    workers: t.Optional[int] = None,
+) -> t.Iterator[Rows]:
+    """Parses the file in a pool of processes, yielding the rows
+    of each range in order.
+
+    The header row, if any, is not yielded.
+
+    :param boundaries: The offsets where the ranges start, plus the
+    offset of the end of the file.
+    """
+    ranges = tuple(pairwise(boundaries))
+    workers = workers or os.cpu_count()
+    log.info(
+        "File %s: parsing %s ranges in %s processes", filepath, len(ranges), workers
+    )
+    params = dialect_params(dialect)
+    pending: t.Deque[Future] = deque()
+    with ProcessPoolExecutor(workers) as pool:
+        try:
+            first = True
+            for start, end in ranges:
+                pending.append(
+                    pool.submit(parse_range, filepath, start, end, encoding, params)
+                )
+                # Only keep a couple of ranges per worker in memory
+                if len(pending) >= workers * 2:
+                    yield _without_header(pending.popleft().result(), headers, first)
+                    first = False
+            while pending:
+                yield _without_header(pending.popleft().result(), headers, first)
+                first = False
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def _without_header(rows: Rows, headers: t.Sequence[str], first: bool) -> Rows:
+    # As CSVFile.__iter__, do not return the first row if it is a header
+    if first and rows and rows[0] == headers:
+        return rows[1:]
+    return rows
@@ -0,0 +1,143 @@
+"""Reuses the connections to the database of the sheets, so a unit
+of work does not pay for connecting: attaching the databases, and
+warming the cache of statements and the parsed schema.
+"""
+from __future__ import annotations
+
+import logging
+import sqlite3
+import threading
+import time
+import typing as t
+from dataclasses import asdict, dataclass
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class Metrics:
+    checkouts: int = 0
+    connections: int = 0
+    """The connections we opened."""
+    waits: int = 0
+    """The checkouts that waited for a connection to be returned."""
+    wait_seconds: float = 0.0
+    max_wait_seconds: float = 0.0
+    overflows: int = 0
+    """The checkouts that opened a connection over the size of the
+    pool, as none was returned in time.
+    """
+
+
+class Pool:
+    """Connections that are checked out and returned, up to size
+    connections.
+
+    When all the connections are checked out, a checkout waits up to
+    timeout seconds for one to be returned, and then opens one over
+    the size, which is closed when returned. This way a unit of work
+    that needs another one meanwhile does not block forever.
+    """
+
+    def __init__(
+        self,
+        connect: t.Callable[[], sqlite3.Connection],
+        reset: t.Callable[[sqlite3.Connection], None],
+        size: int,
+        timeout: float,
+    ):
+        """
+        :param connect: Opens and sets up a connection.
+        :param reset: Leaves a returned connection as a new one,
+        raising sqlite3.Error if it cannot.
+        """
+        self.connect = connect
+        self.reset = reset
+        self.size = size
+        self.timeout = timeout
+        self.metrics = Metrics()
+        self._idle: t.List[sqlite3.Connection] = []
+        """The returned connections, the last one returned the last,
+        as it is the one with the warmest caches.
+        """
+        self._open = 0
+        self._returned = threading.Condition()
+
+    def get(self) -> sqlite3.Connection:
+        start = time.monotonic()
+        with self._returned:
+            self.metrics.checkouts += 1
+            waited = self._wait(start)
+            if self._idle:
+                return self._idle.pop()
+            self._open += 1
+            self.metrics.connections += 1
+            if self._open > self.size:
+                self.metrics.overflows += 1
+                log.warning(
+                    "Opening connection %s over the pool of %s after waiting %.2fs",
+                    self._open,
+                    self.size,
+                    waited,
+                )
+        try:
+            return self.connect()
+        except BaseException:
+            self._discard()
+            raise
+
+    def put(self, session: sqlite3.Connection):
+        try:
+            self.reset(session)
+        except sqlite3.Error:
+            log.warning("Closing a connection we could not reset", exc_info=True)
+            sqlite3.Connection.close(session)
+            self._discard()
+            return
+        with self._returned:
+            if self._open > self.size:  # Opened over the size
+                sqlite3.Connection.close(session)
+                self._open -= 1
+            else:
+                self._idle.append(session)
+            self._returned.notify()
+
+    def sweep(self, fn: t.Callable[[sqlite3.Connection], None]):
+        """Passes the idle connections to fn, which does not wait
+        for them to be checked out, closing the ones fn fails with.
+        """
+        with self._returned:
+            for session in list(self._idle):
+                try:
+                    fn(session)
+                except sqlite3.Error:
+                    log.warning("Closing a connection we could not sweep", exc_info=True)
+                    self._idle.remove(session)
+                    sqlite3.Connection.close(session)
+                    self._open -= 1
+
+    def stats(self) -> dict:
+        """The metrics, and the connections opened and idle."""
+        with self._returned:
+            return {**asdict(self.metrics), "open": self._open, "idle": len(self._idle)}
+
+    def _wait(self, start: float) -> float:
+        """Waits for a returned connection, if we cannot open one,
+        returning the seconds waited.
+        """
+        if self._idle or self._open < self.size:
+            return 0
+        deadline = start + self.timeout
+        while not self._idle and (remaining := deadline - time.monotonic()) > 0:
+            self._returned.wait(remaining)
+        waited = time.monotonic() - start
+        self.metrics.waits += 1
+        self.metrics.wait_seconds += waited
+        self.metrics.max_wait_seconds = max(self.metrics.max_wait_seconds, waited)
+        log.debug("Waited %.3fs for a connection", waited)
+        return waited
+
+    def _discard(self):
+        with self._returned:
+            self._open -= 1
+            self._returned.notify()
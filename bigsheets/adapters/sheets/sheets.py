@@ -5,36 +5,138 @@ import csv
 import io
 import json
 import logging
+import os
 import sqlite3
+import threading
+import time
 import typing as t
 import zipfile
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager, suppress
+from dataclasses import dataclass
 from itertools import chain
 from pathlib import Path
 
 import more_itertools
 import zipstream
 
+from bigsheets.adapters.sheets import (
+    batch,
+    cache,
+    compression,
+    count,
+    indexes,
+    inference,
+    parallel,
+    pool,
+    stats,
+    storage,
+)
 from bigsheets.adapters.sheets.file import CSVFile
+from bigsheets.adapters.sheets.mapped import MappedCSVFile
 from bigsheets.domain import error as error_model, sheet as sheet_model
 from bigsheets.service import running
 
 
+class Session(sqlite3.Connection):
+    """A connection to the database of the sheets."""
+
+    catalog: t.Optional[storage.Catalog] = None
+    """The databases of the sheets, which the connection attaches."""
+    pool: t.Optional[pool.Pool] = None
+    """The pool the connection returns to when closed."""
+
+    def close(self):
+        if self.pool:
+            self.pool.put(self)
+        else:
+            super().close()
+
+
 class EngineFactory:
-    """Returns the db engine upon call."""
+    """Returns the db engine upon call.
 
-    def __init__(self, uri="file:db?mode=memory&cache=shared"):
+    The engines are connections checked out of a pool, which return
+    to it when closed, so units of work reuse them.
+    """
+
+    POOL_SIZE = 16
+    """The connections the pool keeps. Each thread of the message
+    bus and of the sheets being opened takes one at a time.
+    """
+    POOL_TIMEOUT = 5
+    """The seconds a checkout waits for a connection before opening
+    one over the size of the pool.
+    """
+    CACHED_STATEMENTS = 512
+    """The prepared statements each connection caches, more than
+    the default of 128 as a connection now lives long.
+    """
+    PRAGMAS = {
+        # Sorting and grouping big sheets in parallel
+        "threads": 4,
+    }
+    """Set once per connection."""
+
+    def __init__(
+        self,
+        uri="file:db?mode=memory&cache=shared",
+        disk: bool = True,
+        catalog: bool = True,
+    ):
+        """
+        :param disk: Whether to attach a temporary database in the disk
+        to store the sheets that do not fit in memory (see the storage
+        module).
+        :param catalog: Whether to store each sheet in its own database,
+        or all of them in the database of the uri.
+        """
         self.uri = uri
+        self.disk = storage.Disk() if disk else None
+        self.catalog = storage.Catalog() if catalog else None
+        self.pool = pool.Pool(
+            self._connect, self._reset, self.POOL_SIZE, self.POOL_TIMEOUT
+        )
         self._keep_alive = None
         """Keeps the database alive by keeping a live connection to it."""
 
     def __call__(self) -> sqlite3.Connection:
         if not self._keep_alive:
-            self._keep_alive = self._connect(self.uri)
-        return self._connect(self.uri)
+            self._keep_alive = sqlite3.connect(self.uri, uri=True)
+        session = self.pool.get()
+        if self.catalog:
+            self.catalog.sync(session)
+        return session
+
+    def metrics(self) -> dict:
+        """The checkouts, the time they waited, and the size of the pool."""
+        return self.pool.stats()
+
+    def _connect(self) -> Session:
+        session = sqlite3.connect(
+            self.uri,
+            uri=True,
+            factory=Session,
+            cached_statements=self.CACHED_STATEMENTS,
+            # A connection is used by one unit of work at a time, but
+            # the next one can be in another thread
+            check_same_thread=False,
+        )
+        for pragma, value in self.PRAGMAS.items():
+            session.execute(f"PRAGMA {pragma}={value}")
+        if self.disk:
+            self.disk.attach(session)
+        session.catalog = self.catalog
+        session.pool = self.pool
+        return session
 
     @staticmethod
-    def _connect(uri):
-        return sqlite3.connect(uri, uri=True)
+    def _reset(session: Session):
+        """Leaves the session as a new one for the next unit of work."""
+        session.set_progress_handler(None, 0)
+        if session.in_transaction:
+            session.rollback()
+        session.execute("PRAGMA read_uncommitted = 0")
 
 
 engine_factory = EngineFactory()
@@ -57,6 +159,143 @@ class UpdateHandler:
     def on_it(self, n: int):
         self.total += n
 
+    def on_estimate(self, total: int):
+        """The estimation of the total number of iterations changed."""
+        pass
+
+
+class SheetRegistry:
+    """The opened sheets models, safe to use from several threads.
+
+    It names the new sheets too, so sheets opening at the same time
+    get different names.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sheets: t.Dict[str, sheet_model.Sheet] = {}
+        self._reserved: t.Set[str] = set()
+        """The names given to sheets that have not finished opening."""
+
+    def new_name(self, taken: t.Collection[str] = ()) -> str:
+        """Reserves and returns the first free name for a sheet.
+
+        :param taken: Other names in use, like the tables in the db.
+        """
+        with self._lock:
+            i = 0
+            while (name := sheet_model.new_sheet_name(i)) in taken or (
+                name in self._reserved
+            ):
+                i += 1
+            self._reserved.add(name)
+            return name
+
+    def opening(self, name: str) -> bool:
+        """Whether the sheet is still opening."""
+        with self._lock:
+            return name in self._reserved
+
+    def release(self, name: str):
+        """Frees a name from new_name once its table exists, or if
+        opening the sheet failed.
+        """
+        with self._lock:
+            self._reserved.discard(name)
+
+    def add(self, sheet: sheet_model.Sheet):
+        with self._lock:
+            self._sheets[sheet.name] = sheet
+
+    def remove(self, sheet: sheet_model.Sheet):
+        with self._lock:
+            del self._sheets[sheet.name]
+
+    def get(self, name: str) -> sheet_model.Sheet:
+        with self._lock:
+            return self._sheets[name]
+
+    def clear(self):
+        with self._lock:
+            self._sheets.clear()
+
+    def __iter__(self) -> t.Iterator[sheet_model.Sheet]:
+        with self._lock:  # Iterate a copy so others can change the registry
+            return iter(tuple(self._sheets.values()))
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sheets)
+
+
+class Writer:
+    """Serializes the writes to each database, as sqlite only allows
+    one connection to write at a time, so several sheets can load at
+    the same time interleaving their writes.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        """The lock of the memory and disk databases, which also
+        serializes creating the tables of the sheets in them.
+        """
+        self._locks: t.Dict[str, threading.RLock] = {}
+        self._bulk_loads: t.Dict[str, int] = defaultdict(int)
+        self._previous: t.Dict[str, t.Dict[str, t.Union[str, int]]] = {}
+
+    def lock_of(self, database: str) -> threading.RLock:
+        """The lock of the writes to the database.
+
+        Sheets stored in their own database have their own lock,
+        so they load in parallel.
+        """
+        if database in (storage.MEMORY, storage.DISK):
+            return self.lock
+        return self._locks.setdefault(database, threading.RLock())
+
+    @contextmanager
+    def bulk_loading(
+        self,
+        session: sqlite3.Connection,
+        pragmas: t.Dict[str, t.Union[str, int]],
+        database: str = storage.MEMORY,
+    ):
+        """Sets the pragmas of the database while executing the block.
+
+        The pragmas are restored by the last bulk load of the database
+        to finish, as several sheets can load in the same database.
+        """
+        with self.lock_of(database):
+            if not self._bulk_loads[database]:
+                self._previous[database] = {
+                    pragma: session.execute(f"PRAGMA {pragma}").fetchone()[0]
+                    for pragma in _qualify(pragmas, database)
+                }
+            self._bulk_loads[database] += 1
+            _set_pragmas(session, _qualify(pragmas, database))
+        try:
+            yield
+        finally:
+            with self.lock_of(database):
+                self._bulk_loads[database] -= 1
+                if not self._bulk_loads[database]:
+                    _set_pragmas(session, self._previous.pop(database))
+
+
+@dataclass
+class Source:
+    """The file of a sheet, and up to where we loaded it, to load
+    the rows appended to the file afterwards.
+    """
+
+    filepath: Path
+    offset: int
+    """The bytes of the file loaded."""
+    dialect: t.Dict[str, t.Any]
+    """The params for csv.reader."""
+    encoding: str
+    schema: t.Optional[inference.Schema]
+
 
 class Sheets(abc.ABC):
     """The repository of sheets as part of the infrastructure layer.
@@ -70,7 +309,7 @@ class Sheets(abc.ABC):
     @abc.abstractmethod
     def open_sheet(
         self, filepath: Path, update_handler: UpdateHandler = UpdateHandler(),
-    ) -> t.Tuple[sheet_model.Sheet, t.List[error_model.WrongRow]]:
+    ) -> t.Tuple[sheet_model.Sheet, error_model.WrongRows]:
         raise NotImplementedError
 
     @abc.abstractmethod
@@ -82,6 +321,59 @@ class Sheets(abc.ABC):
         """Removes a sheet (ie. closes)."""
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def follow(self, *, name: str, follow: bool = True) -> sheet_model.Sheet:
+        """Sets whether the sheet is followed, failing with ValueError
+        if the sheet cannot be followed.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def load_appended_rows(
+        self, *, name: str
+    ) -> t.Tuple[sheet_model.Sheet, int, bool, error_model.WrongRows]:
+        """Loads the rows appended to the file of the sheet since
+        we last loaded it, loading the whole file again if the
+        file was truncated.
+
+        Returns the sheet, the number of rows loaded, whether the
+        file was loaded again, and the wrong rows.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def clear_import_cache(self):
+        """Removes the sheets cached when opening files."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def advise_indexes(self, q: str) -> t.List[sheet_model.Sheet]:
+        """Learns from a query the user ran, indexing the columns of the
+        sheets that the queries scan repeatedly.
+
+        Returns the sheets that got an index.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def drop_index(self, *, name: str, column: str) -> sheet_model.Sheet:
+        """Removes the index of the column of the sheet."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def derive_sheet(self, query: str) -> sheet_model.Sheet:
+        """Stores the results of the query as a new sheet, failing
+        with sqlite3.Error if the query is wrong.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def refresh_sheet(self, *, name: str) -> sheet_model.Sheet:
+        """Stores again the results of the query of a derived sheet,
+        failing with ValueError if the sheet is not derived.
+        """
+        raise NotImplementedError
+
     @abc.abstractmethod
     def get(self) -> t.Iterator[sheet_model.Sheet]:
         """Gets all the sheets."""
@@ -118,59 +410,569 @@ class SheetsAdaptor(Sheets):
     SQLITE_VAR_LIMIT = 999
     """Max number of variables in queries for sqlite."""
 
-    sheets: t.Set[sheet_model.Sheet] = set()
+    bulk_load = True
+    """Whether to insert the rows of a CSV through a single prepared
+    statement in one transaction, or in chunks of multi-row inserts.
+    """
+    BULK_ROWS_PER_CHUNK = 10_000
+    """Rows inserted per call when bulk loading, or in the first call
+    when tuning the batches.
+    """
+    tune_batches = True
+    """Whether to tune the rows inserted per call by the throughput
+    we measure (see the batch module), or always insert
+    BULK_ROWS_PER_CHUNK when bulk loading, and rows_per_chunk when not.
+    """
+    BATCH_TUNING_RATIO = 20
+    """The batches are tuned from their initial size divided by this
+    up to, when bulk loading, their initial size multiplied by this.
+    """
+    PROGRESS_INTERVAL = 0.2
+    """The seconds between reporting the rows loaded of a sheet."""
+    BULK_LOAD_PRAGMAS = {
+        "journal_mode": "OFF",
+        "synchronous": "OFF",
+        "cache_size": -256_000,  # In KiB
+    }
+    """Pragmas set when bulk loading, and restored after."""
+    progressive_load = True
+    """Whether to commit after each chunk when bulk loading, so the
+    rows loaded so far can be queried while the sheet is opening.
+
+    Connections reading a sheet that is opening need to read
+    uncommitted data, as otherwise they lock the table, making
+    the load fail.
+    """
+
+    parallel_parse = True
+    """Whether to parse big CSV files in several processes."""
+    PARALLEL_MIN_BYTES = 64 * 2 ** 20
+    """Files smaller than this are parsed in the current process."""
+    PARALLEL_RANGE_BYTES = 8 * 2 ** 20
+    """The approx. size of the parts of a file each process parses."""
+    PARALLEL_WORKERS = os.cpu_count() or 1
+    """The number of processes parsing, when parsing in parallel."""
+    APPENDED_BYTES = 8 * 2 ** 20
+    """The bytes of the rows appended to a followed file that we load
+    at a time.
+    """
+
+    memory_map = False
+    """Whether to read uncompressed CSVs through a memory map
+    (see the mapped module) instead of through a text file.
+    """
+
+    infer_types = True
+    """Whether to infer the types of the columns of a CSV and store
+    its values in such types, or let sqlite guess the type of each value.
+    """
+
+    profile_columns = True
+    """Whether to collect the statistics of the columns while loading
+    their rows (see the stats module).
+    """
+
+    EXACT_ROW_COUNT = False
+    """Whether to count the rows of a CSV reading the whole file
+    before loading it, or to estimate them. Files parsed in parallel
+    always have an exact count, as we read them anyway to split them.
+    """
+    ESTIMATE_TOLERANCE = 0.01
+    """Only update the estimated number of rows of a sheet that is
+    opening when it changes more than this ratio.
+    """
+
+    import_cache: t.Optional[cache.ImportCache] = cache.ImportCache(
+        cache.directory(), cache.budget()
+    )
+    """Where to store the sheets we open, so opening again a file
+    that did not change copies the stored table instead of parsing
+    the file. None to not cache the sheets.
+    """
+    CACHE_ROWS_PER_CHUNK = 100_000
+    """Rows copied per statement from and to the import cache."""
+
+    MEMORY_BUDGET = storage.memory_budget()
+    """The max bytes of the sheets in memory. The sheets that would
+    exceed it are stored in the disk, if the engine has a disk
+    database (see EngineFactory).
+    """
+
+    index_advisor: t.Optional[indexes.Advisor] = indexes.Advisor()
+    """Indexes the columns the queries of the user scan repeatedly.
+    None to not index the sheets.
+    """
+    INDEX_BUDGET = indexes.budget()
+    """The max bytes of the indexes of all the sheets."""
+
+    sheets = SheetRegistry()
     """The opened sheets models."""
-    # todo use a thread-safe structure and testing
-    #   And probably this could be taken into its own class
+    writer = Writer()
+    """Serializes the writes of the SheetsAdaptors, so sheets can
+    load at the same time. Loads only interleave their writes when
+    progressively bulk loading, as otherwise each load is a single
+    transaction.
+    """
 
-    session: sqlite3.Connection
+    session: Session
 
     def open_sheet(
         self, filepath: Path, update_handler: UpdateHandler = UpdateHandler()
-    ) -> t.Tuple[sheet_model.Sheet, t.List[error_model.WrongRow]]:
-        with filepath.open() as f:
-            file = CSVFile(f)
-            table_name = sheet_model.new_sheet_name(self.number_of_sheets())
-            sheet = sheet_model.Sheet(
-                table_name,
-                rows=file.rows,
-                header=file.headers,
-                num_rows=file.num_lines,
-                filename=file.name,
-            )
-            self.sheets.add(sheet)
-            update_handler.on_init(sheet)
-            wrong_rows = []
-            for wrongs in self._process_spreadsheet(file, table_name):
-                running.exit_if_asked()
-                wrong_rows.extend(
-                    error_model.WrongRow(sheet.filename, sheet.name, wrong)
-                    for wrong in wrongs
+    ) -> t.Tuple[sheet_model.Sheet, error_model.WrongRows]:
+        if not self.import_cache:
+            return self._import(filepath, update_handler)
+        fingerprint = self.import_cache.fingerprint(filepath)
+        if cached := self.import_cache.get(fingerprint):
+            try:
+                return self._open_cached(filepath, cached, update_handler)
+            except sqlite3.DatabaseError:
+                logging.warning("Cached %s is broken", cached, exc_info=True)
+                self.import_cache.discard(fingerprint)
+        sheet, wrong_rows = self._import(filepath, update_handler)
+        try:
+            self._store_in_cache(fingerprint, sheet, wrong_rows)
+        except (OSError, sqlite3.Error):
+            logging.warning("Could not cache %s", filepath, exc_info=True)
+        return sheet, wrong_rows
+
+    def _import(
+        self, filepath: Path, update_handler: UpdateHandler
+    ) -> t.Tuple[sheet_model.Sheet, error_model.WrongRows]:
+        """Opens the sheet parsing the file."""
+        with self._open_csv(filepath) as file:
+            with self.writer.lock:  # No table is created while we name it
+                table_name = self.sheets.new_name(self._table_names())
+            try:
+                schema = None
+                if self.infer_types:
+                    schema = inference.Schema.infer(file.rows, file.num_cells)
+                sheet = sheet_model.Sheet(
+                    table_name,
+                    rows=file.rows,
+                    header=file.headers,
+                    num_rows=file.num_lines,
+                    filename=file.name,
+                    types=schema.types if schema else None,
+                )
+                database = self._place(
+                    sheet, storage.estimate(file.rows, file.num_lines)
                 )
-                new_rows = self.rows_per_chunk(file.num_cells)
-                update_handler.on_it(new_rows)
+                if self.profile_columns:
+                    sheet.stats = stats.Profile(sheet.header)
+                self.sheets.add(sheet)
+                update_handler.on_init(sheet)
+                wrong_rows = error_model.WrongRows(sheet.filename, sheet.name)
+                progress = batch.Progress(update_handler.on_it, self.PROGRESS_INTERVAL)
+                parsed = 0
+                for wrongs, processed in self._process_spreadsheet(
+                    file, f"{database}.{table_name}", schema, sheet.stats
+                ):
+                    running.exit_if_asked()
+                    for i, wrong in wrongs:
+                        wrong_rows.add(parsed + i + 1, wrong)
+                    progress.add(processed)
+                    parsed += processed
+                    num_rows = file.update_num_lines(parsed)
+                    self._update_num_rows(sheet, num_rows, update_handler)
+                progress.flush()
+                sheet.num_rows = parsed
+                self._measure(sheet, database)
+                self._analyze(sheet, database)
+                if schema:  # Some columns might have been demoted when loading
+                    sheet.types = schema.types
+                if file.filepath:  # We can read the rows appended to it
+                    sheet.source = Source(
+                        file.filepath,
+                        file.scan().size if self._parallel(file) else file.position,
+                        parallel.dialect_params(file.dialect),
+                        file.encoding,
+                        schema,
+                    )
+            except BaseException:
+                with suppress(KeyError):
+                    self.sheets.remove(self.sheets.get(table_name))
+                self._drop(table_name)
+                raise
+            finally:
+                self.sheets.release(table_name)
         return sheet, wrong_rows
 
+    def _open_cached(
+        self, filepath: Path, cached: Path, update_handler: UpdateHandler
+    ) -> t.Tuple[sheet_model.Sheet, error_model.WrongRows]:
+        """Opens the sheet copying its table from the import cache."""
+        with self.writer.lock:  # No table is created while we name it
+            table_name = self.sheets.new_name(self._table_names())
+        try:
+            with self._attached(cached, "cached"):
+                q = "SELECT info FROM cached.bigsheets"
+                info = json.loads(self.session.execute(q).fetchone()[0])
+                sheet = sheet_model.Sheet(
+                    table_name,
+                    rows=info["rows"],
+                    header=info["header"],
+                    num_rows=info["num_rows"],
+                    filename=info["filename"],
+                    types=info["types"],
+                )
+                if self.profile_columns and info.get("stats"):
+                    sheet.stats = stats.Profile.from_json(info["stats"])
+                database = self._place(sheet, cached.stat().st_size)
+                self.sheets.add(sheet)
+                update_handler.on_init(sheet)
+                with self.writer.lock_of(database):
+                    q = self._create_table_q(
+                        f"{database}.{table_name}", sheet.header, sheet.types
+                    )
+                    self.session.execute(q)
+                    self.session.commit()
+                self._copy("cached.sheet", table_name, database, update_handler)
+                self._measure(sheet, database)
+                self._analyze(sheet, database)
+        except BaseException:
+            with suppress(KeyError):
+                self.sheets.remove(self.sheets.get(table_name))
+            self._drop(table_name)
+            raise
+        finally:
+            self.sheets.release(table_name)
+        if source := info["source"]:
+            schema = None
+            if source["columns"]:
+                schema = inference.Schema(
+                    [inference.Column(*column) for column in source["columns"]]
+                )
+            sheet.source = Source(
+                filepath,
+                source["offset"],
+                source["dialect"],
+                source["encoding"],
+                schema,
+            )
+        wrong_rows = error_model.WrongRows(sheet.filename, sheet.name)
+        wrong_rows.numbers.extend(info["wrong_rows"]["numbers"])
+        wrong_rows.cells.extend(info["wrong_rows"]["cells"])
+        wrong_rows.samples = info["wrong_rows"]["samples"]
+        return sheet, wrong_rows
+
+    def _store_in_cache(
+        self,
+        fingerprint: str,
+        sheet: sheet_model.Sheet,
+        wrong_rows: error_model.WrongRows,
+    ):
+        source: t.Optional[Source] = sheet.source
+        info = {
+            **self._export_sheet(sheet),
+            "source": source
+            and {
+                "offset": source.offset,
+                "dialect": source.dialect,
+                "encoding": source.encoding,
+                "columns": source.schema
+                and [[c.type, c.date_format] for c in source.schema.columns],
+            },
+            "stats": sheet.stats and sheet.stats.to_json(),
+            "wrong_rows": {
+                "numbers": wrong_rows.numbers.tolist(),
+                "cells": wrong_rows.cells.tolist(),
+                "samples": wrong_rows.samples,
+            },
+        }
+        with self.import_cache.storing(fingerprint) as path:
+            with self._attached(path, "cached"):
+                # The database is discarded if we fail, so we do not need a journal
+                pragmas = {"cached.journal_mode": "OFF", "cached.synchronous": "OFF"}
+                _set_pragmas(self.session, pragmas)
+                with self.writer.lock:
+                    q = self._create_table_q("cached.sheet", sheet.header, sheet.types)
+                    self.session.execute(q)
+                    self.session.execute("CREATE TABLE cached.bigsheets (info TEXT)")
+                    q = "INSERT INTO cached.bigsheets VALUES (?)"
+                    self.session.execute(q, (json.dumps(info),))
+                    self.session.commit()
+                self._copy(sheet.name, "cached.sheet", self._database(sheet))
+
+    @contextmanager
+    def _attached(self, path: Path, schema: str):
+        """Attaches the database in path with the schema name while
+        executing the block.
+        """
+        with self.writer.lock:  # Sqlite cannot attach inside a transaction
+            if self.session.in_transaction:
+                self.session.commit()
+            self.session.execute(f"ATTACH DATABASE ? AS {schema}", (str(path),))
+        try:
+            yield
+        finally:
+            with self.writer.lock:
+                if self.session.in_transaction:
+                    self.session.rollback()
+                self.session.execute(f"DETACH DATABASE {schema}")
+
+    def _copy(
+        self,
+        source: str,
+        target: str,
+        database: str,
+        update_handler: UpdateHandler = UpdateHandler(),
+    ):
+        """Copies the rows of the source table into the target one,
+        locking the database of the sheet.
+
+        The rows are copied in chunks, each in its transaction,
+        so the writes of other sheets can go in-between.
+        """
+        q = f"SELECT max(rowid) FROM {source}"
+        last = self.session.execute(q).fetchone()[0] or 0
+        q = f"INSERT INTO {target} SELECT * FROM {source} "
+        q += " WHERE rowid > ? AND rowid <= ?"
+        chunk = self.CACHE_ROWS_PER_CHUNK
+        for start in range(0, last, chunk):
+            running.exit_if_asked()
+            with self.writer.lock_of(database):
+                cursor = self.session.execute(q, (start, start + chunk))
+                self.session.commit()
+            update_handler.on_it(cursor.rowcount)
+
+    @contextmanager
+    def _open_csv(self, filepath: Path) -> t.Iterator[CSVFile]:
+        if self.memory_map and not compression.is_compressed(filepath):
+            with MappedCSVFile(
+                filepath,
+                exact_count=self.EXACT_ROW_COUNT,
+                range_size=self.PARALLEL_RANGE_BYTES,
+            ) as file:
+                yield file
+        else:
+            with compression.open_text(filepath) as (f, compressed):
+                yield CSVFile(
+                    f,
+                    exact_count=self.EXACT_ROW_COUNT,
+                    range_size=self.PARALLEL_RANGE_BYTES,
+                    compressed=compressed,
+                )
+
+    def _place(self, sheet: sheet_model.Sheet, footprint: int) -> str:
+        """Sets where to store the new sheet, which takes approx.
+        footprint bytes, returning the name of the database.
+
+        The sheet gets its own database if the catalog has a free slot.
+        """
+        in_memory = sum(s.footprint for s in self.sheets if not s.on_disk)
+        sheet.footprint = footprint
+        over_budget = in_memory + footprint > self.MEMORY_BUDGET
+        if over_budget:
+            logging.info(
+                "%s of ~%s bytes exceeds the memory budget; storing it in the disk",
+                sheet,
+                footprint,
+            )
+        if self.catalog and self.catalog.create(sheet.name, over_budget):
+            sheet.on_disk = over_budget
+            with self.writer.lock:  # Sqlite cannot attach inside a transaction
+                if self.session.in_transaction:
+                    self.session.commit()
+                self.catalog.sync(self.session)
+            return sheet.name
+        sheet.on_disk = over_budget and storage.DISK in self._databases()
+        return storage.DISK if sheet.on_disk else storage.MEMORY
+
+    def _database(self, sheet: sheet_model.Sheet) -> str:
+        """The name of the database storing the sheet."""
+        if self.catalog and sheet.name in self.catalog:
+            return sheet.name
+        return storage.DISK if sheet.on_disk else storage.MEMORY
+
+    def _drop(self, name: str):
+        """Removes the table of the sheet, and its database if it has one."""
+        if self.catalog and name in self.catalog:
+            with self.writer.lock_of(name):
+                if self.session.in_transaction:
+                    self.session.rollback()
+                self.catalog.detach(self.session, name)
+            self.catalog.remove(name)
+            if pool_ := getattr(self.session, "pool", None):
+                # Idle connections would keep the database alive
+                pool_.sweep(self.catalog.sync)
+        else:
+            with self.writer.lock:
+                if self.session.in_transaction:
+                    self.session.rollback()
+                self.session.execute(f"DROP TABLE IF EXISTS {name}")
+                self.session.commit()
+
+    @property
+    def catalog(self) -> t.Optional[storage.Catalog]:
+        return getattr(self.session, "catalog", None)
+
+    def _analyze(self, sheet: sheet_model.Sheet, database: str):
+        """Tells the query planner the rows of the sheet and the values
+        of its indexed columns from the statistics of the sheet.
+        """
+        if not sheet.stats:
+            return
+        with self.writer.lock_of(database):
+            stats.analyze(self.session, database, sheet.name, str(sheet.stats.rows))
+            for column in sheet.indexes:
+                index = indexes.name(sheet.name, column)
+                stat = stats.index_stat(sheet.stats.get(column))
+                stats.analyze(self.session, database, sheet.name, stat, index)
+            self.session.commit()
+
+    def _measure(self, sheet: sheet_model.Sheet, database: str):
+        """Sets the footprint of the loaded sheet.
+
+        Only the sheets in memory are measured, as measuring reads all
+        the pages of the table. The others keep an estimate.
+        """
+        footprint = None
+        if not sheet.on_disk:
+            with self.writer.lock_of(database):  # Reading the schema locks it
+                footprint = storage.footprint(self.session, database, sheet.name)
+        if footprint is None:
+            footprint = storage.estimate(sheet.rows, sheet.num_rows)
+        sheet.footprint = footprint
+
+    def _databases(self) -> t.List[str]:
+        return storage.databases(self.session)
+
+    def _update_num_rows(
+        self,
+        sheet: sheet_model.Sheet,
+        num_rows: t.Optional[int],
+        update_handler: UpdateHandler,
+    ):
+        if num_rows is None:
+            return
+        # Only notify significant changes
+        if abs(num_rows - sheet.num_rows) > sheet.num_rows * self.ESTIMATE_TOLERANCE:
+            sheet.num_rows = num_rows
+            update_handler.on_estimate(num_rows)
+
     def number_of_sheets(self) -> int:
-        return more_itertools.ilen(
-            self.session.execute("SELECT name FROM sqlite_master WHERE type='table'")
-        )
+        return len(self._table_names())
+
+    def _table_names(self) -> t.Set[str]:
+        databases = {storage.MEMORY, storage.DISK} & set(self._databases())
+        q = "SELECT name FROM {}.sqlite_master WHERE type='table'"
+        q += " AND name NOT LIKE 'sqlite_%'"  # Like sqlite_stat1
+        return {
+            name
+            for database in databases
+            for name, in self.session.execute(q.format(database))
+        }.union(self.catalog or ())
 
-    def _create_table_q(self, table_name, headers: sheet_model.Row):
-        cols = (f"'{name}' NUMERIC" for name in headers)
+    def _create_table_q(
+        self,
+        table_name,
+        headers: sheet_model.Row,
+        types: t.Optional[t.Collection[str]] = None,
+    ):
+        types = types or ("NUMERIC" for _ in headers)
+        cols = (f"'{name}' {type}" for name, type in zip(headers, types))
         return f"CREATE TABLE {table_name} ({','.join(cols)})"
 
-    def _process_spreadsheet(self, f: CSVFile, table_name):
-        # create table
-        self.session.execute(self._create_table_q(table_name, f.headers))
+    def _process_spreadsheet(
+        self,
+        f: CSVFile,
+        table_name,
+        schema: t.Optional[inference.Schema] = None,
+        profile: t.Optional[stats.Profile] = None,
+    ):
+        """Creates the table and inserts the rows of the CSV in it,
+        converting the values to the types of the schema, if passed-in,
+        and adding them to the profile, if passed-in.
+
+        Yields per chunk a tuple with the wrong rows of the chunk, as
+        tuples of their index in the chunk and the row, and the number
+        of rows the chunk had.
+        """
+        q = self._create_table_q(table_name, f.headers, schema and schema.types)
+        if self.bulk_load:
+            with self._bulk_load_transaction(table_name):
+                with self._writing(_database_of(table_name)):
+                    self.session.execute(q)
+                yield from self._bulk_insert(f, table_name, schema, profile)
+        else:
+            self.session.execute(q)
+            yield from self._chunked_insert(f, table_name, schema, profile)
+
+    def _bulk_insert(
+        self,
+        f: CSVFile,
+        table_name,
+        schema: t.Optional[inference.Schema],
+        profile: t.Optional[stats.Profile],
+    ):
+        # The same statement is used for all rows, so sqlite
+        # only parses and plans it once
+        q = f"INSERT INTO {table_name} VALUES ({','.join('?' * f.num_cells)})"
+        for rows in self._parse(f):
+            goods = [r for r in rows if len(r) == f.num_cells]
+            if schema:
+                goods = schema.convert(goods)
+            if profile:
+                profile.add(goods)
+            with self._writing(_database_of(table_name)):
+                if schema:
+                    self._convert_demoted(table_name, f.headers, schema)
+                self.session.executemany(q, goods)
+            yield _wrongs(rows, f.num_cells), len(rows)
 
-        # Insert in chunks
-        for rows in more_itertools.ichunked(f, self.rows_per_chunk(f.num_cells)):
-            wrongs, goods = more_itertools.partition(
-                lambda r: len(r) == f.num_cells, rows
+    def _parse(self, f: CSVFile) -> t.Iterator[sheet_model.Rows]:
+        """Yields the rows of the CSV in chunks."""
+        if self._parallel(f):
+            return parallel.parse(
+                f.filepath,
+                f.scan().boundaries,
+                f.encoding,
+                f.dialect,
+                f.headers,
+                self.PARALLEL_WORKERS,
             )
-            goods = list(goods)
+        size = self.BULK_ROWS_PER_CHUNK
+        return self._batches(f, size, size * self.BATCH_TUNING_RATIO)
+
+    def _batches(
+        self, f: CSVFile, size: int, maximum: int
+    ) -> t.Iterator[sheet_model.Rows]:
+        """Yields the rows of the CSV in batches of size rows, which
+        are tuned up to maximum rows when tune_batches.
+        """
+        minimum = max(size // self.BATCH_TUNING_RATIO, 1)
+        if not self.tune_batches:
+            minimum = maximum = size
+        batcher = batch.Batcher(size, minimum, maximum, lambda: f.position, f.name)
+        return batcher(f)
 
+    def _parallel(self, f: CSVFile) -> bool:
+        """Whether to parse the CSV in several processes."""
+        return bool(
+            self.parallel_parse
+            and self.PARALLEL_WORKERS > 1
+            and f.filepath
+            and f.size >= self.PARALLEL_MIN_BYTES
+            and parallel.can_split(f.dialect)
+        )
+
+    def _chunked_insert(
+        self,
+        f: CSVFile,
+        table_name,
+        schema: t.Optional[inference.Schema],
+        profile: t.Optional[stats.Profile],
+    ):
+        size = self.rows_per_chunk(f.num_cells)
+        for rows in self._batches(f, size, size):
+            goods = [r for r in rows if len(r) == f.num_cells]
+            if schema:
+                goods = schema.convert(goods)
+            if profile:
+                profile.add(goods)
+
+            if schema:
+                self._convert_demoted(table_name, f.headers, schema)
             # Insert
             values = (f"({','.join('?' for _ in row)})" for row in goods)
             q = f"INSERT INTO {table_name} VALUES {','.join(values)};"
@@ -179,20 +981,318 @@ class SheetsAdaptor(Sheets):
             except Exception as e:
                 logging.error("Exception in rows %s", goods)
                 raise e
-            yield wrongs
+            yield _wrongs(rows, f.num_cells), len(rows)
+
+    def _convert_demoted(
+        self, table_name, headers: sheet_model.Row, schema: inference.Schema
+    ):
+        """Converts the rows we stored before some columns of the schema
+        were demoted into the demoted types, as the next rows will be.
+        """
+        demoted, schema.demoted = schema.demoted, {}
+        for i, column in demoted.items():
+            name = '"{}"'.format(headers[i].replace('"', '""'))
+            if sql := column.as_text(name):
+                self.session.execute(f"UPDATE {table_name} SET {name} = {sql}")
+
+    @contextmanager
+    def _bulk_load_transaction(self, table_name: str):
+        """Executes the block in one transaction with the
+        BULK_LOAD_PRAGMAS set, restoring the previous pragmas after.
+
+        When loading progressively, the transaction is committed in
+        every write (see _writing) instead, and the writes of other
+        loads can go in-between.
+        """
+        # Sqlite does not allow changing some of the pragmas inside
+        # a transaction, so we handle the whole transaction here
+        if self.session.in_transaction:
+            self.session.commit()
+        database = _database_of(table_name)
+        lock = self.writer.lock_of(database)
+        with ExitStack() as stack:
+            if not self.progressive_load:
+                stack.enter_context(lock)
+            stack.enter_context(
+                self.writer.bulk_loading(
+                    self.session, self.BULK_LOAD_PRAGMAS, database
+                )
+            )
+            try:
+                yield
+                self.session.commit()
+            except BaseException:
+                # Without a journal rollbacks are not reliable,
+                # so we ensure to remove the half-loaded table
+                with lock:
+                    self.session.rollback()
+                    self.session.execute(f"DROP TABLE IF EXISTS {table_name}")
+                raise
+
+    @contextmanager
+    def _writing(self, database: str = storage.MEMORY):
+        """Executes the writes of the block as the only writer of
+        the database.
+
+        When loading progressively, commits them so the rows loaded
+        so far can be queried.
+        """
+        with self.writer.lock_of(database):
+            if not self.session.in_transaction:
+                self.session.execute("BEGIN")
+            yield
+            if self.progressive_load:
+                self.session.commit()
 
     def rows_per_chunk(self, cols: int):
-        """The maximum number of rows that can be processed per chunk."""
-        # Note that the last chunk might have lesser rows
+        """The maximum number of rows that can be processed per chunk
+        when not bulk loading.
+        """
+        # Note that the last chunk might have lesser rows, and that
+        # tuning the batches can lower the rows of the chunks
         return self.SQLITE_VAR_LIMIT // cols
 
     def remove_sheet(self, *, name: str) -> sheet_model.Sheet:
-        sheet = next(sheet for sheet in self.sheets if sheet.name == name)
-        self.session.execute(f"DROP TABLE {name}")
+        sheet = self.sheets.get(name)
+        self._drop(name)
         self.sheets.remove(sheet)
-        sheet.remove(self.sheets)
+        if self.index_advisor:
+            self.index_advisor.forget(name)
+        sheet.remove(tuple(self.sheets))
+        return sheet
+
+    def follow(self, *, name: str, follow: bool = True) -> sheet_model.Sheet:
+        sheet = self.sheets.get(name)
+        if follow and not sheet.source:
+            raise ValueError(f"Cannot follow {sheet.filename}.")
+        sheet.following = follow
+        return sheet
+
+    def load_appended_rows(
+        self, *, name: str
+    ) -> t.Tuple[sheet_model.Sheet, int, bool, error_model.WrongRows]:
+        sheet = self.sheets.get(name)
+        source: Source = sheet.source
+        size = source.filepath.stat().st_size
+        reloaded = size < source.offset
+        if reloaded:
+            logging.info("File %s was truncated; loading it again", source.filepath)
+            with self.writer.lock_of(self._database(sheet)):
+                self.session.execute(f"DELETE FROM {name}")
+                self.session.commit()
+            source.offset = sheet.num_rows = 0
+            if sheet.stats:
+                sheet.stats = stats.Profile(sheet.header)
+        q = f"INSERT INTO {name} VALUES ({','.join('?' * len(sheet.header))})"
+        wrong_rows = error_model.WrongRows(sheet.filename, sheet.name)
+        loaded = 0
+        for end, rows in self._appended(source, size):
+            if not source.offset and rows and rows[0] == sheet.header:
+                rows.pop(0)
+            goods = [r for r in rows if len(r) == len(sheet.header)]
+            if source.schema:
+                goods = source.schema.convert(goods)
+                sheet.types = source.schema.types
+            if sheet.stats:
+                sheet.stats.add(goods)
+            with self.writer.lock_of(self._database(sheet)):
+                if source.schema:
+                    self._convert_demoted(name, sheet.header, source.schema)
+                self.session.executemany(q, goods)
+                self.session.commit()
+            source.offset += end
+            sheet.footprint += storage.estimate(goods, len(goods))
+            for i, wrong in _wrongs(rows, len(sheet.header)):
+                wrong_rows.add(sheet.num_rows + i + 1, wrong)
+            sheet.num_rows += len(rows)
+            loaded += len(rows)
+        self._analyze(sheet, self._database(sheet))
+        return sheet, loaded, reloaded, wrong_rows
+
+    def _appended(
+        self, source: Source, size: int
+    ) -> t.Iterator[t.Tuple[int, sheet_model.Rows]]:
+        """Yields the rows of the file of the source from its offset
+        up to size bytes, in chunks of about APPENDED_BYTES, with the
+        bytes of each chunk.
+        """
+        quotechar = source.dialect.get("quotechar")
+        with source.filepath.open("rb") as fp:
+            fp.seek(source.offset)
+            left, data = size - source.offset, b""
+            while left > 0 and (read := fp.read(min(self.APPENDED_BYTES, left))):
+                left -= len(read)
+                data += read
+                # The last record might not be fully written yet
+                if not (end := count.last_boundary(data, quotechar)):
+                    continue
+                text = io.StringIO(data[:end].decode(source.encoding), newline="")
+                yield end, list(csv.reader(text, **source.dialect))
+                data = data[end:]
+
+    def clear_import_cache(self):
+        if self.import_cache:
+            self.import_cache.clear()
+
+    def advise_indexes(self, q: str) -> t.List[sheet_model.Sheet]:
+        if not self.index_advisor:
+            return []
+        try:
+            candidates = indexes.candidates(self.session, q)
+        except sqlite3.Error:  # The query is wrong, or its sheet was removed
+            return []
+        indexed = []
+        for table, column in self.index_advisor.observe(candidates):
+            try:
+                sheet = self.sheets.get(table)
+            except KeyError:  # Not a sheet, like the table of a workspace
+                continue
+            if column not in sheet.indexes and not self.sheets.opening(table):
+                if self._index(sheet, column):
+                    indexed.append(sheet)
+        return indexed
+
+    def _index(self, sheet: sheet_model.Sheet, column: str) -> bool:
+        """Creates the index of the column if it fits the budget."""
+        i = sheet.header.index(column)
+        footprint = storage.estimate([[row[i]] for row in sheet.rows], sheet.num_rows)
+        used = sum(sum(s.indexes.values()) for s in self.sheets)
+        if used + footprint > self.INDEX_BUDGET:
+            logging.info(
+                "Not indexing %s of %s, as its ~%s bytes exceed the index budget",
+                column,
+                sheet,
+                footprint,
+            )
+            return False
+        database, index = self._database(sheet), indexes.name(sheet.name, column)
+        start = time.perf_counter()
+        with self.writer.lock_of(database):
+            q = 'CREATE INDEX IF NOT EXISTS {}."{}" ON {}("{}")'.format(
+                database,
+                index.replace('"', '""'),
+                sheet.name,
+                column.replace('"', '""'),
+            )
+            self.session.execute(q)
+            if sheet.stats:
+                stat = stats.index_stat(sheet.stats.get(column))
+                stats.analyze(self.session, database, sheet.name, stat, index)
+            self.session.commit()
+            if not sheet.on_disk:
+                measured = storage.footprint(self.session, database, index)
+                footprint = measured or footprint
+        sheet.indexes[column] = footprint
+        logging.info(
+            "Indexed %s of %s in %.2fs, taking %s bytes",
+            column,
+            sheet,
+            time.perf_counter() - start,
+            footprint,
+        )
+        return True
+
+    def drop_index(self, *, name: str, column: str) -> sheet_model.Sheet:
+        sheet = self.sheets.get(name)
+        database = self._database(sheet)
+        with self.writer.lock_of(database):
+            index = indexes.name(sheet.name, column).replace('"', '""')
+            self.session.execute(f'DROP INDEX IF EXISTS {database}."{index}"')
+            self.session.commit()
+        del sheet.indexes[column]
+        return sheet
+
+    def derive_sheet(self, query: str) -> sheet_model.Sheet:
+        sources = self._sources(query)
+        with self.writer.lock:  # No table is created while we name it
+            name = self.sheets.new_name(self._table_names())
+        try:
+            sheet = sheet_model.Sheet(name, [], [], 0, filename=query)
+            sheet.query, sheet.sources = query, sorted(sources)
+            # The results of a query are usually smaller than its sheets
+            footprint = sum(s.footprint for s in self.sheets if s.name in sources)
+            database = self._place(sheet, footprint)
+            self.sheets.add(sheet)
+            self._materialize(sheet, database)
+        except BaseException:
+            with suppress(KeyError):
+                self.sheets.remove(self.sheets.get(name))
+            self._drop(name)
+            raise
+        finally:
+            self.sheets.release(name)
         return sheet
 
+    def refresh_sheet(self, *, name: str) -> sheet_model.Sheet:
+        sheet = self.sheets.get(name)
+        if not sheet.query:
+            raise ValueError(f"{sheet} is not derived from a query.")
+        sheet.indexes.clear()  # Dropped with the table
+        if self.index_advisor:
+            self.index_advisor.forget(name)
+        self._materialize(sheet, self._database(sheet), replace=True)
+        return sheet
+
+    def _materialize(
+        self, sheet: sheet_model.Sheet, database: str, replace: bool = False
+    ):
+        """Stores the results of the query of the derived sheet in its
+        table, in one pass, and then reads them to profile the columns.
+
+        :param replace: Whether to replace the table, which readers
+        see replaced at once.
+        """
+        start = time.perf_counter()
+        table = f"{database}.{sheet.name}"
+        with self.writer.lock_of(database):
+            if self.session.in_transaction:
+                self.session.commit()
+            self.session.execute("BEGIN")
+            if replace:
+                self.session.execute(f"DROP TABLE IF EXISTS {table}")
+            self.session.execute(f"CREATE TABLE {table} AS {sheet.query}")
+            self.session.commit()
+        cursor = self.session.execute(f"SELECT * FROM {table}")
+        sheet.header = [column[0] for column in cursor.description]
+        sheet.rows = [list(row) for row in cursor.fetchmany(CSVFile.SAMPLE)]
+        sheet.types = _types(self.session, database, sheet.name)
+        if self.profile_columns:
+            sheet.stats = stats.Profile(sheet.header)
+            sheet.stats.add(sheet.rows)
+            for rows in iter(lambda: cursor.fetchmany(stats.Profile.BATCH), []):
+                sheet.stats.add(rows)
+            sheet.num_rows = sheet.stats.rows
+        else:
+            q = f"SELECT count(*) FROM {table}"
+            sheet.num_rows = self.session.execute(q).fetchone()[0]
+        self._measure(sheet, database)
+        self._analyze(sheet, database)
+        logging.info(
+            "Stored %s rows of %s in %.2fs",
+            sheet.num_rows,
+            sheet,
+            time.perf_counter() - start,
+        )
+
+    def _sources(self, query: str) -> t.Set[str]:
+        """The sheets the query reads, failing with sqlite3.Error if
+        the query is wrong.
+        """
+        read = set()
+
+        def authorizer(action, table, *_):
+            if action == sqlite3.SQLITE_READ:
+                read.add(table)
+            return sqlite3.SQLITE_OK
+
+        # Sqlite authorizes what the query reads when preparing it
+        self.session.set_authorizer(authorizer)
+        try:
+            self.session.execute(f"EXPLAIN {query}")
+        finally:
+            self.session.set_authorizer(None)
+        return {sheet.name for sheet in self.sheets if sheet.name in read}
+
     def get(self):
         return iter(self.sheets)
 
@@ -241,6 +1341,7 @@ class SheetsAdaptor(Sheets):
             with file.open("info.json") as info:
                 i = json.load(info)
                 self.sheets.clear()
+                databases = {}
                 for s in i["sheets"]:
                     sheet = sheet_model.Sheet(
                         name=s["name"],
@@ -248,15 +1349,36 @@ class SheetsAdaptor(Sheets):
                         header=s["header"],
                         num_rows=s["num_rows"],
                         filename=s["filename"],
+                        types=s.get("types"),  # Workspaces from older versions
+                    )
+                    sheet.query = s.get("query")
+                    sheet.sources = s.get("sources", [])
+                    if self.profile_columns:
+                        sheet.stats = stats.Profile(sheet.header)
+                    databases[sheet] = self._place(
+                        sheet, storage.estimate(sheet.rows, sheet.num_rows)
                     )
                     self.sheets.add(sheet)
                 update_handler.on_init(self.sheets)
             for sheet in self.sheets:
                 with file.open(sheet.name) as inner:
                     csv_sheets = CSVFile(io.TextIOWrapper(inner), headers=sheet.header)
-                    for _ in self._process_spreadsheet(csv_sheets, sheet.name):
-                        rows_opened = self.rows_per_chunk(csv_sheets.num_cells)
-                        update_handler.on_it(rows_opened)
+                    schema = None
+                    if sheet.types:
+                        schema = inference.Schema.from_types(sheet.types)
+                    progress = batch.Progress(
+                        update_handler.on_it, self.PROGRESS_INTERVAL
+                    )
+                    for _, processed in self._process_spreadsheet(
+                        csv_sheets,
+                        f"{databases[sheet]}.{sheet.name}",
+                        schema,
+                        sheet.stats,
+                    ):
+                        progress.add(processed)
+                    progress.flush()
+                    self._measure(sheet, databases[sheet])
+                    self._analyze(sheet, databases[sheet])
         return i["queries"]
 
     def _export_sheet(self, sheet: sheet_model.Sheet):
@@ -268,9 +1390,57 @@ class SheetsAdaptor(Sheets):
             "num_rows": sheet.num_rows,
             "header": sheet.header,
             "filename": sheet.filename,
+            "types": sheet.types,
+            "query": sheet.query,
+            "sources": sheet.sources,
         }
 
 
+def _wrongs(
+    rows: sheet_model.Rows, num_cells: int
+) -> t.List[t.Tuple[int, sheet_model.Row]]:
+    """The rows that do not have num_cells, with their index."""
+    return [(i, r) for i, r in enumerate(rows) if len(r) != num_cells]
+
+
+def _types(
+    session: sqlite3.Connection, database: str, table: str
+) -> t.Optional[t.List[str]]:
+    """The types of the columns of a table created from a query, or
+    None if some column has no type, like when it takes numbers
+    and text.
+    """
+    affinities = {
+        "INT": inference.INTEGER,
+        "REAL": inference.REAL,
+        "TEXT": inference.TEXT,
+    }
+    q = f"PRAGMA {database}.table_info({table})"
+    declared = [type for _, _, type, *_ in session.execute(q)]
+    if all(type in affinities for type in declared):
+        return [affinities[type] for type in declared]
+    return None
+
+
+def _database_of(table_name: str) -> str:
+    """The database of a table name qualified with it."""
+    database, _, _ = table_name.rpartition(".")
+    return database or storage.MEMORY
+
+
+def _qualify(
+    pragmas: t.Dict[str, t.Union[str, int]], database: str
+) -> t.Dict[str, t.Union[str, int]]:
+    return {f"{database}.{pragma}": value for pragma, value in pragmas.items()}
+
+
+def _set_pragmas(
+    session: sqlite3.Connection, pragmas: t.Dict[str, t.Union[str, int]]
+):
+    for pragma, value in pragmas.items():
+        session.execute(f"PRAGMA {pragma}={value}")
+
+
 class FileLike:
     def write(self, row: str):
         return row
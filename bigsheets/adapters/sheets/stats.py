@@ -0,0 +1,208 @@
+"""Profiles the columns of the sheets while we load their rows, so
+we know what a column has without scanning its table again.
+
+The count, nulls, min and max of a column are exact. As the ANALYZE
+of Postgres, the distinct and top values are estimated from a sample
+of the values spread through the column, as counting the values of
+a big column takes longer than loading it.
+"""
+from __future__ import annotations
+
+import math
+import sqlite3
+import typing as t
+from collections import Counter
+
+from bigsheets.domain import sheet as sheet_model
+
+
+class Column:
+    """The statistics of a column."""
+
+    SAMPLE = 5000
+    """The values we sample at least, if the column has them."""
+    TOP = 10
+
+    def __init__(self, name: str):
+        self.name = name
+        self.count = 0
+        self.nulls = 0
+        """The empty cells."""
+        self.min: sheet_model.Cell = None
+        self.max: sheet_model.Cell = None
+        self._sample: t.List[sheet_model.Cell] = []
+        self._step = 1
+        """We sample one value every step values."""
+        self._values = 0
+        """The values we saw, without the nulls."""
+
+    def add(self, values: t.Sequence[sheet_model.Cell]):
+        nulls = values.count(None)
+        if not isinstance(self.max, (int, float)):  # Or the column has no text
+            nulls += values.count("")
+        self.count += len(values)
+        self.nulls += nulls
+        if nulls:
+            values = [v for v in values if v is not None and v != ""]
+        if not values:
+            return
+        low, high = _min(values), _max(values)
+        if self.min is not None:
+            low, high = _min([low, self.min]), _max([high, self.max])
+        self.min, self.max = low, high
+        # We sample the values whose position is a multiple of step
+        self._sample.extend(values[-self._values % self._step :: self._step])
+        self._values += len(values)
+        while len(self._sample) >= 2 * self.SAMPLE:
+            self._sample = self._sample[::2]
+            self._step *= 2
+
+    @property
+    def distinct(self) -> int:
+        """The approx. number of distinct values, without the nulls,
+        through the Duj1 estimator of Haas and Stokes.
+        """
+        counts = Counter(self._sample)
+        if self._step == 1:  # We sampled all the values
+            return len(counts)
+        n, once = len(self._sample), sum(1 for c in counts.values() if c == 1)
+        return round(n * len(counts) / (n - once + once * n / self._values))
+
+    @property
+    def top(self) -> t.List[t.Tuple[sheet_model.Cell, int]]:
+        """The most frequent values and their approx. count.
+
+        Values sampled once are not frequent, unless we sampled all.
+        """
+        counts = Counter(self._sample).most_common(self.TOP)
+        return [
+            (value, n * self._step)
+            for value, n in counts
+            if n > 1 or self._step == 1
+        ]
+
+    def summary(self) -> dict:
+        return {
+            "name": self.name,
+            "count": self.count,
+            "nulls": self.nulls,
+            "min": self.min,
+            "max": self.max,
+            "distinct": self.distinct,
+            "top": self.top,
+        }
+
+    def to_json(self) -> dict:
+        return {
+            "name": self.name,
+            "count": self.count,
+            "nulls": self.nulls,
+            "min": self.min,
+            "max": self.max,
+            "sample": self._sample,
+            "step": self._step,
+            "values": self._values,
+        }
+
+    @classmethod
+    def from_json(cls, value: dict) -> Column:
+        column = cls(value["name"])
+        column.count, column.nulls = value["count"], value["nulls"]
+        column.min, column.max = value["min"], value["max"]
+        column._sample, column._step = value["sample"], value["step"]
+        column._values = value["values"]
+        return column
+
+
+class Profile:
+    """The statistics of the columns of a sheet.
+
+    The rows are added to the columns in batches of BATCH rows at
+    least, as adding rows has a cost per call besides the one per row.
+    """
+
+    BATCH = 5000
+
+    def __init__(self, header: sheet_model.Row):
+        self._columns = [Column(name) for name in header]
+        self._pending: sheet_model.Rows = []
+
+    def add(self, rows: sheet_model.Rows):
+        """Adds the rows, which must have a cell per column."""
+        self._pending.extend(rows)
+        if len(self._pending) >= self.BATCH:
+            self._flush()
+
+    @property
+    def columns(self) -> t.List[Column]:
+        self._flush()
+        return self._columns
+
+    def _flush(self):
+        rows, self._pending = self._pending, []
+        for column, values in zip(self._columns, zip(*rows)):
+            column.add(values)
+
+    @property
+    def rows(self) -> int:
+        return self.columns[0].count if self.columns else 0
+
+    def get(self, name: str) -> Column:
+        return next(column for column in self.columns if column.name == name)
+
+    def summary(self) -> t.List[dict]:
+        return [column.summary() for column in self.columns]
+
+    def to_json(self) -> t.List[dict]:
+        return [column.to_json() for column in self.columns]
+
+    @classmethod
+    def from_json(cls, value: t.List[dict]) -> Profile:
+        profile = cls([])
+        profile._columns = [Column.from_json(column) for column in value]
+        return profile
+
+
+def analyze(
+    session: sqlite3.Connection,
+    database: str,
+    table: str,
+    stat: str,
+    index: t.Optional[str] = None,
+):
+    """Tells the query planner the statistics of the table, or of an
+    index of it, as ANALYZE would without scanning them.
+
+    :param stat: The stat column of sqlite_stat1: the rows of the table
+    and, for an index, the average rows with the same value.
+    """
+    # Analyzing the schema creates sqlite_stat1 without scanning tables
+    session.execute(f"ANALYZE {database}.sqlite_master")
+    q = f"DELETE FROM {database}.sqlite_stat1 WHERE tbl = ? AND idx IS ?"
+    session.execute(q, (table, index))
+    q = f"INSERT INTO {database}.sqlite_stat1 VALUES (?, ?, ?)"
+    session.execute(q, (table, index, stat))
+    session.execute(f"ANALYZE {database}.sqlite_master")  # Loads the statistics
+
+
+def index_stat(column: Column) -> str:
+    """The sqlite_stat1 stat of an index of the column."""
+    return f"{column.count} {math.ceil(column.count / max(column.distinct, 1))}"
+
+
+def _min(values: t.List[sheet_model.Cell]) -> sheet_model.Cell:
+    try:
+        return min(values)
+    except TypeError:  # Numbers and text, which sqlite sorts after numbers
+        return min(values, key=_sqlite_order)
+
+
+def _max(values: t.List[sheet_model.Cell]) -> sheet_model.Cell:
+    try:
+        return max(values)
+    except TypeError:
+        return max(values, key=_sqlite_order)
+
+
+def _sqlite_order(value: sheet_model.Cell):
+    return isinstance(value, str), value
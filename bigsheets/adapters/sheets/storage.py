@@ -0,0 +1,231 @@
+"""Where the sheets are stored.
+
+Each sheet is stored in its own database (see Catalog), in memory or,
+when the sheets in memory would exceed a budget, in a temporary file.
+Once a connection attaches as many databases as sqlite allows, the
+new sheets are tables of the memory database or of a temporary
+database in the disk that every connection attaches as DISK.
+
+The table of a sheet is named as the sheet, and sqlite finds
+unqualified tables in any database, so queries do not need to know
+where a sheet is.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import typing as t
+import uuid
+import weakref
+from contextlib import suppress
+from pathlib import Path
+
+import decouple
+
+from bigsheets.domain import sheet as sheet_model
+
+log = logging.getLogger(__name__)
+
+MEMORY = "main"
+DISK = "disk"
+"""The name of the disk database in the connections."""
+ATTACHED = 10
+"""The databases sqlite attaches at most by default, if we cannot
+ask sqlite.
+"""
+
+ROW_OVERHEAD = 8
+"""The approx. bytes sqlite takes per row besides its values."""
+LOCKED_WAIT = 0.01
+LOCKED_RETRIES = 500
+
+
+def memory_budget() -> int:
+    """The max bytes of the sheets in memory, which is half the
+    physical memory unless set through the MEMORY_BUDGET environment
+    variable.
+    """
+    try:
+        memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):  # Not available in Windows
+        memory = 8 * 2 ** 30
+    return decouple.config("MEMORY_BUDGET", default=memory // 2, cast=int)
+
+
+class Disk:
+    """The temporary database in the disk the sheets spill to.
+
+    The file is created with the first connection, and removed
+    when this is garbage collected or the program exits.
+    """
+
+    PRAGMAS = {
+        "mmap_size": 2 ** 40,  # Sqlite limits it to its max
+        "cache_size": -512_000,  # In KiB
+        # The database is temporary, so we do not need to recover it
+        "journal_mode": "OFF",
+        "synchronous": "OFF",
+    }
+
+    def __init__(self):
+        self.path: t.Optional[Path] = None
+
+    def attach(self, session: sqlite3.Connection):
+        """Attaches the database to the session as DISK."""
+        if not self.path:
+            fd, name = tempfile.mkstemp(".sqlite", "bigsheets-")
+            os.close(fd)
+            self.path = Path(name)
+            weakref.finalize(self, self.path.unlink, missing_ok=True)
+            log.info("Sheets over the memory budget are stored in %s", self.path)
+        # Sharing the cache the connections lock and read the database
+        # as the memory one
+        uri = f"{self.path.as_uri()}?cache=shared"
+        _attach(session, uri, DISK, self.PRAGMAS)
+
+
+class Catalog:
+    """The sheets stored each in its own database, which every
+    connection of the engine attaches with the name of the sheet.
+
+    Loading a sheet only locks its database, so sheets load in
+    parallel, and removing a sheet detaches its database instead of
+    deleting its rows. Sqlite frees a memory database once no
+    connection attaches it.
+    """
+
+    RESERVED = 2
+    """The databases a connection attaches besides the ones of the
+    sheets: DISK, and the one of the import cache.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._uris: t.Dict[str, str] = {}
+        self._files: t.Dict[str, Path] = {}
+        self._keeper = sqlite3.connect(
+            "file::memory:", uri=True, check_same_thread=False
+        )
+        """Attaches the databases so the memory ones live while
+        the sheet is opened.
+        """
+        limit = ATTACHED
+        with suppress(AttributeError):  # Python < 3.11
+            limit = self._keeper.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+        self.slots = limit - self.RESERVED
+        """The sheets that can have their own database."""
+        self._attached: t.MutableMapping[
+            sqlite3.Connection, t.Dict[str, str]
+        ] = weakref.WeakKeyDictionary()
+        """The uris of the databases each connection attached."""
+
+    def create(self, name: str, on_disk: bool) -> bool:
+        """Creates the database of the sheet, returning False if
+        all the slots are taken.
+        """
+        with self._lock:
+            if len(self._uris) >= self.slots:
+                return False
+            if on_disk:
+                fd, filename = tempfile.mkstemp(".sqlite", f"bigsheets-{name}-")
+                os.close(fd)
+                path = self._files[name] = Path(filename)
+                weakref.finalize(self, path.unlink, missing_ok=True)
+                uri = f"{path.as_uri()}?cache=shared"
+            else:
+                uri = f"file:{uuid.uuid4().hex}?mode=memory&cache=shared"
+            _attach(self._keeper, uri, name, Disk.PRAGMAS if on_disk else {})
+            self._uris[name] = uri
+        return True
+
+    def remove(self, name: str):
+        """Removes the database of the sheet, which is freed once
+        the connections attaching it detach it or close.
+        """
+        with self._lock:
+            del self._uris[name]
+            _execute(self._keeper, f"DETACH DATABASE {name}")
+            if path := self._files.pop(name, None):
+                path.unlink(missing_ok=True)
+
+    def sync(self, session: sqlite3.Connection):
+        """Attaches to the session the databases it does not have,
+        and detaches the ones removed since the last sync, as
+        a connection can outlive sheets through the pool.
+        """
+        with self._lock:
+            uris = dict(self._uris)
+            attached = self._attached.setdefault(session, {})
+        for name, uri in list(attached.items()):
+            if uris.get(name) != uri:  # Removed, or its name reused
+                self.detach(session, name)
+        for name, uri in uris.items():
+            if name not in attached:
+                _attach(session, uri, name, Disk.PRAGMAS if name in self._files else {})
+                attached[name] = uri
+
+    def detach(self, session: sqlite3.Connection, name: str):
+        """Detaches the database of the sheet from the session."""
+        with self._lock:
+            self._attached.setdefault(session, {}).pop(name, None)
+        with suppress(sqlite3.OperationalError):  # Not attached
+            _execute(session, f"DETACH DATABASE {name}")
+
+    def __contains__(self, name: str):
+        return name in self._uris
+
+    def __iter__(self) -> t.Iterator[str]:
+        with self._lock:
+            return iter(tuple(self._uris))
+
+
+def databases(session: sqlite3.Connection) -> t.List[str]:
+    """The names of the databases the session attaches."""
+    return [name for _, name, _ in _execute(session, "PRAGMA database_list")]
+
+
+def _attach(
+    session: sqlite3.Connection,
+    uri: str,
+    name: str,
+    pragmas: t.Dict[str, t.Union[str, int]],
+):
+    _execute(session, f"ATTACH DATABASE ? AS {name}", (uri,))
+    for pragma, value in pragmas.items():
+        _execute(session, f"PRAGMA {name}.{pragma}={value}")
+
+
+def _execute(session: sqlite3.Connection, q: str, params: t.Sequence = ()):
+    """Executes q waiting for the connections that lock the schema,
+    as sqlite does not wait for them in shared caches, like when
+    a sheet that is opening creates its table.
+    """
+    for retry in range(LOCKED_RETRIES):
+        try:
+            return session.execute(q, params)
+        except sqlite3.OperationalError as e:
+            if "locked" not in str(e) or retry == LOCKED_RETRIES - 1:
+                raise
+            time.sleep(LOCKED_WAIT)
+
+
+def estimate(rows: sheet_model.Rows, num_rows: t.Optional[int]) -> int:
+    """The approx. bytes num_rows like the sample rows take in sqlite."""
+    if not rows or not num_rows:
+        return 0
+    # Sqlite takes a byte per value to store its type and size
+    sample = sum(len(str(cell)) + 1 for row in rows for cell in row)
+    return (sample // len(rows) + ROW_OVERHEAD) * num_rows
+
+
+def footprint(session: sqlite3.Connection, schema: str, table: str) -> t.Optional[int]:
+    """The bytes the table takes, or None if sqlite cannot measure it."""
+    q = "SELECT sum(pgsize) FROM dbstat WHERE schema = ? AND name = ?"
+    try:
+        return session.execute(q, (schema, table)).fetchone()[0]
+    except sqlite3.OperationalError:  # Sqlite built without dbstat
+        return None
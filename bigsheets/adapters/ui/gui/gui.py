@@ -44,25 +44,41 @@ class GUIAdapter(UIPort):
         )
         self.webview.start(debug=bigsheets.service.utils.debug())
 
-    def ask_user_for_sheet(self):
-        return self.windows[-1].ask_user_for_sheet()
+    def ask_user_for_sheets(self):
+        return self.windows[-1].ask_user_for_sheets()
 
     def start_opening_sheet(self, sheet: sheet.Sheet):
         self.windows[-1].start_opening_sheet(sheet)
 
-    def update_sheet_opening(self, completed: int):
-        self.windows[-1].update_sheet_opening(completed)
+    def update_sheet_opening(self, sheet: sheet.Sheet, completed: int):
+        self.windows[-1].update_sheet_opening(sheet, completed)
 
-    def sheet_opened(self, *opened_sheets: sheet.Sheet):
+    def update_sheet_opening_total(self, sheet: sheet.Sheet, total: int):
+        self.windows[-1].update_sheet_opening_total(sheet, total)
+
+    def sheet_opening_failed(self, sheet: sheet.Sheet):
+        for window in self.windows:
+            window.sheet_opening_failed(sheet)
+
+    def sheet_opened(self, sheet: sheet.Sheet, *opened_sheets: sheet.Sheet):
+        for window in self.windows:
+            window.sheet_opened(sheet)
+            window.set_open_sheets(*opened_sheets)
+
+    def sheet_updated(
+        self, sheet: sheet.Sheet, rows_changed: bool, *opened_sheets: sheet.Sheet
+    ):
         for window in self.windows:
-            window.sheet_opened()
             window.set_open_sheets(*opened_sheets)
+            if rows_changed:
+                window.sheet_updated(sheet)
 
     def sheet_removed(self, *sheet: sheet.Sheet):
         for window in self.windows:
             window.set_open_sheets(*sheet)
 
     def handle_closing_window(self, window: query_window.QueryWindow):
+        window.close_session()
         with suppress(ValueError):
             self.windows.remove(window)
         if not self.windows:
@@ -27,6 +27,9 @@ class Progress(Controller):
     def update(self, completed):
         self._exec(self.update, completed)
 
+    def set_total(self, total: int):
+        self._exec("setTotal", total)
+
     def finish(self):
         self._exec(self.finish)
 
@@ -66,6 +69,12 @@ class Query(Controller):
     def disable(self):
         self._exec(self.disable)
 
+    def refresh(self):
+        self._exec(self.refresh)
+
+    def set_count(self, count: int, exact: bool):
+        self._exec("setCount", count, exact)
+
     def set_opened_sheets(self, sheets: t.Dict[str, t.List[str]]):
         self._exec("setOpenedSheets", sheets)
 
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import logging
+import threading
 import typing as t
 from dataclasses import dataclass
 from functools import partial
@@ -51,6 +52,9 @@ class QueryWindow:
             ui.ctrl.SheetsButton(self.native_window),
         )
         self._view.ctrl = self.ctrl
+        self._opening: t.Dict[sheet.Sheet, int] = {}
+        """The sheets opening in the window and their loaded rows."""
+        self._opening_lock = threading.Lock()
 
     @property
     def query(self):
@@ -64,26 +68,82 @@ class QueryWindow:
     def title(self, value):
         self.native_window.set_title(value)
 
-    def ask_user_for_sheet(self) -> t.Optional[Path]:
-        return self.file_dialog()
+    def ask_user_for_sheets(self) -> t.List[Path]:
+        return self.file_dialog(multiple=True)
 
     def start_opening_sheet(self, sheet: sheet.Sheet):
-        self.ctrl.progress.start_processing(sheet.num_rows)
+        """Starts showing the opening of the sheet, or adds the
+        sheet to the progress of the ones already opening.
+        """
+        with self._opening_lock:
+            first = not self._opening
+            self._opening[sheet] = 0
+        if first:
+            self.ctrl.progress.start_processing(sheet.num_rows)
+            self.ctrl.info.set(
+                "Some functionality is disabled until the sheet finishes opening."
+            )
+            self.ctrl.table.set(sheet.rows, sheet.header)
+            # The rows loaded so far can be queried
+            self.ctrl.query.init(sheet.name)
+        else:
+            self._update_opening_total()
+
+    def update_sheet_opening(self, sheet: sheet.Sheet, completed: int):
+        with self._opening_lock:
+            self._opening[sheet] = completed
+            opening = tuple(self._opening.items())
+        self.ctrl.progress.update(sum(completed for _, completed in opening))
+        loaded = ", ".join(
+            f"{humanize(completed)} of ~{humanize(sheet.num_rows)}"
+            + (f" in {sheet.name}" if len(opening) > 1 else "")
+            for sheet, completed in opening
+        )
         self.ctrl.info.set(
+            f"Rows loaded: {loaded}. "
             "Some functionality is disabled until the sheet finishes opening."
         )
-        self.ctrl.table.set(sheet.rows, sheet.header)
-        self.ctrl.query.init(sheet.name)
-        self.ctrl.query.disable()
 
-    def update_sheet_opening(self, completed: int):
-        self.ctrl.progress.update(completed)
+    def update_sheet_opening_total(self, sheet: sheet.Sheet, total: int):
+        self._update_opening_total()
+
+    def _update_opening_total(self):
+        with self._opening_lock:
+            sheets = tuple(self._opening)
+        self.ctrl.progress.set_total(sum(sheet.num_rows or 0 for sheet in sheets))
+
+    def sheet_opening_failed(self, sheet: sheet.Sheet):
+        """Stops showing the opening of the sheet, which the errors
+        of the sheets report.
+        """
+        self._finish_opening(sheet)
+
+    def sheet_opened(self, sheet: sheet.Sheet):
+        self._finish_opening(sheet)
 
-    def sheet_opened(self):
+    def _finish_opening(self, sheet: sheet.Sheet):
+        """Removes the sheet from the progress of the ones opening,
+        enabling the window when none is left.
+        """
+        self._view.prefetched.drop()  # Before refreshing the query
+        with self._opening_lock:
+            was_opening = self._opening.pop(sheet, None) is not None
+            still_opening = bool(self._opening)
+        if still_opening:
+            self._update_opening_total()
+            return
         self.ctrl.progress.finish()
         self.unset_info()
         self.ctrl.nav.enable()
         self.ctrl.query.enable()
+        if was_opening:
+            # Show the results with all the rows of the sheets
+            self.ctrl.query.refresh()
+
+    def sheet_updated(self, sheet: sheet.Sheet):
+        if not self._opening:
+            # Show the rows appended to the sheet
+            self.ctrl.query.refresh()
 
     def init_with_query(self, query: t.Optional[str] = None):
         """ Initializes the window and executes the passed-in query.
@@ -102,13 +162,31 @@ class QueryWindow:
         self.set_open_sheets(*self.reader.opened_sheets())
 
     def set_open_sheets(self, *sheets: sheet.Sheet):
+        # The sheets changed, and so could the pages of the query
+        self._view.prefetched.drop()
         self.ctrl.sheets_button.set(
-            [{"name": sheet.name, "filename": sheet.filename} for sheet in sheets]
+            [
+                {
+                    "name": sheet.name,
+                    "filename": sheet.filename,
+                    "followable": sheet.source is not None,
+                    "following": sheet.following,
+                    "footprint": f"{humanize(sheet.footprint)}B",
+                    "onDisk": sheet.on_disk,
+                    "indexes": sorted(sheet.indexes),
+                    "query": sheet.query,
+                }
+                for sheet in sheets
+            ]
         )
         self.ctrl.query.set_opened_sheets(
             {sheet.name: sheet.header for sheet in sheets}
         )
 
+    def close_session(self):
+        """Frees the rows of the last query of the window."""
+        self._view.close_session()
+
     def close(self):
         self.on_closing(self)
         self.native_window.destroy()  # Destroy does not trigger closing, etc.
@@ -117,16 +195,25 @@ class QueryWindow:
         if filepath := self.file_dialog(save="sheet.csv"):
             self.bus.handle(command.ExportView(query, filepath))
 
-    def file_dialog(self, *, save: t.Optional[str] = None) -> t.Optional[Path]:
+    def file_dialog(
+        self, *, save: t.Optional[str] = None, multiple: bool = False
+    ) -> t.Union[t.Optional[Path], t.List[Path]]:
         """Creates an open file dialog if save is falsy, and a save dialog when
         save is a string with an exemplifying filename.
+
+        :param multiple: Let the user open several files, returning
+        a list with the paths of the files —empty if none.
         """
         r = self.native_window.create_file_dialog(
             self.webview.SAVE_DIALOG if save else self.webview.OPEN_DIALOG,
-            allow_multiple=False,
+            allow_multiple=multiple and not save,
             save_filename=save,
-            file_types=("CSV and BigSheets (*.bsw;*.csv;*.tsv;*.tab)",),
+            file_types=(
+                "CSV and BigSheets (*.bsw;*.csv;*.tsv;*.tab;*.gz;*.bz2;*.xz;*.zip)",
+            ),
         )
+        if multiple:
+            return [Path(p) for p in r or ()]
         return Path(r[0]) if r else None
 
     def start_blocking_process(self, total: int, info: str):
@@ -145,7 +232,17 @@ class QueryWindow:
         self.unset_info()
 
     def unset_info(self):
-        if self.reader.errors():
+        if self.reader.error_counts():
             self.ctrl.info.set_warnings()
         else:
             self.ctrl.info.unset()
+
+
+def humanize(n: t.Optional[int]) -> str:
+    """A short representation of a big number, like 3.2M."""
+    if n is None:
+        return "?"
+    for divisor, suffix in ((10 ** 9, "G"), (10 ** 6, "M"), (10 ** 3, "k")):
+        if n >= divisor:
+            return f"{n / divisor:.1f}{suffix}"
+    return str(n)
@@ -2,11 +2,13 @@ from __future__ import annotations
 
 import logging
 import sqlite3
-from dataclasses import dataclass
+import threading
+import typing as t
+from dataclasses import dataclass, field
 from functools import wraps
 
 from bigsheets.domain import command
-from bigsheets.service import message_bus, read_model
+from bigsheets.service import message_bus, prefetch, read_model
 from bigsheets.adapters.ui.gui import gui, utils as gui_utils
 from . import query_window, controller
 log = logging.getLogger(__name__)
@@ -21,20 +23,126 @@ class View:
     window: query_window.QueryWindow
     bus: message_bus.MessageBus
 
+    _running: t.Optional[read_model.QueryControl] = field(default=None, init=False)
+    """Stops the query running in the window."""
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False)
+    _session: t.Optional[str] = field(default=None, init=False)
+    """The result session of the last query of the window."""
+    _counting: t.Optional[t.Tuple[str, read_model.QueryControl]] = field(
+        default=None, init=False
+    )
+    """The query whose rows we count in the background, and what
+    stops the count.
+    """
+    prefetched: prefetch.Prefetcher = field(init=False)
+
+    def __post_init__(self):
+        self.prefetched = prefetch.Prefetcher(self.reader, self.reader.submit)
+
     @gui_utils.log_exception
-    def query(self, query: str, limit, page):
+    def query(self, query: str, limit, page, session: t.Optional[str] = None):
+        """Shows the page of the query, returning the id of its result
+        session, which the window passes back to get other pages.
+        """
         self.window.title = query
+        control = read_model.QueryControl(self.reader.timeout)
+        control.start()
+        with self._lock:
+            previous, self._running = self._running, control
+        if previous:  # The new query replaces the one running
+            previous.cancel()
+        self._stop_counting(unless=query)
         try:
-            r = self.reader.query(query, limit, page)
-            headers = next(r)
+            session = self.reader.open_session(query, control, session)
+            self._session = session
+            result = self.prefetched.get(query, limit, page)
+            if result is None:
+                result = list(self.reader.query(query, limit, page, control, session))
             # for huge number of rows we could use simplejson to
             # avoid creating a tuple in memory
-            results = tuple(r)
+            headers, results = result[0], tuple(result[1:])
+        except read_model.QueryInterrupted as e:
+            log.info(f"Query interrupted: {e}")
+            if self._running is control:  # Not replaced by another query
+                self.ctrl.query.set_message(str(e))
         except sqlite3.OperationalError as e:  # todo wrap error with db generic?
             log.info(f"Wrong query {e}")
             self.ctrl.query.set_message(str(e))
         else:
             self.ctrl.table.set(results, headers)
+            self.prefetched.shown(query, limit, page, result, session)
+            self._count(query, session)
+            return session
+        finally:
+            with self._lock:
+                if self._running is control:
+                    self._running = None
+
+    @gui_utils.log_exception
+    def rows(self, query: str, limit, page, session: t.Optional[str] = None):
+        """The rows of a page of the query, which the table gets as
+        the user scrolls to them.
+        """
+        result = self.prefetched.get(query, limit, page)
+        if result is None:
+            try:
+                result = list(self.reader.fetch(query, limit, page, session=session))
+            except sqlite3.OperationalError as e:
+                log.info(f"Rows of the query not got: {e}")
+                return []
+        self.prefetched.shown(query, limit, page, result, session)
+        return result[1:]
+
+    def _count(self, query: str, session: t.Optional[str]):
+        """Shows the estimated rows of the query, counting the exact
+        ones in the background.
+        """
+        count, exact = self.reader.estimate(query, session)
+        self.ctrl.query.set_count(count, exact)
+        with self._lock:
+            if exact or self._counting:  # Counting the query already
+                return
+            control = read_model.QueryControl(self.reader.timeout)
+            self._counting = query, control
+        self.reader.submit(self._count_exactly, query, session, control)
+
+    @gui_utils.log_exception
+    def _count_exactly(
+        self, query: str, session: t.Optional[str], control: read_model.QueryControl
+    ):
+        try:
+            count = self.reader.count(query, control, session)
+        except sqlite3.OperationalError as e:
+            log.info(f"Rows of the query not counted: {e}")
+            count = None
+        with self._lock:
+            # Or the query changed
+            counted = self._counting and self._counting[1] is control
+            if counted:
+                self._counting = None
+        if counted and count is not None:
+            self.ctrl.query.set_count(count, True)
+
+    def _stop_counting(self, unless: t.Optional[str] = None):
+        """Stops counting the rows of the query, unless it is this one."""
+        with self._lock:
+            counting = self._counting
+            if not counting or counting[0] == unless:
+                return
+            self._counting = None
+        counting[1].cancel()
+
+    @gui_utils.log_exception
+    def close_session(self):
+        self._stop_counting()
+        self.prefetched.drop()
+        self.reader.close_session(self._session)
+
+    @gui_utils.log_exception
+    def cancel_query(self):
+        with self._lock:
+            if self._running:
+                self._running.cancel()
 
     @gui_utils.log_exception
     def open_window(self):
@@ -49,6 +157,10 @@ class View:
     def remove_sheet(self, name: str):
         self.bus.handle(command.RemoveSheet(name))
 
+    @gui_utils.log_exception
+    def follow_sheet(self, name: str, follow: bool):
+        self.bus.handle(command.FollowSheet(name, follow))
+
     @gui_utils.log_exception
     def open_sheet(self):
         self.ui.open_sheet()
@@ -61,6 +173,30 @@ class View:
     def save_workspace(self):
         self.ui.save_workspace()
 
+    @gui_utils.log_exception
+    def column_stats(self, name: str):
+        return self.reader.column_stats(name)
+
+    @gui_utils.log_exception
+    def drop_index(self, name: str, column: str):
+        self.bus.handle(command.DropIndex(name, column))
+
+    @gui_utils.log_exception
+    def derive_sheet(self, query: str):
+        try:
+            self.bus.handle(command.DeriveSheet(query))
+        except sqlite3.OperationalError as e:
+            log.info(f"Wrong query {e}")
+            self.ctrl.query.set_message(str(e))
+
+    @gui_utils.log_exception
+    def refresh_sheet(self, name: str):
+        self.bus.handle(command.RefreshSheet(name))
+
+    @gui_utils.log_exception
+    def clear_import_cache(self):
+        self.bus.handle(command.ClearImportCache())
+
     @gui_utils.log_exception
     def open_warnings(self):
         self.ui.open_warnings_window()
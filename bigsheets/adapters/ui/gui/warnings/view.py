@@ -14,8 +14,9 @@ class View:
     reader: read_model.ReadModel
 
     @gui_utils.log_exception
-    def errors(self):
-        return {
-            k: [e.dict() for e in errors]
-            for k, errors in self.reader.errors().items()
-        }
+    def error_counts(self):
+        return self.reader.error_counts()
+
+    @gui_utils.log_exception
+    def errors(self, filename: str, page: int, limit: int):
+        return self.reader.errors(filename, page, limit)
@@ -24,6 +24,10 @@ class Progress {
     this.el.value = completed
   }
 
+  setTotal (total) {
+    this.el.max = total
+  }
+
   finish () {
     this.el.hidden = true
   }
@@ -55,6 +59,29 @@ class Info {
   }
 }
 
+/**
+ * The rows the table gets from the query each time.
+ */
+const BLOCK_ROWS = 200
+/**
+ * The blocks of rows the table keeps, the farthest from the shown
+ * rows being forgotten first.
+ */
+const MAX_BLOCKS = 50
+/**
+ * The rows rendered above and below the visible ones.
+ */
+const OVERSCAN_ROWS = 20
+/**
+ * The max height of the table, as browsers cannot scroll elements
+ * taller than some millions of pixels. Taller tables are scaled.
+ */
+const MAX_HEIGHT = 8000000
+
+/**
+ * A table that renders only the rows the user sees, getting blocks
+ * of them from the query as the user scrolls.
+ */
 class Table {
   constructor () {
     /**
@@ -63,6 +90,37 @@ class Table {
      */
     this.el = document.getElementById('table')
     console.assert(this.el)
+    /**
+     * @type {HTMLElement}
+     */
+    this.scroller = this.el.parentElement
+    this.scroller.onscroll = () => {
+      this._scrolled = true
+      this.scheduleRender()
+    }
+    window.addEventListener('resize', () => this.scheduleRender())
+    this.header = []
+    /**
+     * The rows of the result, which are estimated if not exact.
+     */
+    this.total = 0
+    this.exact = true
+    this.rowHeight = 0
+    /**
+     * @type {Map<number, Array[]>}
+     */
+    this._blocks = new Map()
+    this._requested = new Set()
+    /**
+     * Increases with each result, to discard the blocks of the
+     * previous ones.
+     */
+    this._result = 0
+    this._frame = null
+    /**
+     * Whether the user scrolled since the last render.
+     */
+    this._scrolled = false
   }
 
   init () {
@@ -72,29 +130,145 @@ class Table {
   }
 
   /**
-   *
-   * @param {string[][]} rows
+   * Shows the first rows of a result.
+   * @param {Array[]} rows
    * @param {string[]?} header
    */
   set (rows, header = null) {
-    this.init()
+    this._result++
+    this._blocks = new Map([[0, rows]])
+    this._requested = new Set([0])
+    this.total = rows.length
+    // Getting the block tells if there are more rows, until counted
+    this.exact = rows.length < BLOCK_ROWS
     if (header) {
-      const row = this.el.tHead.insertRow()
-      let html = '<th></th>'
-      for (let h of header) {
-        html += `<th class="col"><div>&nbsp;&nbsp;${h}&nbsp;&nbsp;</div></th>`
-      }
-      row.innerHTML = html
+      this.header = header
+      this.init()
+      this._setColumns(rows)
     }
-    for (let i = 0; i < rows.length; i++) {
-      const row = rows[i]
-      const domRow = this.el.tBodies[0].insertRow()
-      domRow.innerHTML = `<th class="row">${i}</th>`
-      for (let c of row) {
-        const domCell = domRow.insertCell()
-        domCell.innerHTML = `${c}`
+    this.render()
+  }
+
+  /**
+   * Sets the rows of the result, once estimated or counted.
+   * @param {number} total
+   * @param {boolean} exact
+   */
+  setTotal (total, exact) {
+    if (this.exact && !exact) return // We reached the end already
+    const loaded = Math.max(...[...this._blocks].map(([b, rows]) => b * BLOCK_ROWS + rows.length))
+    this.total = exact ? total : Math.max(total, loaded)
+    this.exact = exact
+    this.scheduleRender()
+  }
+
+  scrollToTop () {
+    this.scroller.scrollTop = 0
+  }
+
+  scheduleRender () {
+    if (this._frame === null) {
+      this._frame = requestAnimationFrame(() => {
+        this._frame = null
+        this.render()
+      })
+    }
+  }
+
+  /**
+   * Renders the visible rows between two rows that take the
+   * space of the rest, getting the blocks of rows we do not have.
+   */
+  render () {
+    const height = this.rowHeight || 20
+    const scale = Math.min(1, MAX_HEIGHT / (this.total * height))
+    const visible = Math.ceil(this.scroller.clientHeight / height)
+    const top = Math.floor(this.scroller.scrollTop / (height * scale))
+    const first = Math.max(Math.min(top, this.total - visible) - OVERSCAN_ROWS, 0)
+    const last = Math.min(top + visible + OVERSCAN_ROWS, this.total)
+    let html = `<tr style="height: ${first * height * scale}px"></tr>`
+    for (let i = first; i < last; i++) {
+      const block = this._blocks.get(Math.floor(i / BLOCK_ROWS))
+      const row = block && block[i % BLOCK_ROWS]
+      html += `<tr><th class="row">${i}</th>`
+      if (row) {
+        for (let c of row) html += `<td>${c}</td>`
+      } else {
+        html += `<td colspan="${this.header.length}">…</td>`
       }
+      html += '</tr>'
+    }
+    html += `<tr style="height: ${(this.total - last) * height * scale}px"></tr>`
+    this.el.tBodies[0].innerHTML = html
+    if (!this.rowHeight && last > first) {
+      this.rowHeight = this.el.tBodies[0].rows[1].getBoundingClientRect().height
+      if (this.rowHeight) this.scheduleRender()
     }
+    if (last > first) this._get(Math.floor(first / BLOCK_ROWS), Math.floor((last - 1) / BLOCK_ROWS))
+    // There can be more rows than estimated, which the user
+    // scrolling to the end reveals
+    const end = this._blocks.has(Math.floor((last - 1) / BLOCK_ROWS))
+    if (this._scrolled && !this.exact && last === this.total && end) {
+      this.total += BLOCK_ROWS
+      this.scheduleRender()
+    }
+    this._scrolled = false
+  }
+
+  /**
+   * Gets from the query the blocks of rows we do not have.
+   */
+  _get (firstBlock, lastBlock) {
+    const source = window.query.source
+    if (!source) return // The rows are not from a query
+    const result = this._result
+    for (let b = firstBlock; b <= lastBlock; b++) {
+      if (this._requested.has(b)) continue
+      this._requested.add(b)
+      pywebview.api.rows(source.query, BLOCK_ROWS, b, source.session).then(rows => {
+        if (result !== this._result) return
+        rows = rows || [] // The query failed
+        this._blocks.set(b, rows)
+        if (rows.length < BLOCK_ROWS) {
+          this.total = b * BLOCK_ROWS + rows.length
+          this.exact = true
+        }
+        this._forget(b)
+        this.scheduleRender()
+      })
+    }
+  }
+
+  /**
+   * Forgets the blocks farthest from the one we got, over MAX_BLOCKS.
+   */
+  _forget (block) {
+    const blocks = [...this._blocks.keys()].sort((a, b) => Math.abs(a - block) - Math.abs(b - block))
+    for (let b of blocks.slice(MAX_BLOCKS)) {
+      this._blocks.delete(b)
+      this._requested.delete(b)
+    }
+  }
+
+  /**
+   * Sets the header and fixes the width of the columns from their
+   * first rows, so they do not change as the user scrolls.
+   */
+  _setColumns (rows) {
+    const widths = this.header.map((h, i) => {
+      const longest = Math.max(`${h}`.length + 4, ...rows.map(row => `${row[i]}`.length))
+      return Math.min(Math.max(longest, 4), 40) + 2
+    })
+    const digits = 10 // Of the number of the row
+    let html = `<colgroup><col style="width: ${digits}ch">`
+    for (let w of widths) html += `<col style="width: ${w}ch">`
+    this.el.insertAdjacentHTML('afterbegin', html + '</colgroup>')
+    this.el.style.width = `${digits + widths.reduce((a, b) => a + b, 0)}ch`
+    let header = '<th></th>'
+    for (let h of this.header) {
+      header += `<th class="col"><div>&nbsp;&nbsp;${h}&nbsp;&nbsp;</div></th>`
+    }
+    this.el.tHead.insertRow().innerHTML = header
   }
 }
 
@@ -102,17 +276,21 @@ class Query {
   constructor () {
     this.queryEditor = null
     this._disabled = false
-    this.message = document.getElementById('query-message')
-    console.assert(this.message)
+    this._submitted = false
+    this._submissions = 0
     /**
-     * @type {HTMLInputElement}
+     * The id of the result session of the last query, which serves
+     * its other pages without running it again.
+     * @type {?string}
      */
-    this._limit = document.getElementById('limit')
-    console.assert(this._limit)
-    this.limit = 100 // Set limit before being able to handle changes
-    this._limit.onchange = () => {
-      this.submitQuery()
-    }
+    this._session = null
+    /**
+     * The last submitted query, whose rows the table shows.
+     * @type {?string}
+     */
+    this._submittedQuery = null
+    this.message = document.getElementById('query-message')
+    console.assert(this.message)
     /**
      *
      * @type {HTMLFormElement}
@@ -129,15 +307,18 @@ class Query {
      * @private
      */
     this._queryFormSubmit = document.getElementById('query-submit')
-
     /**
-     * @type {HTMLInputElement}
+     * @type {HTMLButtonElement}
+     * @private
      */
-    this._page = document.getElementById('page')
-    this.page = 0
-    this._page.onchange = () => {
-      this.submitQuery(false)
+    this._cancel = document.getElementById('query-cancel')
+    this._cancel.onclick = () => {
+      pywebview.api.cancel_query()
     }
+    /**
+     * @type {HTMLOutputElement}
+     */
+    this._count = document.getElementById('count')
   }
 
   init (sheetName, headers) {
@@ -146,11 +327,55 @@ class Query {
     this._queryForm.hidden = false
   }
 
-  submitQuery (resetPage = true) {
+  /**
+   * Shows the first rows of the query in the table, which gets the
+   * rest as the user scrolls.
+   * @param {boolean} fromTop Whether to scroll the table to the top.
+   * @param {?string} query The query to submit, the editor's if null.
+   */
+  submitQuery (fromTop = true, query = null) {
     if (this._disabled) throw Error('Cannot query while disabled.')
-    if (resetPage) this.page = 0
+    if (fromTop) {
+      window.table.scrollToTop()
+      this.setCount(null)
+    }
     this.message.innerText = ''
-    pywebview.api.query(this.query, this.limit, this.page)
+    this._submitted = true
+    this._submittedQuery = query === null ? this.query : query
+    // Stopping a query that runs for too long
+    const submission = ++this._submissions
+    this._cancel.hidden = false
+    pywebview.api.query(this._submittedQuery, BLOCK_ROWS, 0, this._session).then(session => {
+      if (submission === this._submissions) this._session = session
+    }).finally(() => {
+      if (submission === this._submissions) this._cancel.hidden = true
+    })
+  }
+
+  /**
+   * Executes again the last submitted query keeping the scroll of
+   * the table, or the query of the editor if none, so the table can
+   * get the rows of the sheets as the user scrolls.
+   */
+  refresh () {
+    if (!this.queryEditor || this._disabled) return
+    if (this._submitted) this.submitQuery(false, this._submittedQuery)
+    else this.submitQuery()
+  }
+
+  /**
+   * Shows the rows of the result of the query, which are estimated
+   * if not exact, sizing the table with them.
+   * @param {?number} count
+   * @param {boolean} exact
+   */
+  setCount (count, exact = false) {
+    if (count === null) {
+      this._count.value = ''
+      return
+    }
+    this._count.value = `${exact ? '' : '~'}${count.toLocaleString()}`
+    window.table.setTotal(count, exact)
   }
 
   setMessage (message) {
@@ -162,11 +387,11 @@ class Query {
   }
 
   enable () {
-    this._disabled = this._limit.disabled = this._page.disabled = this._queryFormSubmit.disabled = false
+    this._disabled = this._queryFormSubmit.disabled = false
   }
 
   disable () {
-    this._disabled = this._limit.disabled = this._page.disabled = this._queryFormSubmit.disabled = true
+    this._disabled = this._queryFormSubmit.disabled = true
   }
 
   /**
@@ -183,22 +408,15 @@ class Query {
     return this.queryEditor.getValue()
   }
 
-  get limit () {
-    return parseInt(this._limit.value)
-  }
-
-  set limit (v) {
-    this._limit.value = v
-  }
-
-  get page () {
-    return parseInt(this._page.value)
-  }
-
-  set page (v) {
-    this._page.value = v
+  /**
+   * The query and result session the rows of the table come from,
+   * or null if they do not come from a query.
+   * @returns {?{query: string, session: ?string}}
+   */
+  get source () {
+    if (!this._submitted) return null
+    return {query: this._submittedQuery, session: this._session}
   }
-
 }
 
 class Nav {
@@ -216,6 +434,10 @@ class Nav {
     this._openSheetBtn.onclick = () => {
       pywebview.api.open_sheet()
     }
+    this._deriveSheetBtn = document.getElementById('derive-sheet-button')
+    this._deriveSheetBtn.onclick = () => {
+      pywebview.api.derive_sheet(window.query.query)
+    }
     this._exportViewBtn = document.getElementById('export-view-button')
     this._exportViewBtn.onclick = () => {
       pywebview.api.export_view(window.query.query)
@@ -224,19 +446,23 @@ class Nav {
     this._saveWorkspaceBtn.onclick = () => {
       pywebview.api.save_workspace()
     }
+    this._clearImportCacheBtn = document.getElementById('clear-import-cache-button')
+    this._clearImportCacheBtn.onclick = () => {
+      pywebview.api.clear_import_cache()
+    }
     this.disable()
   }
 
   disable () {
     this._openWindowBtn.disabled = this._sheetsBtn.disabled = this._openSheetBtn.disabled =
-      this._exportViewBtn.disabled = this._saveWorkspaceBtn.disabled
-        = true
+      this._deriveSheetBtn.disabled = this._exportViewBtn.disabled =
+      this._saveWorkspaceBtn.disabled = this._clearImportCacheBtn.disabled = true
   }
 
   enable () {
     this._openWindowBtn.disabled = this._sheetsBtn.disabled = this._openSheetBtn.disabled =
-      this._exportViewBtn.disabled = this._saveWorkspaceBtn.disabled
-        = false
+      this._deriveSheetBtn.disabled = this._exportViewBtn.disabled =
+      this._saveWorkspaceBtn.disabled = this._clearImportCacheBtn.disabled = false
   }
 }
 
@@ -255,17 +481,56 @@ class SheetsButton {
   }
 
   _content () {
-    const sheets = this.sheets.map(({filename, name}) => {
+    const sheets = this.sheets.map(({filename, name, followable, following, footprint, onDisk, indexes, query}) => {
       const delElementButton = document.createElement('button')
       delElementButton.className = 'close-button'
       delElementButton.innerHTML = '<i class=\'fa fa-lg fa-times\'></i>'
       delElementButton.onclick = () => this.removeSheet(name)
       delElementButton.style = 'margin-right:1em'
       const text = document.createElement('span')
-      text.innerHTML = `${filename}&nbsp;<em>as</em>&nbsp;<strong>${name}</strong>`
+      // Derived sheets store the results of a query
+      text.innerHTML = `${query ? `<code>${query}</code>` : filename}&nbsp;<em>as</em>&nbsp;<strong>${name}</strong>`
+      // Sheets over the memory budget are stored in the disk
+      const size = document.createElement('small')
+      size.innerHTML = `&nbsp;(${footprint}${onDisk ? ' in disk' : ''})`
+      text.appendChild(size)
       const div = document.createElement('div')
       div.appendChild(delElementButton)
+      if (followable) {
+        // Follow loads the rows appended to the file, as "tail -f"
+        const followButton = document.createElement('button')
+        followButton.className = 'close-button'
+        followButton.innerHTML = `<i class='fa fa-lg ${following ? 'fa-eye-slash' : 'fa-eye'}'></i>`
+        followButton.title = following ? 'Stop following the file' : 'Follow the rows appended to the file'
+        followButton.onclick = () => this.followSheet(name, !following)
+        followButton.style = 'margin-right:1em'
+        div.appendChild(followButton)
+      }
+      if (query) {
+        const refreshButton = document.createElement('button')
+        refreshButton.className = 'close-button'
+        refreshButton.innerHTML = '<i class=\'fa fa-lg fa-sync\'></i>'
+        refreshButton.title = 'Run the query again'
+        refreshButton.onclick = () => this.refreshSheet(name)
+        refreshButton.style = 'margin-right:1em'
+        div.appendChild(refreshButton)
+      }
       div.appendChild(text)
+      // The columns indexed from the queries, which the user can drop
+      for (const column of indexes) {
+        const index = document.createElement('div')
+        index.style = 'margin-left:3em'
+        const dropButton = document.createElement('button')
+        dropButton.className = 'close-button'
+        dropButton.innerHTML = '<i class=\'fa fa-times\'></i>'
+        dropButton.title = 'Drop the index'
+        dropButton.onclick = () => this.dropIndex(name, column)
+        dropButton.style = 'margin-right:1em'
+        const indexText = document.createElement('small')
+        indexText.innerHTML = `<i class='fa fa-bolt'></i>&nbsp;Index of <strong>${column}</strong>`
+        index.append(dropButton, indexText)
+        div.appendChild(index)
+      }
       return div
     })
     const content = document.createElement('div')
@@ -282,6 +547,18 @@ class SheetsButton {
   removeSheet (name) {
     pywebview.api.remove_sheet(name)
   }
+
+  followSheet (name, follow) {
+    pywebview.api.follow_sheet(name, follow)
+  }
+
+  dropIndex (name, column) {
+    pywebview.api.drop_index(name, column)
+  }
+
+  refreshSheet (name) {
+    pywebview.api.refresh_sheet(name)
+  }
 }
 
 const darkMode = window.matchMedia && window.matchMedia('(prefers-color-scheme: dark)').matches
@@ -8,7 +8,9 @@ class Warnings {
    * @typedef WrongRow
    * @extends SheetError
    * @property {string} - sheet_name
-   * @property {Array.<string|number|null>} - row
+   * @property {number} - number The number of the row in the file
+   * @property {number} - cells
+   * @property {?Array.<string|number|null>} - row Only for the first rows
    */
   /**
    * @typedef OpeningFileFailed
@@ -23,13 +25,14 @@ class Warnings {
      */
     this.el = document.getElementById('main')
     console.assert(this.el)
+    this.PAGE_SIZE = 100
   }
 
   async getErrors () {
     try {
-      const errors = await pywebview.api.errors()
-      console.info(errors)
-      this.set(errors)
+      const counts = await pywebview.api.error_counts()
+      console.info(counts)
+      this.set(counts)
     } catch (e) {
       console.error(e)
       throw e
@@ -37,20 +40,30 @@ class Warnings {
   }
 
   /**
-   * @param {Object.<string, SheetError[]>} errors
+   * Shows the files with errors, loading their errors by pages.
+   * @param {Object.<string, number>} counts The number of errors per file.
    */
-  set (errors) {
-    if (Object.keys(errors).length === 0) {
+  set (counts) {
+    if (Object.keys(counts).length === 0) {
       this.el.innerHTML = "Hooray! No errors in here."
       return
     }
-    let html = ''
-    for (let [filename, _errors] of Object.entries(errors)) {
-      html += `<h3>File ${filename}</h3>`
-      const els = _errors.map(e => `<li>${this.printError(e)}</li>`)
-      html += `<ul>${els}</ul>`
+    this.el.innerHTML = ''
+    for (let [filename, count] of Object.entries(counts)) {
+      const title = document.createElement('h3')
+      title.textContent = `File ${filename} (${count} errors)`
+      const list = document.createElement('ul')
+      const more = document.createElement('button')
+      more.textContent = 'Show more'
+      let page = 0
+      more.onclick = async () => {
+        const errors = await pywebview.api.errors(filename, page++, this.PAGE_SIZE)
+        list.insertAdjacentHTML('beforeend', errors.map(e => `<li>${this.printError(e)}</li>`).join(''))
+        more.hidden = list.childElementCount >= count
+      }
+      this.el.append(title, list, more)
+      more.onclick()
     }
-    this.el.innerHTML = html
   }
 
   /**
@@ -59,7 +72,8 @@ class Warnings {
    */
   printError (e) {
     if (e.type === 'WrongRow') {
-      return `The row is wrong: <code>${e.row}</code>.`
+      const cells = e.row ? `: <code>${e.row}</code>` : ''
+      return `Row ${e.number} of ${e.sheet_name} has ${e.cells} cells${cells}.`
     } else {
       return `The file could not be opened because of <code>${e.error}</code>.`
     }
@@ -25,19 +25,38 @@ class UIPort(abc.ABC):
         raise NotImplementedError
 
     @abc.abstractmethod
-    def ask_user_for_sheet(self) -> t.Optional[Path]:
+    def ask_user_for_sheets(self) -> t.List[Path]:
+        """Asks the user for one or more sheets or a workspace."""
         raise NotImplementedError
 
     @abc.abstractmethod
     def start_opening_sheet(self, sheet: sheet.Sheet):
+        """A sheet started opening, maybe with others at the same time."""
         raise NotImplementedError
 
     @abc.abstractmethod
-    def update_sheet_opening(self, completed: int):
+    def update_sheet_opening(self, sheet: sheet.Sheet, completed: int):
         raise NotImplementedError
 
     @abc.abstractmethod
-    def sheet_opened(self, opened_sheets: sheet.Sheet):
+    def update_sheet_opening_total(self, sheet: sheet.Sheet, total: int):
+        """The estimated number of rows of the opening sheet changed."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def sheet_opening_failed(self, sheet: sheet.Sheet):
+        """The sheet failed after it started opening."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def sheet_opened(self, sheet: sheet.Sheet, *opened_sheets: sheet.Sheet):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def sheet_updated(
+        self, sheet: sheet.Sheet, rows_changed: bool, *opened_sheets: sheet.Sheet
+    ):
+        """The rows of the sheet changed, or whether it is followed."""
         raise NotImplementedError
 
     @abc.abstractmethod
@@ -19,6 +19,28 @@ class OpenSheet(Command):
     filepath: Path
 
 
+@dataclass
+class OpenSheets(Command):
+    """Opens several sheets at the same time."""
+
+    filepaths: t.Collection[Path]
+
+
+@dataclass
+class FollowSheet(Command):
+    """Starts, or stops, loading the rows appended to the file of
+    a sheet.
+    """
+
+    name: str
+    follow: bool = True
+
+
+@dataclass
+class LoadAppendedRows(Command):
+    name: str
+
+
 @dataclass
 class OpenWindow(Command):
     pass
@@ -44,3 +66,30 @@ class SaveWorkspace(Command):
 @dataclass
 class LoadWorkspace(Command):
     filepath: Path
+
+
+@dataclass
+class ClearImportCache(Command):
+    pass
+
+
+@dataclass
+class DropIndex(Command):
+    """Removes the index of a column of a sheet."""
+
+    name: str
+    column: str
+
+
+@dataclass
+class DeriveSheet(Command):
+    """Stores the results of a query as a new sheet."""
+
+    query: str
+
+
+@dataclass
+class RefreshSheet(Command):
+    """Runs again the query of a derived sheet."""
+
+    name: str
@@ -1,6 +1,8 @@
 from __future__ import annotations
 
 import abc
+import typing as t
+from array import array
 
 from bigsheets.domain import sheet as sheet_model
 
@@ -12,22 +14,73 @@ class Error(abc.ABC):
         self.filename = filename
 
     def dict(self) -> dict:
-        d = vars(self)
+        d = dict(vars(self))
         d["type"] = self.__class__.__name__
         return d
 
-    def __hash__(self):
-        return hash(self.filename)
+    def records(self, start: int = 0, stop: t.Optional[int] = None) -> t.List[dict]:
+        """The errors this represents, as dicts, from start to stop."""
+        return [self.dict()][start:stop]
 
+    def __len__(self):
+        """The number of errors this represents."""
+        return 1
 
-class WrongRow(Error):
-    def __init__(self, filename: str, sheet_name: str, row: sheet_model.Row):
-        self.sheet_name = sheet_name
-        self.row = row
+
+class WrongRows(Error):
+    """The rows of a sheet that do not have as many cells as the header.
+
+    As files can have many wrong rows, we only keep the number and the
+    number of cells of each row, plus the cells of the first SAMPLES
+    rows.
+    """
+
+    SAMPLES = 1000
+
+    def __init__(self, filename: str, sheet_name: str):
         super().__init__(filename)
+        self.sheet_name = sheet_name
+        self.numbers = array("q")
+        """The number of each row in the file, the first row after
+        the header being 1.
+        """
+        self.cells = array("l")
+        self.samples: sheet_model.Rows = []
+
+    def add(self, number: int, row: sheet_model.Row):
+        self.numbers.append(number)
+        self.cells.append(len(row))
+        if len(self.samples) < self.SAMPLES:
+            self.samples.append(row)
+
+    def extend(self, other: WrongRows):
+        self.numbers.extend(other.numbers)
+        self.cells.extend(other.cells)
+        self.samples.extend(other.samples[: self.SAMPLES - len(self.samples)])
+
+    def records(self, start: int = 0, stop: t.Optional[int] = None) -> t.List[dict]:
+        return [
+            {
+                "type": "WrongRow",
+                "filename": self.filename,
+                "sheet_name": self.sheet_name,
+                "number": self.numbers[i],
+                "cells": self.cells[i],
+                "row": self.samples[i] if i < len(self.samples) else None,
+            }
+            for i in range(len(self))[start:stop]
+        ]
+
+    def __len__(self):
+        return len(self.numbers)
 
 
 class OpeningFileFailed(Error):
     def __init__(self, filename: str, error: Exception):
         self.error = error
         super().__init__(filename)
+
+    def dict(self) -> dict:
+        d = super().dict()
+        d["error"] = str(self.error)
+        return d
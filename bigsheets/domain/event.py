@@ -16,9 +16,35 @@ class SheetOpened(Event):
     opened_sheets: t.Collection[sheet.Sheet]
 
 
+@dataclass
+class SheetUpdated(Event):
+    """The rows of an opened sheet changed, or whether it is
+    followed.
+    """
+
+    sheet: sheet.Sheet
+    opened_sheets: t.Collection[sheet.Sheet]
+    appended_rows: int = 0
+    reloaded: bool = False
+    """Whether the file was truncated, so the sheet was loaded again."""
+
+
 @dataclass
 class SheetRemoved(Event):
     remaining_sheets: t.Collection[sheet.Sheet]
 
-# todo missing event for WorkspaceLoaded
+
+@dataclass
+class QueryExecuted(Event):
+    """The user queried the sheets."""
+
+    query: str
+
+
+@dataclass
+class WorkspaceLoaded(Event):
+    """The sheets of a workspace replaced the opened ones."""
+
+    opened_sheets: t.Collection[sheet.Sheet]
+
 # todo missing event for WorkspaceSaved
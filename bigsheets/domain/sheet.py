@@ -21,7 +21,13 @@ class Sheet:
     """
 
     def __init__(
-        self, name: str, rows: Rows, header: Row, num_rows: int, filename: str
+        self,
+        name: str,
+        rows: Rows,
+        header: Row,
+        num_rows: int,
+        filename: str,
+        types: t.Optional[t.List[str]] = None,
     ):
         self.rows: Rows = rows
         """The rows of the sheet. For a sheet that is opening,
@@ -38,6 +44,38 @@ class Sheet:
          """
         self.header: Row = header
         self.filename = filename
+        self.types = types
+        """The types of the columns, in the same order as the header:
+        INTEGER, REAL, TEXT, or DATE —as ISO 8601 text. None if the
+        types of the columns are not inferred.
+        """
+        self.source: t.Any = None
+        """Where the rows of the sheet were loaded from, which the
+        sheets repository sets to load the rows appended to the file
+        afterwards. None when it cannot, like for compressed files.
+        """
+        self.stats: t.Any = None
+        """The statistics of the columns, which the sheets repository
+        collects while loading the rows. None if it does not.
+        """
+        self.following = False
+        """Whether to load the rows appended to the file of the sheet."""
+        self.footprint = 0
+        """The approx. bytes the rows of the sheet take in the database."""
+        self.on_disk = False
+        """Whether the rows are stored in the disk, as they did not
+        fit in the memory budget.
+        """
+        self.indexes: t.Dict[str, int] = {}
+        """The columns indexed from the queries of the user, and the
+        approx. bytes of their indexes.
+        """
+        self.query: t.Optional[str] = None
+        """The query whose results a derived sheet stores, which
+        refreshes it when run again. None for the sheets of files.
+        """
+        self.sources: t.List[str] = []
+        """The sheets the query of a derived sheet reads."""
 
     def __str__(self):
         return f"Sheet {self.name}"
@@ -1,9 +1,15 @@
+import multiprocessing
+
 from bigsheets.service.utils import ensure_utf8, setup_logging
 
-setup_logging()
-ensure_utf8()
+if __name__ == "__main__":
+    # Processes parsing CSVs import this module, so only the
+    # main process starts the app
+    multiprocessing.freeze_support()
+    setup_logging()
+    ensure_utf8()
 
-from bigsheets.app import BigSheets
+    from bigsheets.app import BigSheets
 
-bs = BigSheets()
-bs.start()
+    bs = BigSheets()
+    bs.start()
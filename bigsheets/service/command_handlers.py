@@ -1,13 +1,18 @@
 from __future__ import annotations
 
+import logging
+import threading
 import typing as t
+from concurrent.futures import ThreadPoolExecutor
 
 from bigsheets.adapters.sheets import sheets as sheets_adapter
 from bigsheets.adapters.ui import ui_port
-from bigsheets.domain import command, event, sheet
-from bigsheets.service import message_bus, unit_of_work
+from bigsheets.domain import command, error as error_model, event, sheet
+from bigsheets.service import message_bus, running, unit_of_work
 from bigsheets.service.handler import Handler, Handlers
 
+log = logging.getLogger(__name__)
+
 
 class OpenSheetSelector(Handler):
     HANDLES = {command.AskUserForASheetOrWorkspace}
@@ -17,11 +22,16 @@ class OpenSheetSelector(Handler):
         self.bus = bus
 
     def __call__(self, message: command.AskUserForASheetOrWorkspace):
-        if filepath := self.ui.ask_user_for_sheet():
-            if filepath.suffix == ".bsw":
-                self.bus.handle(command.LoadWorkspace(filepath))
-            else:
-                return self.bus.handle(command.OpenSheet(filepath))
+        filepaths = self.ui.ask_user_for_sheets()
+        if len(filepaths) == 1 and filepaths[0].suffix == ".bsw":
+            self.bus.handle(command.LoadWorkspace(filepaths[0]))
+        elif len(filepaths) == 1:
+            return self.bus.handle(command.OpenSheet(filepaths[0]))
+        elif filepaths:
+            if workspaces := [f for f in filepaths if f.suffix == ".bsw"]:
+                log.info("Ignoring workspaces %s opened with sheets", workspaces)
+            sheets = [f for f in filepaths if f.suffix != ".bsw"]
+            return self.bus.handle(command.OpenSheets(sheets))
 
 
 class OpenSheet(Handler):
@@ -32,28 +42,147 @@ class OpenSheet(Handler):
             super().__init__()
             self.ui = ui
 
+            self.sheet: t.Optional[sheet.Sheet] = None
+
         def on_init(self, sheet: sheet.Sheet):
             super().on_init(sheet)
+            self.sheet = sheet
             self.ui.start_opening_sheet(sheet)
 
         def on_it(self, n: int):
             super().on_it(n)
-            self.ui.update_sheet_opening(self.total)
+            self.ui.update_sheet_opening(self.sheet, self.total)
+
+        def on_estimate(self, total: int):
+            super().on_estimate(total)
+            self.ui.update_sheet_opening_total(self.sheet, total)
 
     def __init__(self, uow: unit_of_work.UnitOfWork, ui: ui_port.UIPort):
         self.uow = uow
         self.ui = ui
 
     def __call__(self, message: command.OpenSheet):
-        with self.uow.instantiate() as uow:
-            sheet, wrong_rows = uow.sheets.open_sheet(
-                message.filepath, update_handler=self.Update(self.ui)
-            )
-            uow.errors.add(*wrong_rows)
-            uow.commit(event.SheetOpened(sheet, tuple(uow.sheets.get())))
+        update = self.Update(self.ui)
+        try:
+            with self.uow.instantiate() as uow:
+                sheet, wrong_rows = uow.sheets.open_sheet(
+                    message.filepath, update_handler=update
+                )
+                uow.errors.add(wrong_rows)
+                uow.commit(event.SheetOpened(sheet, tuple(uow.sheets.get())))
+        except BaseException:
+            if update.sheet:  # The UI shows it opening
+                self.ui.sheet_opening_failed(update.sheet)
+            raise
         return sheet
 
 
+class OpenSheets(Handler):
+    """Opens several sheets at the same time, each one through
+    the OpenSheet command in its own thread.
+
+    The threads parse the files concurrently, whereas SheetsAdaptor
+    serializes their writes to the database. A sheet failing to open
+    does not stop the others.
+    """
+
+    HANDLES = {command.OpenSheets}
+    MAX_CONCURRENT_LOADS = 4
+
+    def __init__(self, bus: message_bus.MessageBus, uow: unit_of_work.UnitOfWork):
+        self.bus = bus
+        self.uow = uow
+
+    def __call__(self, message: command.OpenSheets) -> t.List[sheet.Sheet]:
+        with ThreadPoolExecutor(
+            self.MAX_CONCURRENT_LOADS, thread_name_prefix=self.__class__.__name__
+        ) as pool:
+            futures = [
+                (filepath, pool.submit(self.bus.handle, command.OpenSheet(filepath)))
+                for filepath in message.filepaths
+            ]
+        opened, failed = [], []
+        for filepath, future in futures:
+            try:
+                opened.append(future.result())
+            except running.Exiting:
+                raise
+            except Exception as e:
+                failed.append(error_model.OpeningFileFailed(filepath.name, e))
+        if failed:
+            with self.uow.instantiate() as uowi:
+                uowi.errors.add(*failed)
+        return opened
+
+
+class FollowSheet(Handler):
+    """Follows a sheet by checking every INTERVAL seconds whether its
+    file has new rows, in a thread per followed sheet.
+    """
+
+    HANDLES = {command.FollowSheet}
+    INTERVAL = 2
+
+    def __init__(self, bus: message_bus.MessageBus, uow: unit_of_work.UnitOfWork):
+        self.bus = bus
+        self.uow = uow
+        self._stops: t.Dict[str, threading.Event] = {}
+        """Stops following a sheet when set."""
+        self._lock = threading.Lock()
+
+    def __call__(self, message: command.FollowSheet):
+        with self.uow.instantiate() as uowi:
+            sheet = uowi.sheets.follow(name=message.name, follow=message.follow)
+            uowi.commit(event.SheetUpdated(sheet, tuple(uowi.sheets.get())))
+        with self._lock:
+            if stop := self._stops.pop(message.name, None):
+                stop.set()
+            if message.follow:
+                stop = self._stops[message.name] = threading.Event()
+                threading.Thread(
+                    target=self._follow,
+                    args=(message.name, stop),
+                    name=f"{self.__class__.__name__} {message.name}",
+                    daemon=True,
+                ).start()
+
+    def _follow(self, name: str, stop: threading.Event):
+        while not stop.wait(self.INTERVAL) and not running.exiting:
+            try:
+                if not self.bus.handle(command.LoadAppendedRows(name)):
+                    break
+            except Exception:  # The bus logs it
+                break
+        with self._lock:
+            if self._stops.get(name) is stop:
+                del self._stops[name]
+
+
+class LoadAppendedRows(Handler):
+    HANDLES = {command.LoadAppendedRows}
+
+    def __init__(self, uow: unit_of_work.UnitOfWork):
+        self.uow = uow
+
+    def __call__(self, message: command.LoadAppendedRows) -> bool:
+        """Returns whether the sheet is still followed."""
+        with self.uow.instantiate() as uowi:
+            sheets = {sheet.name: sheet for sheet in uowi.sheets.get()}
+            if not getattr(sheets.get(message.name), "following", False):
+                return False  # The sheet was removed or unfollowed
+            sheet, appended, reloaded, wrong_rows = uowi.sheets.load_appended_rows(
+                name=message.name
+            )
+            if appended or reloaded:
+                uowi.errors.add(wrong_rows)
+                uowi.commit(
+                    event.SheetUpdated(
+                        sheet, tuple(uowi.sheets.get()), appended, reloaded
+                    )
+                )
+        return True
+
+
 class RemoveSheet(Handler):
     HANDLES = {command.RemoveSheet}
 
@@ -133,16 +262,73 @@ class LoadWorkspace(Handler):
             queries = uowi.sheets.load_workspace(
                 message.filepath, update_handler=self.Update(self.ui)
             )
-            uowi.commit()
+            uowi.commit(event.WorkspaceLoaded(tuple(uowi.sheets.get())))
         # todo we should use an event instead of directly calling the UI
         self.ui.finish_loading_workspace(queries)
 
 
+class ClearImportCache(Handler):
+    HANDLES = {command.ClearImportCache}
+
+    def __init__(self, uow: unit_of_work.UnitOfWork):
+        self.uow = uow
+
+    def __call__(self, message: command.ClearImportCache):
+        with self.uow.instantiate() as uowi:
+            uowi.sheets.clear_import_cache()
+
+
+class DropIndex(Handler):
+    HANDLES = {command.DropIndex}
+
+    def __init__(self, uow: unit_of_work.UnitOfWork):
+        self.uow = uow
+
+    def __call__(self, message: command.DropIndex):
+        with self.uow.instantiate() as uowi:
+            sheet = uowi.sheets.drop_index(name=message.name, column=message.column)
+            uowi.commit(event.SheetUpdated(sheet, tuple(uowi.sheets.get())))
+
+
+class DeriveSheet(Handler):
+    HANDLES = {command.DeriveSheet}
+
+    def __init__(self, uow: unit_of_work.UnitOfWork):
+        self.uow = uow
+
+    def __call__(self, message: command.DeriveSheet) -> sheet.Sheet:
+        with self.uow.instantiate() as uowi:
+            sheet = uowi.sheets.derive_sheet(message.query)
+            uowi.commit(event.SheetOpened(sheet, tuple(uowi.sheets.get())))
+        return sheet
+
+
+class RefreshSheet(Handler):
+    HANDLES = {command.RefreshSheet}
+
+    def __init__(self, uow: unit_of_work.UnitOfWork):
+        self.uow = uow
+
+    def __call__(self, message: command.RefreshSheet):
+        with self.uow.instantiate() as uowi:
+            sheet = uowi.sheets.refresh_sheet(name=message.name)
+            uowi.commit(
+                event.SheetUpdated(sheet, tuple(uowi.sheets.get()), reloaded=True)
+            )
+
+
 HANDLERS: Handlers = {
     OpenSheet,
+    OpenSheets,
     OpenSheetSelector,
+    FollowSheet,
+    LoadAppendedRows,
     RemoveSheet,
     ExportView,
     SaveWorkspace,
     LoadWorkspace,
+    ClearImportCache,
+    DropIndex,
+    DeriveSheet,
+    RefreshSheet,
 }
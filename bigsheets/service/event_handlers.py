@@ -1,7 +1,10 @@
 from __future__ import annotations
 
+import typing as t
+
 from bigsheets.adapters.ui import ui_port
-from bigsheets.domain import event as e
+from bigsheets.domain import command, event as e
+from bigsheets.service import message_bus, read_model, unit_of_work
 from bigsheets.service.handler import Handler, Handlers
 
 
@@ -12,7 +15,18 @@ class UpdateUISheetOpened(Handler):
         self.ui = ui
 
     def __call__(self, message: e.SheetOpened):
-        self.ui.sheet_opened(*message.opened_sheets)
+        self.ui.sheet_opened(message.sheet, *message.opened_sheets)
+
+
+class UpdateUISheetUpdated(Handler):
+    HANDLES = {e.SheetUpdated}
+
+    def __init__(self, ui: ui_port.UIPort):
+        self.ui = ui
+
+    def __call__(self, message: e.SheetUpdated):
+        rows_changed = bool(message.appended_rows or message.reloaded)
+        self.ui.sheet_updated(message.sheet, rows_changed, *message.opened_sheets)
 
 
 class SheetRemoved(Handler):
@@ -25,4 +39,82 @@ class SheetRemoved(Handler):
         self.ui.sheet_removed(*message.remaining_sheets)
 
 
-HANDLERS: Handlers = {UpdateUISheetOpened, SheetRemoved}
+class AdviseIndexes(Handler):
+    """Indexes the sheets from the queries of the user, in the
+    background.
+    """
+
+    HANDLES = {e.QueryExecuted}
+
+    def __init__(self, uow: unit_of_work.UnitOfWork):
+        self.uow = uow
+
+    def __call__(self, message: e.QueryExecuted):
+        with self.uow.instantiate() as uowi:
+            if indexed := uowi.sheets.advise_indexes(message.query):
+                sheets = tuple(uowi.sheets.get())
+                uowi.commit(*(e.SheetUpdated(sheet, sheets) for sheet in indexed))
+
+
+class InvalidateQueryResults(Handler):
+    """Changes the version of the sheets whose rows changed, so
+    the read model does not return the cached results of their
+    queries.
+
+    It runs before the other handlers, like the ones refreshing the
+    windows, so these do not get the cached results of the old rows.
+    """
+
+    HANDLES = {e.SheetOpened, e.SheetUpdated, e.SheetRemoved, e.WorkspaceLoaded}
+    SYNC = True
+
+    def __init__(self, reader: read_model.ReadModel):
+        self.reader = reader
+
+    def __call__(self, message: e.Event):
+        results = self.reader.results
+        if isinstance(message, e.SheetOpened):
+            results.changed(message.sheet.name)
+        elif isinstance(message, e.SheetUpdated):
+            if message.appended_rows or message.reloaded:
+                results.changed(message.sheet.name)
+        elif isinstance(message, e.SheetRemoved):
+            results.retain({sheet.name for sheet in message.remaining_sheets})
+        elif isinstance(message, e.WorkspaceLoaded):
+            names = {sheet.name for sheet in message.opened_sheets}
+            results.retain(names)
+            results.changed(*names)
+
+
+class RefreshDerivedSheets(Handler):
+    """Refreshes the derived sheets whose source sheets changed,
+    which in turn refreshes the ones derived from them.
+    """
+
+    HANDLES = {e.SheetOpened, e.SheetUpdated}
+
+    def __init__(self, bus: message_bus.MessageBus):
+        self.bus = bus
+
+    def __call__(self, message: t.Union[e.SheetOpened, e.SheetUpdated]):
+        if isinstance(message, e.SheetUpdated) and not (
+            message.appended_rows or message.reloaded
+        ):
+            return
+        opened = {sheet.name for sheet in message.opened_sheets}
+        for sheet in message.opened_sheets:
+            # We cannot refresh a sheet whose other sources were removed
+            if message.sheet.name in sheet.sources and opened.issuperset(
+                sheet.sources
+            ):
+                self.bus.handle(command.RefreshSheet(sheet.name))
+
+
+HANDLERS: Handlers = {
+    UpdateUISheetOpened,
+    UpdateUISheetUpdated,
+    SheetRemoved,
+    AdviseIndexes,
+    InvalidateQueryResults,
+    RefreshDerivedSheets,
+}
@@ -10,6 +10,10 @@ Message = t.Union[event.Event, command.Command]
 
 class Handler(abc.ABC):
     HANDLES: t.Set[t.Union[t.Type[event.Event], t.Type[command.Command]]]
+    SYNC = False
+    """Whether the handler of an event runs before handle returns,
+    for what the other handlers and the sender expect to be done.
+    """
 
     @abc.abstractmethod
     def __call__(self, message: Message):
@@ -79,9 +79,19 @@ class MessageBus:
 
     @handle.register
     def _(self, event: event.Event):
-        """Handle a message in another thread."""
-        for handler in self._get_handlers(event, self.event_handlers):
-            self._pool.submit(partial(self._exec, handler, event))
+        """Handle a message in another thread, or first in this one
+        for the synchronous handlers (see Handler.SYNC).
+        """
+        handlers = self._get_handlers(event, self.event_handlers)
+        for handler in handlers:
+            if getattr(handler, "SYNC", False):
+                try:
+                    self._exec(handler, event)
+                except Exception:  # Logged, and fails independently
+                    pass
+        for handler in handlers:
+            if not getattr(handler, "SYNC", False):
+                self._pool.submit(partial(self._exec, handler, event))
 
     def _exec(self, handler, message):
         name = threading.current_thread().name
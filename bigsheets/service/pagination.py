@@ -0,0 +1,221 @@
+"""Pages the results of the queries of the user by where the previous
+page ended, instead of by LIMIT and OFFSET.
+
+To give a page, OFFSET makes sqlite generate and discard the rows of
+all the pages before, so each page is slower the deeper it is. A query
+that reads a single sheet is rewritten to order its rows by a key:
+the terms of its ORDER BY, and the rowid to tell apart rows with the
+same terms. A page then starts after the key of the last row of the
+previous page (its bookmark), which sqlite seeks to.
+
+Jumping to a page whose bookmark we do not know starts from the
+nearest bookmark before it, reading only the keys of the rows in
+between, and records checkpoints among them so later jumps skip less.
+"""
+from __future__ import annotations
+
+import re
+import threading
+import typing as t
+from collections import OrderedDict
+from dataclasses import dataclass
+
+QUOTED = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")""")
+"""Strings, and quoted identifiers."""
+
+_SELECT = re.compile(
+    r"^\s*SELECT\s+(?P<select>.+?)\s+FROM\s+(?P<table>\w+)"
+    r"(?:\s+(?:AS\s+)?(?!WHERE\b|ORDER\b)(?P<alias>\w+))?"
+    r"(?:\s+WHERE\s+(?P<where>.+?))?"
+    r"(?:\s+ORDER\s+BY\s+(?P<order>.+?))?\s*$",
+    re.IGNORECASE | re.DOTALL,
+)
+_UNSUPPORTED = re.compile(
+    r"\b(?:JOIN|GROUP|HAVING|LIMIT|OFFSET|UNION|INTERSECT|EXCEPT|DISTINCT|WINDOW"
+    r"|OVER|SELECT\b.*\bSELECT|DESC|COLLATE|NULLS"
+    r"|(?:count|sum|avg|min|max|total|group_concat)\s*\()",
+    re.IGNORECASE | re.DOTALL,
+)
+"""What a query cannot have to be paged by its keys, as the rows
+would not be the ones of the table, the keys would not order them
+ascending, or sqlite could not compare them.
+"""
+_ASC = re.compile(r"\s+ASC\s*$", re.IGNORECASE)
+_IDENTIFIER = r'"(?:[^"]|"")*"|\[[^\]]*\]|`(?:[^`]|``)*`|\w+'
+_ALIAS = re.compile(rf"(?:\s|\bAS)\s*({_IDENTIFIER})\s*$", re.IGNORECASE)
+"""The alias of a term of the select, which ORDER BY can name but
+the keys in WHERE cannot.
+"""
+_ROWIDS = ("rowid", "_rowid_", "oid")
+
+Key = t.Tuple[t.Any, ...]
+
+
+@dataclass
+class Keyset:
+    """A query rewritten to page its rows by their keys."""
+
+    select: str
+    source: str
+    """The table, and its alias if any."""
+    where: t.Optional[str]
+    keys: t.List[str]
+    """The expressions that order the rows, ending with the rowid."""
+
+    @classmethod
+    def of(
+        cls, q: str, headers: t.Mapping[str, t.Sequence[str]]
+    ) -> t.Optional[Keyset]:
+        """The keyset of the query, or None if it cannot be paged
+        by its keys.
+
+        :param headers: The header of each sheet by its name.
+        """
+        # Quoted text could look like the clauses
+        masked = QUOTED.sub(lambda m: "_" * len(m[0]), q)
+        if _UNSUPPORTED.search(masked) or not (match := _SELECT.match(masked)):
+            return None
+        table, alias = match["table"], match["alias"]
+        if table not in headers:
+            return None
+        columns = {column.lower() for column in headers[table]}
+        rowid = next((r for r in _ROWIDS if r not in columns), None)
+        if not rowid:
+            return None
+        order = []
+        if match["order"]:
+            select = _split(q[match.start("select") : match.end("select")])
+            found = map(_ALIAS.search, map(str.strip, select))
+            aliases = {_name(m[1]) for m in found if m}
+            start = match.start("order")
+            for term in _split(q[start : match.end("order")]):
+                term = _ASC.sub("", term).strip()
+                if not term or term.isdigit():  # A position of the select
+                    return None
+                # The alias can shadow a column, so the keys would not
+                # be the terms that order the rows
+                if aliases.intersection(map(_name, re.findall(_IDENTIFIER, term))):
+                    return None
+                order.append(term)
+
+        def clause(name: str) -> t.Optional[str]:
+            return q[match.start(name) : match.end(name)] if match[name] else None
+
+        return cls(
+            select=clause("select"),
+            source=f"{table} {alias}" if alias else table,
+            where=clause("where"),
+            keys=[*order, f"{alias or table}.{rowid}"],
+        )
+
+    def page(self, after: bool, limit: int, offset: int = 0) -> str:
+        """The query of the rows, with their keys as the last columns,
+        after a key if after.
+        """
+        return self._q(f"{self.select}, {', '.join(self.keys)}", after, limit, offset)
+
+    def key(self, after: bool, offset: int) -> str:
+        """The query of the key of the row offset rows after a key,
+        if after.
+        """
+        return self._q(", ".join(self.keys), after, 1, offset)
+
+    def skip(self, after: bool, rows: int, every: int) -> str:
+        """The query of the keys of every few of the rows that we skip
+        to get to a page, and of the last one, after a key if after.
+
+        The keys come with the number of their row.
+        """
+        keys = ", ".join(f"{key} AS _k{i}" for i, key in enumerate(self.keys))
+        number = f"row_number() OVER (ORDER BY {', '.join(self.keys)}) AS _n"
+        q = self._q(f"{keys}, {number}", after, rows, 0)
+        return f"SELECT * FROM ({q}) WHERE _n % {every} = 0 OR _n = {rows}"
+
+    def _q(self, select: str, after: bool, limit: int, offset: int) -> str:
+        conditions = [f"({self.where})"] if self.where else []
+        if after:
+            keys = ", ".join(self.keys)
+            conditions.append(f"({keys}) > ({', '.join('?' * len(self.keys))})")
+        q = f"SELECT {select} FROM {self.source}"
+        if conditions:
+            q += f" WHERE {' AND '.join(conditions)}"
+        q += f" ORDER BY {', '.join(self.keys)} LIMIT {limit}"
+        return f"{q} OFFSET {offset}" if offset else q
+
+
+class Bookmarks:
+    """The key each page of a query starts after."""
+
+    MAX = 10_000
+    """The pages whose bookmark we keep at most."""
+
+    def __init__(self):
+        self._starts: t.Dict[int, Key] = {}
+        self._lock = threading.Lock()
+
+    def nearest(self, page: int) -> t.Tuple[int, t.Optional[Key]]:
+        """The nearest page up to page whose start we know, and its
+        bookmark, which is None for the first page.
+        """
+        with self._lock:
+            known = [p for p in self._starts if p <= page]
+            nearest = max(known, default=0)
+            return nearest, self._starts.get(nearest)
+
+    def add(self, page: int, key: Key):
+        """Records that the page starts after the key."""
+        if None in key:  # Sqlite does not order NULL comparing row values
+            return
+        with self._lock:
+            if len(self._starts) < self.MAX or page in self._starts:
+                self._starts[page] = key
+
+
+class Pages:
+    """The bookmarks of the last queries."""
+
+    QUERIES = 128
+
+    def __init__(self):
+        self._bookmarks: t.OrderedDict[t.Hashable, Bookmarks] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def of(self, key: t.Optional[t.Hashable]) -> Bookmarks:
+        """The bookmarks of a query, or new ones if it has no key."""
+        if key is None:
+            return Bookmarks()
+        with self._lock:
+            if key in self._bookmarks:
+                self._bookmarks.move_to_end(key)
+            else:
+                self._bookmarks[key] = Bookmarks()
+                if len(self._bookmarks) > self.QUERIES:
+                    self._bookmarks.popitem(last=False)
+            return self._bookmarks[key]
+
+
+def _name(identifier: str) -> str:
+    """The identifier without quotes, in lower case as sqlite compares
+    them.
+    """
+    if identifier[0] in "\"[`":
+        identifier = identifier[1:-1]
+    return identifier.lower()
+
+
+def _split(terms: str) -> t.List[str]:
+    """Splits the terms by the commas outside parentheses and quotes."""
+    parts = QUOTED.split(terms)
+    split, depth, current = [], 0, ""
+    for i, part in enumerate(parts):
+        if i % 2:  # Quoted
+            current += part
+            continue
+        for char in part:
+            depth += {"(": 1, ")": -1}.get(char, 0)
+            if char == "," and not depth:
+                split.append(current)
+                current = ""
+            else:
+                current += char
+    return [*split, current]
@@ -0,0 +1,178 @@
+"""Loads in the background the pages next to the one a window shows,
+so flipping to them does not wait for the query.
+"""
+from __future__ import annotations
+
+import logging
+import sqlite3
+import threading
+import typing as t
+
+import decouple
+
+from bigsheets.service import read_model
+
+log = logging.getLogger(__name__)
+
+
+class Prefetcher:
+    """The pages next to the shown one of the query of a window.
+
+    The pages are dropped when the query or the limit of the window
+    changes, or when the rows of the sheets change (see drop). Pages
+    that do not fit in the budget are dropped, the farthest from the
+    shown page first.
+    """
+
+    LOG_EVERY = 20
+    """Every how many pages we log the hit rate."""
+
+    def __init__(
+        self,
+        reader: read_model.ReadModel,
+        submit: t.Callable[..., t.Any],
+        depth: t.Optional[int] = None,
+        previous: t.Optional[bool] = None,
+        budget: t.Optional[int] = None,
+    ):
+        """
+        :param submit: Executes a function with its args in the
+        background, like ReadModel.submit.
+        :param depth: The pages after the shown one to load, which is
+        the PREFETCH_DEPTH environment variable by default.
+        :param previous: Whether to load the page before the shown
+        one too, the PREFETCH_PREVIOUS environment variable by default.
+        :param budget: The max bytes of the pages, which is the
+        PREFETCH_BUDGET environment variable by default.
+        """
+        if depth is None:
+            depth = decouple.config("PREFETCH_DEPTH", default=1, cast=int)
+        if previous is None:
+            previous = decouple.config("PREFETCH_PREVIOUS", default=True, cast=bool)
+        if budget is None:
+            budget = decouple.config("PREFETCH_BUDGET", default=2 ** 25, cast=int)
+        self.reader = reader
+        self.submit = submit
+        self.depth = depth
+        self.previous = previous
+        self.budget = budget
+        self.hits = 0
+        self.misses = 0
+        self._query: t.Optional[t.Tuple[str, int]] = None
+        """The query and the limit of the pages."""
+        self._pages: t.Dict[int, t.Tuple[read_model.Result, int]] = {}
+        self._loading: t.Dict[int, read_model.QueryControl] = {}
+        self._shown = 0
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, q: str, limit: int, page: int) -> t.Optional[read_model.Result]:
+        """The header and rows of the page, if we loaded it."""
+        with self._lock:
+            if self._query == (q, limit) and page in self._pages:
+                self.hits += 1
+                result = self._pages[page][0]
+            else:
+                self.misses += 1
+                result = None
+            if not (self.hits + self.misses) % self.LOG_EVERY:
+                rate = self.hits / (self.hits + self.misses)
+                log.info(
+                    "Prefetched pages hit rate: %.0f%% of %s (%s hits)",
+                    rate * 100,
+                    self.hits + self.misses,
+                    self.hits,
+                )
+            return result
+
+    def shown(
+        self,
+        q: str,
+        limit: int,
+        page: int,
+        result: read_model.Result,
+        session: t.Optional[str] = None,
+    ):
+        """Keeps the page the window shows, to flip back to it, and
+        starts loading the pages around it.
+
+        :param session: The result session of the query.
+        """
+        pages = range(page + 1, page + 1 + self.depth)
+        if self.previous and page:
+            pages = (*pages, page - 1)
+        with self._lock:
+            if self._query != (q, limit):
+                self._drop()
+                self._query = q, limit
+            self._shown = page
+            if page not in self._pages:
+                self._add(page, result)
+            self._fit()
+            load = {
+                p: read_model.QueryControl(self.reader.timeout)
+                for p in pages
+                if p not in self._pages and p not in self._loading
+            }
+            self._loading.update(load)
+        for p, control in load.items():
+            self.submit(self._load, q, limit, p, session, control)
+
+    def drop(self):
+        """Drops the pages, and stops loading them."""
+        with self._lock:
+            self._drop()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "pages": len(self._pages),
+                "size": self._size,
+            }
+
+    def _load(
+        self,
+        q: str,
+        limit: int,
+        page: int,
+        session: t.Optional[str],
+        control: read_model.QueryControl,
+    ):
+        try:
+            result = list(self.reader.fetch(q, limit, page, control, session))
+        except sqlite3.OperationalError as e:  # Like when the query changed
+            log.debug("Page %s of %s not prefetched: %s", page, q, e)
+            result = None
+        with self._lock:
+            if self._loading.get(page) is not control:  # Dropped meanwhile
+                return
+            del self._loading[page]
+            if result is not None:
+                self._add(page, result)
+                self._fit()
+
+    def _add(self, page: int, result: read_model.Result):
+        size = read_model.result_size(result)
+        self._pages[page] = result, size
+        self._size += size
+
+    def _fit(self):
+        """Drops the pages that are not next to the shown one, and
+        the farthest from it that do not fit in the budget.
+        """
+        first, last = self._shown - 1, self._shown + self.depth
+        by_distance = sorted(self._pages, key=lambda p: abs(p - self._shown))
+        while by_distance and (
+            self._size > self.budget or not first <= by_distance[-1] <= last
+        ):
+            _, size = self._pages.pop(by_distance.pop())
+            self._size -= size
+
+    def _drop(self):
+        for control in self._loading.values():
+            control.cancel()
+        self._loading.clear()
+        self._pages.clear()
+        self._size = 0
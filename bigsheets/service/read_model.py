@@ -1,11 +1,202 @@
 from __future__ import annotations
 
+import itertools
+import logging
+import re
 import sqlite3
+import sys
+import threading
+import time
 import typing as t
-from dataclasses import dataclass
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import partial
 
-from bigsheets.domain import sheet
-from bigsheets.service import unit_of_work
+import decouple
+
+from bigsheets.domain import event, sheet
+from bigsheets.service import pagination, result_sessions, running, unit_of_work
+
+log = logging.getLogger(__name__)
+
+Result = t.List[t.Union[t.Tuple[str, ...], sheet.Row]]
+"""The header and the rows of a query."""
+
+_SPACES = re.compile(r"\s+")
+_WORD = re.compile(r"\w+")
+_VOLATILE = re.compile(
+    r"\b(?:random|randomblob|changes|total_changes|last_insert_rowid"
+    r"|current_date|current_time|current_timestamp)\b|'now'",
+    re.IGNORECASE,
+)
+"""What makes the results of a query change without the sheets
+changing.
+"""
+_GROUPS = re.compile(r"\bGROUP\s+BY\b|\bDISTINCT\b", re.IGNORECASE)
+_AGGREGATE = re.compile(
+    r"\b(?:count|sum|avg|min|max|total|group_concat)\s*\(", re.IGNORECASE
+)
+
+
+def query_timeout() -> t.Optional[float]:
+    """The max seconds a query of the user runs, which can be set
+    through the QUERY_TIMEOUT environment variable, 0 being none.
+    """
+    return decouple.config("QUERY_TIMEOUT", default=300, cast=float) or None
+
+
+class QueryInterrupted(sqlite3.OperationalError):
+    """The query was cancelled, or it took longer than its timeout."""
+
+
+class QueryControl:
+    """Stops a running query when cancelled, or when it runs for
+    longer than timeout seconds.
+    """
+
+    def __init__(self, timeout: t.Optional[float] = None):
+        self.timeout = timeout
+        self._cancelled = threading.Event()
+        self._deadline: t.Optional[float] = None
+
+    def start(self):
+        """Starts the timeout, unless it started, so the queries of
+        a submission, like opening its session and getting its page,
+        share it.
+        """
+        if self.timeout and self._deadline is None:
+            self._deadline = time.monotonic() + self.timeout
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def reason(self) -> t.Optional[str]:
+        """Why the query has to stop, or None if it does not."""
+        if self._cancelled.is_set():
+            return "The query was cancelled."
+        if running.exiting:
+            return "The query was stopped as the app is exiting."
+        if self._deadline and time.monotonic() > self._deadline:
+            return f"The query was stopped as it took longer than {self.timeout:g}s."
+        return None
+
+    def interrupts(self) -> bool:
+        """The progress handler of sqlite, which interrupts the query
+        returning True.
+        """
+        return self.reason() is not None
+
+
+class ResultCache:
+    """The results of the last queries, so flipping back to a page,
+    or running again the query of another window, does not query
+    the sheets.
+
+    A result is cached with the version of the sheets its query
+    names, which changes with the rows of the sheet (see
+    InvalidateQueryResults), so we never return a stale result.
+    The results that do not fit in the budget are evicted, the least
+    recently used first.
+    """
+
+    def __init__(self, budget: t.Optional[int] = None):
+        """
+        :param budget: The max bytes of the results, which is
+        the RESULT_CACHE_BUDGET environment variable by default.
+        """
+        if budget is None:
+            budget = decouple.config("RESULT_CACHE_BUDGET", default=2 ** 28, cast=int)
+        self.budget = budget
+        self.hits = 0
+        self.misses = 0
+        self.size = 0
+        self._results: t.OrderedDict[tuple, t.Tuple[Result, int]] = OrderedDict()
+        self._versions: t.Dict[str, int] = {}
+        """The version of the sheets that are opened."""
+        self._clock = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def key(
+        self, q: str, limit: int, page: int, sheets: t.Iterable[str]
+    ) -> t.Optional[tuple]:
+        """The key of the result of the query, or None if we cannot
+        cache it.
+
+        :param sheets: The names of the sheets in the repository.
+        """
+        if _VOLATILE.search(q):
+            return None
+        parts = pagination.QUOTED.split(q.strip())
+        # Odd parts are quoted, where the spaces matter
+        parts[::2] = [_SPACES.sub(" ", part) for part in parts[::2]]
+        # Like [sheet1], "sheet1", or SHEET1, as sqlite ignores the case
+        words = {w.lower() for w in _WORD.findall(" ".join(parts[::2]))}
+        words.update(part[1:-1].lower() for part in parts[1::2])
+        versions = []
+        with self._lock:
+            for name in sorted(s for s in sheets if s.lower() in words):
+                if name not in self._versions:  # Still opening
+                    return None
+                versions.append((name, self._versions[name]))
+        return "".join(parts), limit, page, tuple(versions)
+
+    def get(self, key: tuple) -> t.Optional[Result]:
+        with self._lock:
+            if key in self._results:
+                self.hits += 1
+                self._results.move_to_end(key)
+                return self._results[key][0]
+            self.misses += 1
+            return None
+
+    def put(self, key: tuple, result: Result):
+        size = result_size(result)
+        if size > self.budget:
+            return
+        with self._lock:
+            if key in self._results:
+                return
+            self._results[key] = result, size
+            self.size += size
+            while self.size > self.budget:
+                _, (_, evicted) = self._results.popitem(last=False)
+                self.size -= evicted
+
+    def changed(self, *names: str):
+        """The rows of the sheets changed, or the sheets opened."""
+        with self._lock:
+            for name in names:
+                self._versions[name] = next(self._clock)
+            self._forget(names)
+
+    def retain(self, names: t.Collection[str]):
+        """Only the sheets with the names remain opened."""
+        with self._lock:
+            removed = [name for name in self._versions if name not in names]
+            for name in removed:
+                del self._versions[name]
+            self._forget(removed)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "results": len(self._results),
+                "size": self.size,
+            }
+
+    def _forget(self, names: t.Collection[str]):
+        """Evicts the results of older versions of the sheets."""
+        for key in [k for k in self._results if any(n in names for n, _ in k[-1])]:
+            self.size -= self._results.pop(key)[1]
+
+
+def result_size(result: Result) -> int:
+    """The approx. bytes the result takes in memory."""
+    return sum(sys.getsizeof(row) + sum(map(sys.getsizeof, row)) for row in result)
 
 
 @dataclass
@@ -15,12 +206,176 @@ class ReadModel:
     """
 
     uow: unit_of_work.UnitOfWork
+    results: ResultCache = field(default_factory=ResultCache, init=False)
+    timeout: t.Optional[float] = field(default_factory=query_timeout, init=False)
+    """The seconds after which the queries of the user stop."""
+    pages: pagination.Pages = field(default_factory=pagination.Pages, init=False)
+    sessions: result_sessions.ResultSessions = field(
+        default_factory=result_sessions.ResultSessions, init=False
+    )
+    background: ThreadPoolExecutor = field(
+        default_factory=partial(
+            ThreadPoolExecutor, max_workers=2, thread_name_prefix="ReadModel"
+        ),
+        init=False,
+        repr=False,
+    )
+    """Reads what the user did not ask for yet, apart from the events
+    of the message bus, so they do not wait for these reads.
+    """
+
+    PROGRESS_STEPS = 10_000
+    """The sqlite instructions between checking whether to stop
+    a query, which take around a millisecond.
+    """
+    CHECKPOINTS = 100
+    """Every how many pages we bookmark the pages we skip."""
+    FILL_ROWS = 1000
+    """The rows we store at a time in a result session."""
+    WAIT_STEP = 0.1
+    """The seconds between checking whether to stop waiting for the
+    rows of a result session.
+    """
 
     def query(
-        self, q: str, limit: int = 100, page: int = 0
+        self,
+        q: str,
+        limit: int = 100,
+        page: int = 0,
+        control: t.Optional[QueryControl] = None,
+        session: t.Optional[str] = None,
+    ) -> t.Iterator[t.Union[t.Tuple[str, ...], sheet.Row]]:
+        """The header and rows of the page of the query the user runs.
+
+        :param control: Stops the query, raising QueryInterrupted.
+        By default, the query stops after the timeout.
+        :param session: The id of the result session of the query
+        (see open_session), to get the page from it if it can.
+        """
+        # The query of a session was published when opening it
+        if (yield from self._execute(q, limit, page, control, session)) and not session:
+            # Indexes the columns the query scans if the user repeats it
+            self.uow.bus.handle(event.QueryExecuted(q))
+
+    def fetch(
+        self,
+        q: str,
+        limit: int = 100,
+        page: int = 0,
+        control: t.Optional[QueryControl] = None,
+        session: t.Optional[str] = None,
     ) -> t.Iterator[t.Union[t.Tuple[str, ...], sheet.Row]]:
+        """The header and rows of another page of a query the user ran,
+        like the pages we prefetch, which the index advisor does not see.
+        """
+        yield from self._execute(q, limit, page, control, session)
+
+    def submit(self, fn: t.Callable, *args) -> Future:
+        """Executes the function in the background, for the reads the
+        user does not wait for, like prefetching pages or counting rows.
+        """
+        return self.background.submit(fn, *args)
+
+    def open_session(
+        self,
+        q: str,
+        control: t.Optional[QueryControl] = None,
+        current: t.Optional[str] = None,
+    ) -> t.Optional[str]:
+        """Runs the query in the background storing its rows in a
+        result session, from which query gets the pages, waiting for
+        their rows if they are not stored yet, returning the id of the
+        session.
+
+        Returns None for the queries we page by their keys, as their
+        pages are already cheap, and the ones whose result can change
+        without the sheets changing.
+
+        :param control: Stops getting the header of the query, which
+        raises sqlite3.OperationalError if the query is wrong.
+        :param current: The id of the session the caller has, which
+        is kept if it is of the query and of the current rows, and
+        closed otherwise.
+        """
+        with self.uow.instantiate() as uowi:
+            headers = {s.name: s.header for s in uowi.sheets.get()}
+            if not (key := self.results.key(q, 0, 0, headers)):
+                self.sessions.close(current)
+                return None
+            key = key[0], key[-1]
+            if self.sessions.get(current, key):
+                return current
+            self.sessions.close(current)
+            if pagination.Keyset.of(q, headers):
+                return None
+            with self._controlled(uowi.session, control):
+                cursor = uowi.session.execute(f"{q} LIMIT 0")
+        header = [h[0] for h in cursor.description]
+        stored = result_sessions.ResultSession(key, header, self.sessions.rows)
+        filling = QueryControl(self.timeout)
+        stored.stopping = filling.cancel
+        self.sessions.add(stored)
+        self.submit(self._fill, q, stored, filling)
+        self.uow.bus.handle(event.QueryExecuted(q))
+        return stored.id
+
+    def close_session(self, session: t.Optional[str]):
+        self.sessions.close(session)
+
+    def estimate(self, q: str, session: t.Optional[str] = None) -> t.Tuple[int, bool]:
+        """The rows of the result of the query right away, and whether
+        they are exact.
+
+        They are exact if we counted them before (see count), or if
+        the result session stored all of them. Otherwise, we estimate
+        them from the rows of the sheets the query reads and its plan.
+        """
         with self.uow.instantiate() as uowi:
-            yield from self._query(q, limit, page, uowi.session)
+            sheets = tuple(uowi.sheets.get())
+            headers = {s.name: s.header for s in sheets}
+            if key := self.results.key(q, 0, 0, headers):
+                stored = self.sessions.get(session, (key[0], key[-1]))
+                if stored and stored.total is not None:
+                    return stored.total, True
+            if (count := self.results.key(self._count_q(q), 1, 0, headers)) and (
+                counted := self.results.get(count)
+            ):
+                return counted[1][0], True
+            plan = [row[-1] for row in uowi.session.execute(f"EXPLAIN QUERY PLAN {q}")]
+        masked = pagination.QUOTED.sub("''", q)
+        words = set(_WORD.findall(masked))
+        rows = max((s.num_rows or 0 for s in sheets if s.name in words), default=0)
+        if _AGGREGATE.search(masked) and not _GROUPS.search(masked):
+            return min(rows, 1), False
+        scans = [step for step in plan if step.startswith(("SCAN", "SEARCH"))]
+        if scans and all(step.startswith("SEARCH") for step in scans):
+            # Looking up an index, which sqlite guesses finds a few rows
+            return rows // 10, False
+        return rows, False
+
+    def count(
+        self,
+        q: str,
+        control: t.Optional[QueryControl] = None,
+        session: t.Optional[str] = None,
+    ) -> int:
+        """The exact rows of the result of the query, which the result
+        session counts while storing them, or which we count running
+        the query and cache with the version of its sheets.
+        """
+        count, exact = self.estimate(q, session)
+        if exact:
+            return count
+        if stored := self._session(q, session):
+            self._wait(stored, None, control)
+            if stored.total is not None:  # Or it closed meanwhile
+                return stored.total
+        _, (count,) = self._execute(self._count_q(q), 1, 0, control)
+        return count
+
+    @staticmethod
+    def _count_q(q: str) -> str:
+        return f"SELECT count(*) FROM ({q})"
 
     def q_default_last_sheet(self):
         with self.uow.instantiate() as uowi:
@@ -28,19 +383,209 @@ class ReadModel:
             q = f"SELECT * FROM {sheet_name}"
             yield from self._query(q, 100, 0, uowi.session)
 
+    def _execute(
+        self,
+        q: str,
+        limit: int,
+        page: int,
+        control: t.Optional[QueryControl] = None,
+        session: t.Optional[str] = None,
+    ) -> t.Generator[t.Union[t.Tuple[str, ...], sheet.Row], None, bool]:
+        """The header and rows of the page of the query, from the cache,
+        the result session, or the sheets, returning whether we queried
+        the sheets.
+
+        Unlike query, this does not publish QueryExecuted, so the
+        queries the user did not run, like counting the rows, do not
+        make us index the columns.
+        """
+        with self.uow.instantiate() as uowi:
+            headers = {s.name: s.header for s in uowi.sheets.get()}
+            key = self.results.key(q, limit, page, headers)
+            if key and (cached := self.results.get(key)) is not None:
+                yield from cached
+                return False
+            if key and (stored := self.sessions.get(session, (key[0], key[-1]))):
+                self._wait(stored, limit * (page + 1), control)
+                if (rows := stored.page(limit, page)) is not None:
+                    yield stored.header
+                    yield from rows
+                    return False
+            bookmarks = None
+            if keyset := pagination.Keyset.of(q, headers):
+                # Any page of the query, until the rows of the sheets change
+                bookmarks = self.pages.of(key and (key[0], limit, key[-1]))
+            result = []
+            control = control or QueryControl(self.timeout)
+            for row in self._query(
+                q, limit, page, uowi.session, control, keyset, bookmarks
+            ):
+                result.append(row)
+                yield row
+            if key:
+                self.results.put(key, result)
+        return True
+
     def _query(
-        self, q: str, limit: int, page: int, session: sqlite3.Connection
+        self,
+        q: str,
+        limit: int,
+        page: int,
+        session: sqlite3.Connection,
+        control: t.Optional[QueryControl] = None,
+        keyset: t.Optional[pagination.Keyset] = None,
+        bookmarks: t.Optional[pagination.Bookmarks] = None,
     ) -> t.Iterator[t.Union[t.Tuple[str, ...], sheet.Row]]:
-        q = f"{q} LIMIT {limit} OFFSET {limit * page}"
+        """Pages the query by its keys if it has a keyset, or by
+        LIMIT and OFFSET.
+        """
+        with self._controlled(session, control):
+            cursor = None
+            if keyset:
+                try:
+                    cursor = self._keyset(keyset, bookmarks, limit, page, session)
+                except sqlite3.OperationalError:
+                    if control and control.reason():
+                        raise
+                    # Like ordering by an alias of the select
+                    log.debug("Cannot page %s by its keys", q, exc_info=True)
+            if cursor:
+                n = len(keyset.keys)
+                yield tuple(h[0] for h in cursor.description[:-n])
+                rows = 0
+                for row in cursor:
+                    rows += 1
+                    yield row[:-n]
+                if rows == limit:
+                    bookmarks.add(page + 1, row[-n:])
+            else:
+                q = f"{q} LIMIT {limit} OFFSET {limit * page}"
+                cursor = session.execute(q)
+                yield tuple(h[0] for h in cursor.description)
+                yield from cursor
+
+    def _fill(
+        self, q: str, stored: result_sessions.ResultSession, control: QueryControl
+    ):
+        """Runs the query storing its rows in the result session, which
+        is closed if we cannot.
+        """
+        with self.uow.instantiate() as uowi:
+            try:
+                with self._controlled(uowi.session, control):
+                    cursor = uowi.session.execute(q)
+                    for rows in iter(lambda: cursor.fetchmany(self.FILL_ROWS), []):
+                        stored.add(rows)
+                stored.finish()
+            except sqlite3.Error:  # Like when the session closed
+                log.debug("Rows of %s not stored", q, exc_info=True)
+                self.sessions.close(stored.id)
+                return
+        self.sessions.filled(stored)
 
-        cursor: sqlite3.Cursor = session.execute(q)
-        yield tuple(h[0] for h in cursor.description)
-        yield from cursor
+    def _session(
+        self, q: str, session: t.Optional[str]
+    ) -> t.Optional[result_sessions.ResultSession]:
+        """The result session of the query, if it is open."""
+        if session is None:
+            return None
+        with self.uow.instantiate() as uowi:
+            headers = {s.name: s.header for s in uowi.sheets.get()}
+        if key := self.results.key(q, 0, 0, headers):
+            return self.sessions.get(session, (key[0], key[-1]))
+        return None
+
+    def _wait(
+        self,
+        stored: result_sessions.ResultSession,
+        rows: t.Optional[int],
+        control: t.Optional[QueryControl],
+    ):
+        """Waits until the result session stores the rows, all of them
+        if None, or cannot, raising QueryInterrupted if the control
+        stops the query meanwhile.
+        """
+        control = control or QueryControl(self.timeout)
+        control.start()
+        while not stored.wait(rows, self.WAIT_STEP):
+            if reason := control.reason():
+                raise QueryInterrupted(reason)
+
+    @contextmanager
+    def _controlled(
+        self, session: sqlite3.Connection, control: t.Optional[QueryControl]
+    ):
+        """Lets the control stop the queries of the session, raising
+        QueryInterrupted.
+        """
+        # Do not lock the tables so we can query sheets that are opening
+        session.execute("PRAGMA read_uncommitted = 1")
+        if control:
+            control.start()
+            session.set_progress_handler(control.interrupts, self.PROGRESS_STEPS)
+        try:
+            yield
+        except sqlite3.OperationalError as e:
+            if control and (reason := control.reason()):
+                raise QueryInterrupted(reason) from e
+            raise
+        finally:
+            if control:
+                session.set_progress_handler(None, 0)
+
+    def _keyset(
+        self,
+        keyset: pagination.Keyset,
+        bookmarks: pagination.Bookmarks,
+        limit: int,
+        page: int,
+        session: sqlite3.Connection,
+    ) -> sqlite3.Cursor:
+        """The cursor of the rows of the page and their keys, starting
+        from the nearest bookmark.
+        """
+        nearest, after = bookmarks.nearest(page)
+        if len(keyset.keys) == 1:
+            # Sqlite seeks the rowid, so we go from checkpoint to checkpoint
+            while nearest < page:
+                pages = min(page - nearest, self.CHECKPOINTS)
+                q = keyset.key(after is not None, pages * limit - 1)
+                if not (start := session.execute(q, after or ()).fetchone()):
+                    break
+                nearest, after = nearest + pages, start
+                bookmarks.add(nearest, start)
+        elif nearest < page:
+            # Sqlite sorts the rows, so we do it once
+            skip = (page - nearest) * limit
+            q = keyset.skip(after is not None, skip, limit * self.CHECKPOINTS)
+            start, rows = (), 0
+            for *start, rows in session.execute(q, after or ()):
+                bookmarks.add(nearest + rows // limit, tuple(start))
+            if rows == skip and None not in start:
+                nearest, after = page, tuple(start)
+        # Past the last page, or sqlite cannot compare the key
+        offset = (page - nearest) * limit
+        q = keyset.page(after is not None, limit, offset)
+        return session.execute(q, after or ())
 
     def opened_sheets(self):
         with self.uow.instantiate() as uowi:
             yield from uowi.sheets.get()
 
-    def errors(self):
+    def column_stats(self, name: str) -> t.List[dict]:
+        """The statistics of the columns of the sheet, collected when
+        loading it: count, nulls, min, max, approx. distinct values,
+        and top values.
+        """
+        with self.uow.instantiate() as uowi:
+            sheet = next(s for s in uowi.sheets.get() if s.name == name)
+            return sheet.stats.summary() if sheet.stats else []
+
+    def error_counts(self) -> t.Dict[str, int]:
+        """The number of errors per filename."""
+        with self.uow.instantiate() as uowi:
+            return uowi.errors.counts()
+
+    def errors(self, filename: str, page: int, limit: int) -> t.List[dict]:
         with self.uow.instantiate() as uowi:
-            return uowi.errors.get()
+            return uowi.errors.page(filename, page, limit)
@@ -0,0 +1,216 @@
+"""Keeps the rows of the queries of the user, so paging through them
+does not run the queries again.
+
+The rows are stored in a table of a database in memory, one per
+session, whose rowid is the position of the row in the result. A page
+is then a seek by rowid, whatever the query was: joins, aggregates, or
+sorts.
+"""
+from __future__ import annotations
+
+import logging
+import sqlite3
+import threading
+import time
+import typing as t
+import uuid
+from collections import OrderedDict
+
+import decouple
+
+from bigsheets.domain import sheet
+
+log = logging.getLogger(__name__)
+
+
+class ResultSession:
+    """The stored rows of a query, which we store as we run the query
+    (see add and finish), so its first pages are there before the
+    query finishes.
+    """
+
+    def __init__(self, key: t.Hashable, header: t.Sequence[str], max_rows: int):
+        """
+        :param key: The query and the version of its sheets, so we
+        do not serve rows that changed.
+        :param max_rows: The rows we store at most, counting the rest.
+        """
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.header = tuple(header)
+        self.max_rows = max_rows
+        self.rows = 0
+        """The rows we stored so far."""
+        self.total: t.Optional[int] = None
+        """The rows of the result, once the query finished."""
+        self.size = 0
+        """The bytes of the stored rows."""
+        self.stopping: t.Optional[t.Callable[[], None]] = None
+        """Stops storing the rows, when the session closes first."""
+        self.used = time.monotonic()
+        self._counted = 0
+        self._closed = False
+        self._connection = sqlite3.connect(":memory:", check_same_thread=False)
+        columns = ", ".join(f"c{i}" for i in range(len(self.header)))
+        # The rowid of the rows is their position, and the columns have
+        # no type so the values keep theirs
+        self._connection.execute(f"CREATE TABLE rows ({columns})")
+        self._insert = f"INSERT INTO rows VALUES ({', '.join('?' * len(header))})"
+        self._changed = threading.Condition()
+
+    @property
+    def complete(self) -> bool:
+        """Whether we stored all the rows, or the first max rows."""
+        return self.total is not None and self.total == self.rows
+
+    def add(self, rows: t.Sequence[sheet.Row]):
+        """Stores the next rows of the query, up to max rows."""
+        with self._changed:
+            stored = rows[: self.max_rows - self.rows]
+            if stored:
+                self._connection.executemany(self._insert, stored)
+                self._connection.commit()
+                self.rows += len(stored)
+            self._counted += len(rows)
+            self._changed.notify_all()
+
+    def finish(self):
+        """The query has no more rows."""
+        with self._changed:
+            (pages,) = self._connection.execute("PRAGMA page_count").fetchone()
+            (page_size,) = self._connection.execute("PRAGMA page_size").fetchone()
+            self.size = pages * page_size
+            self.total = self._counted
+            self._changed.notify_all()
+
+    def wait(self, rows: t.Optional[int], timeout: float) -> bool:
+        """Waits up to timeout seconds until we stored the rows, all of
+        them if None, or we cannot, returning whether we can stop
+        waiting.
+        """
+
+        def stored() -> bool:
+            if self.total is not None or self._closed:
+                return True
+            return rows is not None and self.rows >= rows
+
+        with self._changed:
+            return self._changed.wait_for(stored, timeout)
+
+    def page(self, limit: int, page: int) -> t.Optional[t.List[sheet.Row]]:
+        """The rows of the page, or None if we did not store them."""
+        start = limit * page
+        if not self.complete and start + limit > self.rows:
+            return None
+        with self._changed:
+            self.used = time.monotonic()
+            q = "SELECT * FROM rows WHERE rowid > ? ORDER BY rowid LIMIT ?"
+            try:
+                return self._connection.execute(q, (start, limit)).fetchall()
+            except sqlite3.ProgrammingError:  # Expired meanwhile
+                return None
+
+    def close(self):
+        if self.stopping:
+            self.stopping()
+        with self._changed:
+            self._closed = True
+            self._connection.close()
+            self._changed.notify_all()
+
+
+class ResultSessions:
+    """The result sessions of the queries of the windows.
+
+    A session expires when it is not used for timeout seconds, and
+    the least recently used ones close when there are more than
+    SESSIONS, or when their rows do not fit in the budget.
+    """
+
+    SESSIONS = 32
+
+    def __init__(
+        self,
+        timeout: t.Optional[float] = None,
+        rows: t.Optional[int] = None,
+        budget: t.Optional[int] = None,
+    ):
+        """
+        :param timeout: The RESULT_SESSION_TIMEOUT environment
+        variable by default.
+        :param rows: The max rows a session stores, pages after them
+        running the query again, which is the RESULT_SESSION_ROWS
+        environment variable by default.
+        :param budget: The max bytes of the rows of all the sessions,
+        which is the RESULT_SESSION_BUDGET environment variable by
+        default.
+        """
+        if timeout is None:
+            timeout = decouple.config("RESULT_SESSION_TIMEOUT", default=600, cast=float)
+        if rows is None:
+            rows = decouple.config("RESULT_SESSION_ROWS", default=100_000, cast=int)
+        if budget is None:
+            budget = decouple.config("RESULT_SESSION_BUDGET", default=2 ** 28, cast=int)
+        self.timeout = timeout
+        self.rows = rows
+        self.budget = budget
+        self._sessions: t.OrderedDict[str, ResultSession] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, session: ResultSession):
+        """Serves the pages of the session, once its rows are stored
+        (see filled).
+        """
+        with self._lock:
+            self._sessions[session.id] = session
+            expired = self._expired()
+        self._close(*expired)
+
+    def filled(self, session: ResultSession):
+        """The rows of the session are stored, which closes the least
+        recently used sessions that do not fit in the budget.
+        """
+        log.debug("Stored %s bytes in result session %s", session.size, session.id)
+        with self._lock:
+            expired = self._expired()
+        self._close(*expired)
+
+    def get(self, id: t.Optional[str], key: t.Hashable) -> t.Optional[ResultSession]:
+        """The session, if it is open and of the query."""
+        with self._lock:
+            expired = self._expired()
+            if (session := self._sessions.get(id)) and session.key == key:
+                self._sessions.move_to_end(id)
+            else:
+                session = None
+        self._close(*expired)
+        return session
+
+    def close(self, id: t.Optional[str]):
+        with self._lock:
+            session = self._sessions.pop(id, None)
+        if session:
+            self._close(session)
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _expired(self) -> t.List[ResultSession]:
+        """Forgets the idle sessions and the ones over SESSIONS,
+        returning them to close them outside the lock.
+        """
+        now = time.monotonic()
+        expired = [s for s in self._sessions.values() if now - s.used > self.timeout]
+        for session in expired:
+            del self._sessions[session.id]
+        size = sum(s.size for s in self._sessions.values())
+        while len(self._sessions) > self.SESSIONS or size > self.budget:
+            expired.append(self._sessions.popitem(last=False)[1])
+            size -= expired[-1].size
+        return expired
+
+    @staticmethod
+    def _close(*sessions: ResultSession):
+        for session in sessions:
+            log.debug("Closing result session %s", session.id)
+            session.close()
@@ -45,7 +45,6 @@ setup(
         "punq",
         "zipstream_new",
         "more_itertools",
-        "ordered-set-37",
     ],
     extras_require={
         "test": ["pytest"],
@@ -6,7 +6,7 @@ import pytest
 import webview as pywebview
 
 from bigsheets.adapters.errors import errors as error_adapter
-from bigsheets.adapters.sheets.sheets import EngineFactory, SheetsAdaptor
+from bigsheets.adapters.sheets.sheets import EngineFactory, SheetRegistry, SheetsAdaptor
 from bigsheets.adapters.ui.gui.gui import GUIAdapter
 from bigsheets.adapters.ui.gui.query import controller
 
@@ -23,6 +23,12 @@ def engine_factory():
     return EngineFactory(f"file:t{engine_counts}?mode=memory&cache=shared")
 
 
+@pytest.fixture(autouse=True)
+def no_import_cache(monkeypatch):
+    """Opens the files without the import cache of the user."""
+    monkeypatch.setattr(SheetsAdaptor, "import_cache", None)
+
+
 @pytest.fixture(autouse=True)
 def check_logs(caplog):
     """Sets the message bus logs to INFO (so we can see what commands
@@ -55,7 +61,7 @@ def gui():
 @pytest.fixture
 def MockedSheetsAdaptor():
     class TestSheetsAdaptor(SheetsAdaptor):
-        sheets = set()  # So we don't contaminate other tests
+        sheets = SheetRegistry()  # So we don't contaminate other tests
 
     return TestSheetsAdaptor
 
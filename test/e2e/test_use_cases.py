@@ -1,3 +1,4 @@
+from concurrent import futures
 from time import sleep
 from unittest import mock
 
@@ -5,6 +6,7 @@ import pytest
 
 from bigsheets.adapters.ui.gui.gui import GUIAdapter
 from bigsheets.app import BigSheets
+from bigsheets.domain import event
 from test.conftest import FIXTURES
 
 
@@ -23,6 +25,7 @@ def test_open_csv_sheet_when_opening_the_app(gui, engine_factory):
         When I select a sheet to open
         Then I see a progress bar while the sheet is opening
         And I see some rows while the sheet is loading
+        And I can query the rows loaded so far
         And I see the final sheet once it is opened
     """
     MockedGUIAdapter, native_window = gui
@@ -57,9 +60,17 @@ def test_open_csv_sheet_when_opening_the_app(gui, engine_factory):
         "State",
     ]
     assert calls[9] == mock.call.Query().init("sheet1")
-    assert calls[13] == mock.call.Progress().finish()
+    # The query is not disabled, so we can query the rows loaded so far
+    assert calls[10] == mock.call.Progress().update(128)
+    assert calls[11] == mock.call.Info().set(
+        "Rows loaded: 128 of ~128. "
+        "Some functionality is disabled until the sheet finishes opening."
+    )
+    assert calls[12] == mock.call.Progress().finish()
     # todo why not table?
-    assert calls[14] == mock.call.Info().unset()
+    assert calls[13] == mock.call.Info().unset()
+    # Once opened we refresh the results of the query, if any
+    assert calls[16] == mock.call.Query().refresh()
 
 
 @pytest.mark.skip(reason="Test not developed.")
@@ -110,7 +121,27 @@ class TestQuery:
         bs.start()
         bs.ui: GUIAdapter
 
-        bs.ui.windows[-1]._view.query("select * from sheet1", 1, 0)
+        view = bs.ui.windows[-1]._view
+        background, submit = [], view.reader.background.submit
+
+        def track(fn, *args):
+            background.append(submit(fn, *args))
+            return background[-1]
+
+        with mock.patch.object(
+            bs.bus, "handle", wraps=bs.bus.handle
+        ) as handle, mock.patch.object(view.reader.background, "submit", track):
+            view.query("select * from sheet1", 1, 0)
+            # The table gets the rows the user scrolls to
+            rows = view.rows("select * from sheet1", 2, 1)
+            # The count and the prefetched pages
+            futures.wait(background)
+        # The index advisor sees the query once
+        assert [
+            c.args[0]
+            for c in handle.call_args_list
+            if isinstance(c.args[0], event.QueryExecuted)
+        ] == [event.QueryExecuted("select * from sheet1")]
         # We get the first row of the csv
         # Note that mock_calls[0] is the temp table created when loading
         # the csv (which we assert in test_open_csv)
@@ -129,6 +160,10 @@ class TestQuery:
                 "State",
             ),
         )
+        assert rows == [
+            (46, 35, 59, "N", 120, 30, 36, "W", "Yakima", "WA"),
+            (42, 16, 12, "N", 71, 48, 0, "W", "Worcester", "MA"),
+        ]
 
     @pytest.mark.skip(reason="Test not developed.")
     def test_wrong_query(self):
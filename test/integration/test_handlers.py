@@ -1,8 +1,11 @@
+import sqlite3
 from unittest import mock
 from unittest.mock import MagicMock
 
-from bigsheets.domain import command, event
-from bigsheets.service.command_handlers import OpenSheet
+from bigsheets.domain import command, event, sheet as sheet_model
+from bigsheets.domain.error import OpeningFileFailed
+from bigsheets.service.command_handlers import LoadAppendedRows, OpenSheet, OpenSheets
+from bigsheets.service.event_handlers import RefreshDerivedSheets
 from bigsheets.service.unit_of_work import UnitOfWork
 from test.conftest import FIXTURES
 
@@ -21,3 +24,93 @@ def test_open_sheet(engine_factory, MockedSheetsAdaptor, MockedErrorsAdapter):
     with uow.instantiate() as uowi:  # Check persistance
         x = uowi.session.execute("SELECT * FROM sheet1 LIMIT 1")
         assert next(x) == (41, 5, 59, "N", 80, 39, 0, "W", "Youngstown", "OH")
+
+
+def test_open_sheets(engine_factory, MockedSheetsAdaptor, MockedErrorsAdapter):
+    """Sheets open at the same time, and one failing does not stop the others."""
+    errors = MockedErrorsAdapter()
+    bus = MagicMock()
+    uow = UnitOfWork(sheet_engine_factory=engine_factory, bus=bus,
+                     Sheets=MockedSheetsAdaptor, errors=errors)
+    open_sheet = OpenSheet(uow, MagicMock())
+    # The bus executes the OpenSheet commands and ignores the events
+    bus.handle.side_effect = lambda m: (
+        open_sheet(m) if isinstance(m, command.OpenSheet) else None
+    )
+    cmd = command.OpenSheets(
+        [FIXTURES / "cities.csv", FIXTURES / "missing.csv", FIXTURES / "cities.csv"]
+    )
+    sheets = OpenSheets(bus, uow)(cmd)
+    assert sorted(sheet.name for sheet in sheets) == ["sheet1", "sheet2"]
+    assert isinstance(errors.get()["missing.csv"][0], OpeningFileFailed)
+
+    with uow.instantiate() as uowi:
+        for sheet in sheets:
+            q = f"SELECT count(*) FROM {sheet.name}"
+            assert uowi.session.execute(q).fetchone() == (128,)
+
+
+def test_open_sheets_failing_while_loading(
+    engine_factory, MockedSheetsAdaptor, MockedErrorsAdapter, tmp_path
+):
+    """A sheet failing in the middle of loading stops showing as opening."""
+
+    class SheetsAdaptor(MockedSheetsAdaptor):
+        def _process_spreadsheet(self, f, *args):
+            for chunk in super()._process_spreadsheet(f, *args):
+                if f.name == str(broken):
+                    raise sqlite3.OperationalError("disk I/O error")
+                yield chunk
+
+    broken = tmp_path / "broken.csv"
+    broken.write_bytes((FIXTURES / "cities.csv").read_bytes())
+    errors = MockedErrorsAdapter()
+    bus, ui = MagicMock(), MagicMock()
+    uow = UnitOfWork(sheet_engine_factory=engine_factory, bus=bus,
+                     Sheets=SheetsAdaptor, errors=errors)
+    open_sheet = OpenSheet(uow, ui)
+    bus.handle.side_effect = lambda m: (
+        open_sheet(m) if isinstance(m, command.OpenSheet) else None
+    )
+    cmd = command.OpenSheets([FIXTURES / "cities.csv", broken])
+    sheets = OpenSheets(bus, uow)(cmd)
+    assert [sheet.filename for sheet in sheets] == [str(FIXTURES / "cities.csv")]
+    assert isinstance(errors.get()["broken.csv"][0], OpeningFileFailed)
+    (failed,) = (c.args[0] for c in ui.sheet_opening_failed.call_args_list)
+    assert failed.filename == str(broken)
+    assert len(ui.start_opening_sheet.call_args_list) == 2
+
+
+def test_load_appended_rows(
+    engine_factory, MockedSheetsAdaptor, MockedErrorsAdapter, tmp_path
+):
+    bus = MagicMock()
+    uow = UnitOfWork(sheet_engine_factory=engine_factory, bus=bus,
+                     Sheets=MockedSheetsAdaptor, errors=MockedErrorsAdapter())
+    filepath = tmp_path / "log.csv"
+    filepath.write_text("time,value\n1,a\n")
+    sheet = OpenSheet(uow, MagicMock())(command.OpenSheet(filepath))
+    load = LoadAppendedRows(uow)
+    cmd = command.LoadAppendedRows(sheet.name)
+    assert not load(cmd), "The sheet is not followed"
+
+    sheet.following = True
+    with filepath.open("a") as f:
+        f.write("2,b\n")
+    assert load(cmd)
+    assert bus.mock_calls[-1] == mock.call.handle(
+        event.SheetUpdated(sheet, tuple(MockedSheetsAdaptor.sheets), 1, False)
+    )
+
+
+def test_refresh_derived_sheets():
+    bus = MagicMock()
+    source = sheet_model.Sheet("sheet1", [], [], 0, "cities.csv")
+    other = sheet_model.Sheet("sheet2", [], [], 0, "cities.csv")
+    derived = sheet_model.Sheet("sheet3", [], [], 0, "SELECT ...")
+    derived.query, derived.sources = "SELECT ...", ["sheet1", "sheet2"]
+    refresh = RefreshDerivedSheets(bus)
+    refresh(event.SheetUpdated(source, (source, other, derived)))
+    refresh(event.SheetUpdated(other, (source, other, derived), appended_rows=1))
+    refresh(event.SheetOpened(source, (source, derived)))  # sheet2 was removed
+    assert bus.mock_calls == [mock.call.handle(command.RefreshSheet("sheet3"))]
@@ -1,11 +1,24 @@
 import sqlite3
+import threading
+import time
 from pathlib import Path
+from unittest import mock
 from unittest.mock import MagicMock
 
 import pytest
 
+from bigsheets.adapters.sheets.sheets import SheetRegistry, SheetsAdaptor, UpdateHandler
+from bigsheets.domain import event
 from bigsheets.service import unit_of_work
-from bigsheets.service.read_model import ReadModel
+from bigsheets.service.pagination import Keyset
+from bigsheets.service.event_handlers import InvalidateQueryResults
+from bigsheets.service.read_model import (
+    QueryControl,
+    QueryInterrupted,
+    ReadModel,
+    ResultCache,
+    result_size,
+)
 
 FIXTURES = Path(__file__).parent.parent / "fixtures"
 
@@ -33,7 +46,379 @@ class TestQuery:
         rows = tuple(r)
         assert rows == ((1, 2),)
 
+    def test_query_sheet_while_opening(self, uow, engine_factory):
+        """The rows loaded so far of a sheet that is opening can be queried."""
+
+        class Sheets(SheetsAdaptor):
+            sheets = SheetRegistry()
+            BULK_ROWS_PER_CHUNK = 50
+            tune_batches = False
+            PROGRESS_INTERVAL = 0
+
+        counts = []
+
+        def on_it(_):
+            r = ReadModel(uow).query("select count(*) from sheet1", 10, 0)
+            next(r)
+            counts.append(next(r)[0])
+
+        update_handler = mock.create_autospec(UpdateHandler)()
+        update_handler.on_it.side_effect = on_it
+        with engine_factory() as session:
+            Sheets(session).open_sheet(
+                FIXTURES / "cities.csv", update_handler=update_handler
+            )
+        assert counts == [50, 100, 128]
+
     def test_syntax_error(self, uow):
         """User input error."""
         with pytest.raises(sqlite3.OperationalError):
             tuple(ReadModel(uow).query("select 1- from sheet1", 1, 1))
+
+
+def test_column_stats(uow, engine_factory):
+    class Sheets(SheetsAdaptor):
+        sheets = SheetRegistry()
+
+    uow.Sheets = Sheets
+    with engine_factory() as session:
+        Sheets(session).open_sheet(FIXTURES / "cities.csv")
+    stats = ReadModel(uow).column_stats("sheet1")
+    assert [s["name"] for s in stats] == Sheets.sheets.get("sheet1").header
+    assert stats[1]["count"] == 128 and stats[1]["nulls"] == 0
+
+
+class TestResultCache:
+    @pytest.fixture
+    def sheets(self, uow):
+        class Sheets(SheetsAdaptor):
+            sheets = SheetRegistry()
+
+        uow.Sheets = Sheets
+        return Sheets
+
+    def test_cached_until_the_sheet_changes(self, uow, engine_factory, sheets):
+        with engine_factory() as session:
+            sheet, _ = sheets(session).open_sheet(FIXTURES / "cities.csv")
+        reader = ReadModel(uow)
+        invalidate = InvalidateQueryResults(reader)
+        invalidate(event.SheetOpened(sheet, (sheet,)))
+        q = "SELECT count(*) FROM sheet1"
+        assert tuple(reader.query(q, 10, 0)) == (("count(*)",), (128,))
+        # Same query but the spaces
+        assert tuple(reader.query(f" {q}\n", 10, 0)) == (("count(*)",), (128,))
+        assert reader.results.stats()["hits"] == 1
+        assert uow.bus.handle.call_count == 1, "Cached results are not executed"
+        with engine_factory() as session:
+            session.execute("DELETE FROM sheet1 WHERE rowid > 100")
+        assert tuple(reader.query(q, 10, 0))[1] == (128,), "Cached"
+        invalidate(event.SheetUpdated(sheet, (sheet,)))  # Rows did not change
+        assert tuple(reader.query(q, 10, 0))[1] == (128,)
+        invalidate(event.SheetUpdated(sheet, (sheet,), reloaded=True))
+        assert tuple(reader.query(q, 10, 0))[1] == (100,)
+        assert reader.results.stats() == {
+            "hits": 3,
+            "misses": 2,
+            "results": 1,
+            "size": mock.ANY,
+        }
+        invalidate(event.SheetRemoved(()))
+        assert reader.results.stats()["results"] == 0
+
+    def test_uncached(self, uow, engine_factory, sheets):
+        with engine_factory() as session:
+            sheets(session).open_sheet(FIXTURES / "cities.csv")
+        reader = ReadModel(uow)
+        # We did not get the SheetOpened event of sheet1 yet
+        tuple(reader.query("SELECT count(*) FROM sheet1", 10, 0))
+        reader.results.changed("sheet1")
+        tuple(reader.query("SELECT random() FROM sheet1", 10, 0))
+        tuple(reader.query("SELECT * FROM sheet1", 10, 0))
+        # A partially read result
+        r = reader.query("SELECT * FROM sheet1", 10, 1)
+        next(r)
+        r.close()
+        assert reader.results.stats()["results"] == 1
+
+    def test_evict_least_recently_used(self):
+        result = [("a",), (1,)]
+        cache = ResultCache(budget=result_size(result) * 2)
+        cache.changed("sheet1", "sheet2")
+        keys = [cache.key(f"SELECT {i} FROM sheet1", 10, 0, ["sheet1"]) for i in range(3)]
+        cache.put(keys[0], result)
+        cache.put(keys[1], result)
+        assert cache.get(keys[0]) == result
+        cache.put(keys[2], result)
+        assert cache.get(keys[1]) is None
+        assert cache.get(keys[0]) == cache.get(keys[2]) == result
+        cache.changed("sheet2")
+        assert cache.stats()["results"] == 2
+        cache.changed("sheet1")
+        assert cache.stats() == {"hits": 3, "misses": 1, "results": 0, "size": 0}
+
+    def test_key(self):
+        cache = ResultCache()
+        cache.changed("sheet1")
+        key = cache.key("SELECT  *\nFROM sheet1 WHERE a = 'x  y'", 10, 2, ["sheet1"])
+        assert key == ("SELECT * FROM sheet1 WHERE a = 'x  y'", 10, 2, (("sheet1", 1),))
+        assert cache.key("SELECT 'now'", 10, 0, []) is None
+        assert cache.key("SELECT * FROM sheet2", 10, 0, ["sheet1", "sheet2"]) is None
+        for q in ('SELECT * FROM "sheet1"', "SELECT * FROM [sheet1]", "from SHEET1"):
+            assert cache.key(q, 10, 0, ["sheet1"])[-1] == (("sheet1", 1),), q
+
+
+class TestKeyset:
+    HEADERS = {"sheet1": ["a", "b"], "sheet2": ["rowid", "x"]}
+
+    def test_of(self):
+        q = "SELECT a, b FROM sheet1 WHERE a = 'x' ORDER BY b"
+        keyset = Keyset.of(q, self.HEADERS)
+        assert keyset == Keyset("a, b", "sheet1", "a = 'x'", ["b", "sheet1.rowid"])
+        assert keyset.page(True, 10) == (
+            "SELECT a, b, b, sheet1.rowid FROM sheet1 WHERE (a = 'x') "
+            "AND (b, sheet1.rowid) > (?, ?) ORDER BY b, sheet1.rowid LIMIT 10"
+        )
+        keyset = Keyset.of("select * from sheet2 s order by x asc, 'a,b'", self.HEADERS)
+        assert keyset.source == "sheet2 s"
+        assert keyset.keys == ["x", "'a,b'", "s._rowid_"]
+
+    @pytest.mark.parametrize(
+        "q",
+        [
+            "SELECT count(*) FROM sheet1",
+            "SELECT * FROM sheet1 ORDER BY a DESC",
+            "SELECT * FROM sheet1 ORDER BY 1",
+            "SELECT * FROM sheet1, sheet2",
+            "SELECT * FROM sheet1 JOIN sheet2",
+            "SELECT DISTINCT a FROM sheet1",
+            "SELECT * FROM sheet3",
+            # Ordering by an alias that shadows a column
+            "SELECT b AS a FROM sheet1 ORDER BY a",
+            "SELECT a AS b, b AS a FROM sheet1 ORDER BY a",
+            "SELECT a b FROM sheet1 ORDER BY B",
+            'SELECT a + 1 AS "b" FROM sheet1 ORDER BY [b]',
+        ],
+    )
+    def test_unsupported(self, q):
+        assert Keyset.of(q, self.HEADERS) is None
+
+    def test_pages_match_offset(self, uow, engine_factory):
+        with engine_factory() as session:
+            session.execute("CREATE TABLE sheet1 (a, b)")
+            rows = [(i % 7 or None, str(i)) for i in range(1000)]
+            session.executemany("INSERT INTO sheet1 VALUES (?, ?)", rows)
+        sheet = MagicMock(header=["a", "b"])
+        sheet.name = "sheet1"
+        uow.Sheets.return_value.get.return_value = [sheet]
+        reader = ReadModel(uow)
+        reader.results.changed("sheet1")
+        session = engine_factory()
+        for q in (
+            "SELECT b FROM sheet1",
+            "SELECT * FROM sheet1 WHERE a > 2 ORDER BY a",
+            "SELECT * FROM sheet1 ORDER BY a",  # With NULL keys
+            "SELECT b AS a FROM sheet1 ORDER BY a",
+        ):
+            for page in (0, 1, 2, 40, 39, 41, 20, 200):
+                expected = session.execute(f"{q} LIMIT 10 OFFSET {page * 10}")
+                expected = [tuple(r) for r in expected]
+                assert list(reader.query(q, 10, page))[1:] == expected, (q, page)
+        bookmarks = reader.pages.of(("SELECT b FROM sheet1", 10, (("sheet1", 1),)))
+        assert bookmarks.nearest(200) == (42, (420,))
+
+
+class TestResultSession:
+    Q = "SELECT a, count(*) FROM sheet1 GROUP BY a"
+
+    @pytest.fixture
+    def reader(self, uow, engine_factory):
+        with engine_factory() as session:
+            session.execute("CREATE TABLE sheet1 (a)")
+            rows = [(i % 250,) for i in range(1000)]
+            session.executemany("INSERT INTO sheet1 VALUES (?)", rows)
+        sheet = MagicMock(header=["a"])
+        sheet.name = "sheet1"
+        uow.Sheets.return_value.get.return_value = [sheet]
+        reader = ReadModel(uow)
+        reader.results.changed("sheet1")
+        # Stores the rows of the sessions right away
+        reader.submit = lambda fn, *args: fn(*args)
+        return reader
+
+    def test_pages_from_the_session(self, reader, engine_factory):
+        id = reader.open_session(self.Q)
+        with engine_factory() as session:
+            # Queries from here would see the change
+            session.execute("DELETE FROM sheet1")
+        for page in (0, 1, 2, 24, 25):
+            result = tuple(reader.query(self.Q, 10, page, session=id))
+            assert result[0] == ("a", "count(*)")
+            expected = [(a, 4) for a in range(page * 10, page * 10 + 10) if a < 250]
+            assert result[1:] == tuple(expected)
+        assert reader.open_session(self.Q, current=id) == id
+        reader.results.changed("sheet1")
+        assert reader.open_session(self.Q, current=id) != id, "Sheet changed"
+        assert len(reader.sessions) == 1
+
+    def test_bounded_rows(self, reader):
+        reader.sessions.rows = 100
+        id = reader.open_session(self.Q)
+        assert tuple(reader.query(self.Q, 10, 9, session=id))[-1] == (99, 4)
+        # Not stored
+        assert tuple(reader.query(self.Q, 10, 10, session=id))[-1] == (109, 4)
+        reader.close_session(id)
+        assert not len(reader.sessions)
+
+    def test_wait_for_the_rows(self, reader):
+        """The query runs once, and its pages wait for its rows."""
+        stored = []
+        reader.submit = lambda *args: stored.append(args)
+        reader.FILL_ROWS = 10
+        id = reader.open_session(self.Q)
+        fill, *args = stored[0]
+        threading.Timer(0.2, fill, args).start()
+        start = time.monotonic()
+        assert tuple(reader.query(self.Q, 10, 1, session=id))[1] == (10, 4)
+        assert time.monotonic() - start >= 0.2
+        assert reader.estimate(self.Q, id) == (250, True)
+
+    def test_stop_waiting(self, reader):
+        reader.submit = lambda *args: None  # Never stores the rows
+        id = reader.open_session(self.Q)
+        with pytest.raises(QueryInterrupted, match="took longer than 0.2s"):
+            tuple(reader.query(self.Q, 10, 0, QueryControl(0.2), id))
+
+    def test_budget(self, reader):
+        q = "SELECT a, count(*) FROM sheet1 WHERE a < {} GROUP BY a"
+        ids = [reader.open_session(q.format(i)) for i in (250, 200, 100)]
+        sizes = [reader.sessions._sessions[id].size for id in ids]
+        assert all(sizes)
+        reader.sessions.budget = sum(sizes)
+        # As big as the first one
+        reader.close_session(reader.open_session(self.Q))
+        assert [id in reader.sessions._sessions for id in ids] == [False, True, True]
+
+    def test_no_session(self, reader):
+        assert reader.open_session("SELECT * FROM sheet1") is None, "By keys"
+        assert reader.open_session("SELECT random() FROM sheet1") is None
+        with pytest.raises(sqlite3.OperationalError, match="no such table"):
+            reader.open_session("SELECT * FROM sheet2 GROUP BY 1")
+
+    def test_expire(self, reader):
+        reader.sessions.timeout = 0.1
+        id = reader.open_session(self.Q)
+        time.sleep(0.2)
+        assert tuple(reader.query(self.Q, 10, 1, session=id))[1] == (10, 4)
+        assert not len(reader.sessions)
+
+
+class TestCount:
+    @pytest.fixture
+    def reader(self, uow, engine_factory):
+        with engine_factory() as session:
+            session.execute("CREATE TABLE sheet1 (a)")
+            rows = [(i % 250,) for i in range(1000)]
+            session.executemany("INSERT INTO sheet1 VALUES (?)", rows)
+        sheet = MagicMock(header=["a"], num_rows=1000)
+        sheet.name = "sheet1"
+        uow.Sheets.return_value.get.return_value = [sheet]
+        reader = ReadModel(uow)
+        reader.results.changed("sheet1")
+        reader.submit = lambda fn, *args: fn(*args)
+        return reader
+
+    def test_estimate_and_count(self, reader, engine_factory):
+        q = "SELECT * FROM sheet1 WHERE a > 200"
+        assert reader.estimate(q) == (1000, False)
+        assert reader.estimate("SELECT max(a) FROM sheet1") == (1, False)
+        assert reader.count(q) == 196
+        with engine_factory() as session:
+            session.execute("DELETE FROM sheet1")
+        assert reader.estimate(q) == (196, True), "Cached"
+        reader.results.changed("sheet1")
+        assert reader.estimate(q) == (1000, False)
+        assert reader.count(q) == 0
+
+    def test_count_while_storing_the_session(self, reader):
+        """Counts the rows the result session stores, not running the
+        query again.
+        """
+        q = "SELECT a, count(*) FROM sheet1 GROUP BY a"
+        stored = []
+        reader.submit = lambda *args: stored.append(args)
+        id = reader.open_session(q)
+        fill, *args = stored[0]
+        with mock.patch.object(reader, "_execute") as execute:
+            threading.Timer(0.1, fill, args).start()
+            assert reader.count(q, session=id) == 250
+        execute.assert_not_called()
+
+    def test_count_the_session(self, reader):
+        q = "SELECT a, count(*) FROM sheet1 GROUP BY a"
+        id = reader.open_session(q)
+        assert reader.estimate(q) == (1000, False)
+        assert reader.estimate(q, id) == (250, True)
+
+    @pytest.mark.parametrize(
+        "q", ["SELECT * FROM sheet1 WHERE a > 200", "SELECT DISTINCT a FROM sheet1"]
+    )
+    def test_one_submission_one_observation(self, reader, uow, q):
+        """Counting and paging the query do not make the index advisor
+        see it more times than the user ran it.
+        """
+        id = reader.open_session(q)
+        tuple(reader.query(q, 10, 0, session=id))
+        reader.count(q, session=id)
+        executed = [
+            c.args[0]
+            for c in uow.bus.handle.call_args_list
+            if isinstance(c.args[0], event.QueryExecuted)
+        ]
+        assert executed == [event.QueryExecuted(q)]
+
+
+class TestInterrupt:
+    Q = "SELECT count(*) FROM sheet1 a, sheet1 b, sheet1 c, sheet1 d"
+    """Crosses 128^4 rows."""
+
+    @pytest.fixture
+    def uow(self, uow, engine_factory):
+        with engine_factory() as session:
+            session.execute("CREATE TABLE sheet1 (x)")
+            rows = [(i,) for i in range(128)]
+            session.executemany("INSERT INTO sheet1 VALUES (?)", rows)
+        return uow
+
+    def test_timeout(self, uow, engine_factory):
+        reader = ReadModel(uow)
+        start = time.monotonic()
+        with pytest.raises(QueryInterrupted, match="took longer than 0.1s"):
+            tuple(reader.query(self.Q, 10, 0, QueryControl(0.1)))
+        assert time.monotonic() - start < 2
+        # The connection is back in the pool without the handler
+        assert engine_factory.metrics()["idle"] == 1
+        session = engine_factory()
+        q = "SELECT count(*) FROM sheet1 a, sheet1 b, sheet1 c"
+        assert session.execute(q).fetchone() == (128 ** 3,)
+
+    def test_timeout_of_the_submission(self, uow):
+        """The timeout starts once for the queries of a submission."""
+        reader = ReadModel(uow)
+        control = QueryControl(0.3)
+        control.start()
+        time.sleep(0.3)  # Like while opening its session
+        start = time.monotonic()
+        with pytest.raises(QueryInterrupted, match="took longer than 0.3s"):
+            tuple(reader.query(self.Q, 10, 0, control))
+        assert time.monotonic() - start < 0.2
+
+    def test_cancel(self, uow):
+        reader = ReadModel(uow)
+        control = QueryControl()
+        threading.Timer(0.1, control.cancel).start()
+        with pytest.raises(QueryInterrupted, match="cancelled"):
+            tuple(reader.query(self.Q, 10, 0, control))
+        assert tuple(reader.query("SELECT count(*) FROM sheet1", 10, 0)) == (
+            ("count(*)",),
+            (128,),
+        )
@@ -1,17 +1,30 @@
+import bz2
 import csv
+import gzip
 import io
 import json
+import lzma
+import random
+import sqlite3
 import tempfile
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from unittest import mock
-from unittest.mock import call
 
 import pytest
 
-from bigsheets.adapters.sheets.sheets import SheetsAdaptor, UpdateHandler
+from bigsheets.adapters.sheets import cache, compression, count, indexes
+from bigsheets.adapters.sheets.file import CSVFile
+from bigsheets.adapters.sheets.mapped import MappedCSVFile
+from bigsheets.adapters.sheets.sheets import (
+    EngineFactory,
+    SheetRegistry,
+    SheetsAdaptor,
+    UpdateHandler,
+)
 from bigsheets.domain import sheet as sheet_model
-from bigsheets.domain.error import WrongRow
+from bigsheets.domain.error import WrongRows
 from test.conftest import FIXTURES
 
 
@@ -35,23 +48,103 @@ class TestSheets:
 
         # Check callbacks
         update_handler.on_init.assert_called_once_with(sheet)
-        update_handler.on_it.assert_has_calls([call(99), call(99)])
+        update_handler.on_it.assert_called_once_with(128)
 
         # Check db
         x = e.execute("SELECT * FROM sheet1 LIMIT 1")
         assert next(x) == (41, 5, 59, "N", 80, 39, 0, "W", "Youngstown", "OH")
 
+    def test_open_sheet_types(self, engine_factory, update_handler):
+        e = engine_factory()
+        with tempfile.TemporaryDirectory() as directory:
+            filepath = Path(directory) / "types.csv"
+            filepath.write_text(
+                "id,amount,price,day,name\n"
+                '1,"1,200",2.5,31/12/2020,foo\n'
+                "2,3,,01/02/2021,bar\n"
+                "3,1.5,1,15/01/2021,\n"
+            )
+            sheet, _ = SheetsAdaptor(e).open_sheet(
+                filepath, update_handler=update_handler
+            )
+        # amount was inferred as an INTEGER and demoted when loading
+        assert sheet.types == ["INTEGER", "REAL", "REAL", "DATE", "TEXT"]
+        x = e.execute("SELECT * FROM sheet1 ORDER BY day")
+        assert tuple(x) == (
+            (1, 1200, 2.5, "2020-12-31", "foo"),
+            (3, 1.5, 1.0, "2021-01-15", ""),
+            (2, 3, None, "2021-02-01", "bar"),
+        )
+
+    def test_open_sheet_demoted_in_a_later_chunk(self, engine_factory):
+        class ChunkedSheetsAdaptor(SheetsAdaptor):
+            sheets = SheetRegistry()
+            BULK_ROWS_PER_CHUNK = 10
+            tune_batches = False
+
+        e = engine_factory()
+        with tempfile.TemporaryDirectory() as directory:
+            filepath = Path(directory) / "days.csv"
+            # After the rows we infer the types from
+            days = [f"{13 + i % 16}/01/2020" for i in range(60)]
+            days += ["soon", "31/01/2020"]
+            filepath.write_text("".join(f"{i},{d}\n" for i, d in enumerate(days)))
+            sheet, _ = ChunkedSheetsAdaptor(e).open_sheet(filepath)
+        assert sheet.types == ["INTEGER", "TEXT"]
+        # The rows of the first chunk are as in the file too
+        x = e.execute("SELECT C1 FROM sheet1 WHERE rowid IN (1, 61, 62)")
+        assert [day for day, in x] == ["13/01/2020", "soon", "31/01/2020"]
+
+    def test_open_sheet_chunked(self, engine_factory, update_handler):
+        """Opens the sheet without the bulk-load mode."""
+        e = engine_factory()
+
+        class ChunkedSheetsAdaptor(SheetsAdaptor):
+            bulk_load = False
+            PROGRESS_INTERVAL = 0  # Report every chunk
+
+        sheet, errors = ChunkedSheetsAdaptor(e).open_sheet(
+            FIXTURES / "cities.csv", update_handler=update_handler
+        )
+        assert not errors
+        update_handler.on_it.assert_has_calls([mock.call(99), mock.call(29)])
+        x = e.execute("SELECT count(*) FROM sheet1")
+        assert next(x) == (128,)
+
+    def test_bulk_load_restores_pragmas(self, engine_factory, update_handler):
+        e = engine_factory()
+        e.execute("PRAGMA cache_size=-2000")
+        SheetsAdaptor(e).open_sheet(
+            FIXTURES / "cities.csv", update_handler=update_handler
+        )
+        assert not e.in_transaction
+        assert e.execute("PRAGMA journal_mode").fetchone() == ("memory",)
+        assert e.execute("PRAGMA synchronous").fetchone() == (2,)
+        assert e.execute("PRAGMA cache_size").fetchone() == (-2000,)
+
+    def test_bulk_load_failing_removes_table(self, engine_factory, update_handler):
+        e = engine_factory()
+        update_handler.on_it.side_effect = Exception("Boom!")
+        with pytest.raises(Exception, match="Boom!"):
+            SheetsAdaptor(e).open_sheet(
+                FIXTURES / "cities.csv", update_handler=update_handler
+            )
+        x = e.execute("SELECT name FROM sqlite_master WHERE type='table'")
+        assert not tuple(x)
+
     def test_open_sheet_wrong_rows(self, engine_factory, update_handler):
         e = engine_factory()
         sheet, errors = SheetsAdaptor(e).open_sheet(
             FIXTURES / "cities-wrong.csv", update_handler=update_handler
         )
         assert len(errors) == 1
-        e = errors[0]
-        assert e.filename.endswith("cities-wrong.csv")
-        assert e.sheet_name == "sheet1"
-        assert e.row == ["41", "5", "59", "N", "80", "39", "0", "W", "Youngstown"]
-        assert isinstance(e, WrongRow)
+        assert isinstance(errors, WrongRows)
+        assert errors.filename.endswith("cities-wrong.csv")
+        assert errors.sheet_name == "sheet1"
+        e = errors.records()[0]
+        assert e["number"] == 2  # The sniffer does not detect the header
+        assert e["cells"] == 9
+        assert e["row"] == ["41", "5", "59", "N", "80", "39", "0", "W", "Youngstown"]
 
     def test_engine_persistance(self, engine_factory):
         session = engine_factory()
@@ -109,6 +202,9 @@ class TestSheets:
                         "num_rows": 1,
                         "header": ["x", "y"],
                         "filename": "foo.bar",
+                        "types": None,
+                        "query": None,
+                        "sources": [],
                     }
                 ],
             }
@@ -153,5 +249,583 @@ class TestSheets:
             assert rows == (("foo", "bar"),)
 
             update_handler.on_init.assert_called_once_with(MockedSheetsAdaptor.sheets)
-            update_handler.on_it.assert_called_once_with(499)
+            update_handler.on_it.assert_called_once_with(1)
             assert ret == ["select * from s1", "select x from s1"]
+
+
+class TestCount:
+    DATA = b'a,b\n1,"x\ny"\n2,"z"\n3,""""\n4,w\n'
+
+    def test_scan(self):
+        scanner = count.scan(io.BytesIO(self.DATA), '"', every=1)
+        # The newline inside the quotes does not end a record
+        assert scanner.records == 5
+        assert scanner.boundaries == [0, 4, 12, 18, 25, 29]
+        scanner = count.scan(io.BytesIO(self.DATA), '"', every=12)
+        assert scanner.boundaries == [0, 18, 29]
+        # The last record has no newline
+        assert count.scan(io.BytesIO(self.DATA[:-1]), '"').records == 5
+
+    def test_estimate(self):
+        assert count.estimate(len(self.DATA), self.DATA, '"') == 5
+        assert count.estimate(len(self.DATA) * 10, self.DATA, '"') == 50
+        assert count.refine(10, 100, 1000) == 100
+
+    @pytest.mark.parametrize("exact_count", [True, False])
+    def test_num_lines(self, exact_count):
+        with tempfile.TemporaryDirectory() as directory:
+            # The name has a quote, which broke the old "wc -l"
+            filepath = Path(directory) / "it's.csv"
+            filepath.write_bytes(self.DATA[4:] * 1000)
+            with filepath.open() as f:
+                file = CSVFile(f, headers=["a", "b"], exact_count=exact_count)
+                file.BYTES_SAMPLE = 90
+                if exact_count:
+                    assert file.num_lines == 4000
+                else:
+                    assert file.num_lines != 4000
+                    assert abs(file.num_lines - 4000) < 400
+                assert len(list(file)) == 4000
+                assert file.update_num_lines(4000) == 4000
+
+
+class TestCompressed:
+    @staticmethod
+    def compress(data: bytes, suffix: str, directory: str) -> Path:
+        filepath = Path(directory) / f"cities.csv{suffix}"
+        if suffix == ".zip":
+            with zipfile.ZipFile(filepath, "w", zipfile.ZIP_DEFLATED) as zip:
+                zip.writestr("README", "Not a CSV")
+                zip.writestr("cities.csv", data)
+        else:
+            module = {".gz": gzip, ".bz2": bz2, ".xz": lzma}[suffix]
+            filepath.write_bytes(module.compress(data))
+        return filepath
+
+    @pytest.mark.parametrize("suffix", [".gz", ".bz2", ".xz", ".zip"])
+    def test_open_sheet_compressed(self, engine_factory, suffix):
+        e = engine_factory()
+        with tempfile.TemporaryDirectory() as directory:
+            data = (FIXTURES / "cities.csv").read_bytes()
+            filepath = self.compress(data, suffix, directory)
+            sheet, errors = SheetsAdaptor(e).open_sheet(filepath)
+        assert not errors
+        assert sheet.num_rows == 128
+        x = e.execute(f"SELECT * FROM {sheet.name} LIMIT 1")
+        assert next(x) == (41, 5, 59, "N", 80, 39, 0, "W", "Youngstown", "OH")
+
+    def test_num_lines_compressed(self):
+        rand = random.Random(0)
+        rows = (f"{rand.random()},{rand.randint(0, 10 ** 6)}\n" for _ in range(100_000))
+        data = "".join(rows).encode()
+        with tempfile.TemporaryDirectory() as directory:
+            filepath = self.compress(data, ".gz", directory)
+            with compression.open_text(filepath) as (f, compressed):
+                file = CSVFile(f, headers=["a", "b"], compressed=compressed)
+                file.BYTES_SAMPLE = 2 ** 18
+                assert not file.filepath
+                # Estimated from the compressed bytes the sample took
+                assert abs(file.num_lines - 100_000) < 10_000
+                assert len(list(file)) == 100_000
+                assert file.update_num_lines(100_000) == 100_000
+
+
+class TestMapped:
+    DATA = b"a,b\n" + b'1,"x\ny"\n2,z\n\n3,"w ""q"""\n4,v\n' * 20
+
+    @pytest.mark.parametrize("block", [1, 10, 2 ** 20])
+    def test_rows(self, block):
+        """The mapped file reads the same rows as CSVFile."""
+        with tempfile.TemporaryDirectory() as directory:
+            filepath = Path(directory) / "data.csv"
+            filepath.write_bytes(self.DATA)
+            with filepath.open() as f:
+                expected = list(CSVFile(f))
+            with MappedCSVFile(filepath) as file:
+                file.BLOCK = block
+                assert file.headers == ["a", "b"]
+                assert list(file) == expected
+                assert file.num_lines == 100
+
+    def test_open_sheet_mapped(self, engine_factory):
+        class MappedSheetsAdaptor(SheetsAdaptor):
+            sheets = SheetRegistry()
+            memory_map = True
+            BULK_ROWS_PER_CHUNK = 50
+
+        e = engine_factory()
+        sheet, errors = MappedSheetsAdaptor(e).open_sheet(FIXTURES / "cities.csv")
+        assert not errors
+        assert sheet.num_rows == 128
+        x = e.execute("SELECT * FROM sheet1 LIMIT 1")
+        assert next(x) == (41, 5, 59, "N", 80, 39, 0, "W", "Youngstown", "OH")
+
+
+class TestParallel:
+    def test_open_sheet_parallel(self, engine_factory):
+        e = engine_factory()
+        update_handler = mock.create_autospec(UpdateHandler)()
+
+        class ParallelSheetsAdaptor(SheetsAdaptor):
+            sheets = SheetRegistry()
+            PARALLEL_MIN_BYTES = 0
+            PARALLEL_RANGE_BYTES = 1000
+            PARALLEL_WORKERS = 2
+            PROGRESS_INTERVAL = 0
+
+        sheet, errors = ParallelSheetsAdaptor(e).open_sheet(
+            FIXTURES / "cities.csv", update_handler=update_handler
+        )
+        assert not errors
+        assert update_handler.on_it.call_count > 1
+        assert sum(c.args[0] for c in update_handler.on_it.mock_calls) == 128
+        x = e.execute("SELECT * FROM sheet1 LIMIT 1")
+        assert next(x) == (41, 5, 59, "N", 80, 39, 0, "W", "Youngstown", "OH")
+        assert e.execute("SELECT count(*) FROM sheet1").fetchone() == (128,)
+
+
+class TestConcurrent:
+    def test_new_name(self):
+        registry = SheetRegistry()
+        assert registry.new_name() == "sheet1"
+        # sheet1 is reserved until its table exists
+        assert registry.new_name({"sheet2"}) == "sheet3"
+        registry.release("sheet1")
+        assert registry.new_name({"sheet2", "sheet3"}) == "sheet1"
+
+    def test_open_sheets_concurrently(self, engine_factory):
+        class Sheets(SheetsAdaptor):
+            sheets = SheetRegistry()
+            BULK_ROWS_PER_CHUNK = 10
+
+        def open_sheet(filepath):
+            with engine_factory() as session:
+                return Sheets(session).open_sheet(filepath)
+
+        filepaths = [FIXTURES / "cities.csv", FIXTURES / "cities-wrong.csv"] * 2
+        with ThreadPoolExecutor(4) as pool:
+            opened = list(pool.map(open_sheet, filepaths))
+        e = engine_factory()
+        names = [sheet.name for sheet, _ in opened]
+        assert sorted(names) == ["sheet1", "sheet2", "sheet3", "sheet4"]
+        assert len(Sheets.sheets) == 4
+        for sheet, errors in opened:
+            q = f"SELECT count(*) FROM {sheet.name}"
+            assert e.execute(q).fetchone() == (sheet.num_rows - len(errors),)
+        # The last load to finish restores the pragmas
+        assert e.execute("PRAGMA journal_mode").fetchone() == ("memory",)
+
+
+class TestFollow:
+    def test_load_appended_rows(self, engine_factory):
+        e = engine_factory()
+        with tempfile.TemporaryDirectory() as directory:
+            filepath = Path(directory) / "log.csv"
+            filepath.write_text("time,value\n1,a\n2,b\n")
+            adaptor = SheetsAdaptor(e)
+            sheet, _ = adaptor.open_sheet(filepath)
+            assert sheet.source.offset == len("time,value\n1,a\n2,b\n")
+            adaptor.follow(name=sheet.name)
+            # The last record is not complete yet
+            with filepath.open("a") as f:
+                f.write('3,c\n4,"d\n')
+            assert adaptor.load_appended_rows(name=sheet.name)[1:3] == (1, False)
+            with filepath.open("a") as f:
+                f.write('e"\n5,f,wrong\n')
+            _, appended, reloaded, wrongs = adaptor.load_appended_rows(name=sheet.name)
+            assert (appended, reloaded) == (2, False)
+            assert list(wrongs.numbers) == [5]
+            assert wrongs.samples == [["5", "f", "wrong"]]
+            assert sheet.num_rows == 5
+            rows = e.execute(f"SELECT * FROM {sheet.name}").fetchall()
+            assert rows == [(1, "a"), (2, "b"), (3, "c"), (4, "d\ne")]
+            # Truncating the file loads it again
+            filepath.write_text("time,value\n9,z\n")
+            assert adaptor.load_appended_rows(name=sheet.name)[1:3] == (1, True)
+            assert e.execute(f"SELECT * FROM {sheet.name}").fetchall() == [(9, "z")]
+
+    def test_load_appended_rows_in_chunks(self, engine_factory):
+        e = engine_factory()
+        with tempfile.TemporaryDirectory() as directory:
+            filepath = Path(directory) / "log.csv"
+            filepath.write_text("time,value\n1,a\n")
+            adaptor = SheetsAdaptor(e)
+            adaptor.APPENDED_BYTES = 8
+            sheet, _ = adaptor.open_sheet(filepath)
+            adaptor.follow(name=sheet.name)
+            with filepath.open("a") as f:
+                f.write('2,"a long\nvalue"\n')
+                f.writelines(f"{i},x\n" for i in range(3, 100))
+                f.write("100,")
+            assert adaptor.load_appended_rows(name=sheet.name)[1:3] == (98, False)
+            assert sheet.num_rows == 99
+            assert sheet.source.offset == filepath.stat().st_size - len("100,")
+            q = f"SELECT * FROM {sheet.name} LIMIT 3"
+            assert e.execute(q).fetchall() == [(1, "a"), (2, "a long\nvalue"), (3, "x")]
+
+    def test_cannot_follow_compressed(self, engine_factory):
+        e = engine_factory()
+        with tempfile.TemporaryDirectory() as directory:
+            data = (FIXTURES / "cities.csv").read_bytes()
+            filepath = TestCompressed.compress(data, ".gz", directory)
+            adaptor = SheetsAdaptor(e)
+            sheet, _ = adaptor.open_sheet(filepath)
+        assert not sheet.source
+        with pytest.raises(ValueError):
+            adaptor.follow(name=sheet.name)
+
+
+class TestImportCache:
+    @pytest.fixture
+    def import_cache(self, monkeypatch, tmp_path):
+        import_cache = cache.ImportCache(tmp_path / "cache", 2 ** 30)
+        monkeypatch.setattr(SheetsAdaptor, "import_cache", import_cache)
+        return import_cache
+
+    def test_open_cached_sheet(self, engine_factory, import_cache, tmp_path):
+        e = engine_factory()
+        filepath = tmp_path / "log.csv"
+        rows = [(i, "a", "2020-01-31") for i in range(1, 2001)]
+        with filepath.open("w") as f:
+            f.write("time,value,day\n")
+            csv.writer(f, lineterminator="\n").writerows(rows)
+            f.write("2001,b\n")
+        adaptor = SheetsAdaptor(e)
+        sheet, _ = adaptor.open_sheet(filepath)
+        assert import_cache.get(import_cache.fingerprint(filepath))
+        with mock.patch.object(SheetsAdaptor, "_import") as _import:
+            cached, wrongs = adaptor.open_sheet(filepath)
+        assert not _import.called
+        assert cached.name != sheet.name
+        assert (cached.header, cached.num_rows) == (sheet.header, sheet.num_rows)
+        assert cached.types == ["INTEGER", "TEXT", "DATE"]
+        assert list(wrongs.numbers) == [2001]
+        assert wrongs.samples == [["2001", "b"]]
+        q = "SELECT * FROM {}"
+        assert e.execute(q.format(cached.name)).fetchall() == rows
+        # The cached sheet can be followed as the parsed one
+        assert cached.source.offset == sheet.source.offset
+        adaptor.follow(name=cached.name)
+        with filepath.open("a") as f:
+            f.write("2002,c,2020-02-01\n")
+        adaptor.load_appended_rows(name=cached.name)
+        last = e.execute(q.format(cached.name)).fetchall()[-1]
+        assert last == (2002, "c", "2020-02-01")
+        assert cached.stats.get("time").max == 2002
+        assert cached.stats.get("time").count == 2001
+
+    def test_changed_file_misses(self, engine_factory, import_cache, tmp_path):
+        filepath = tmp_path / "log.csv"
+        filepath.write_text("time,value\n1,a\n")
+        adaptor = SheetsAdaptor(engine_factory())
+        adaptor.open_sheet(filepath)
+        fingerprint = import_cache.fingerprint(filepath)
+        filepath.write_text("time,value\n2,a\n")
+        assert import_cache.fingerprint(filepath) != fingerprint
+        sheet, _ = adaptor.open_sheet(filepath)
+        assert sheet.rows == [["2", "a"]]
+
+    @pytest.mark.parametrize(
+        "platform,env,expected",
+        [
+            ("darwin", {}, "~/Library/Caches/com.bustawin.big-sheets"),
+            ("linux", {}, "~/.cache/big-sheets"),
+            ("linux", {"XDG_CACHE_HOME": "/var/cache"}, "/var/cache/big-sheets"),
+            ("linux", {"XDG_CACHE_HOME": "relative"}, "~/.cache/big-sheets"),
+            ("win32", {"LOCALAPPDATA": "/local"}, "/local/big-sheets/Cache"),
+        ],
+    )
+    def test_directory(self, monkeypatch, platform, env, expected):
+        for name in ("IMPORT_CACHE_DIR", "XDG_CACHE_HOME", "LOCALAPPDATA"):
+            monkeypatch.delenv(name, raising=False)
+        for name, value in env.items():
+            monkeypatch.setenv(name, value)
+        monkeypatch.setattr(cache.sys, "platform", platform)
+        assert cache.directory() == Path(expected).expanduser()
+
+    def test_evict_and_clear(self, engine_factory, import_cache, tmp_path):
+        adaptor = SheetsAdaptor(engine_factory())
+        filepaths = [tmp_path / f"{i}.csv" for i in range(3)]
+        for filepath in filepaths:
+            filepath.write_text("a,b\n" + "1,2\n" * 1000)
+            adaptor.open_sheet(filepath)
+        import_cache.get(import_cache.fingerprint(filepaths[0]))  # Use it again
+        import_cache.budget = import_cache.size - 1
+        filepaths[0].touch()  # Another fingerprint
+        adaptor.open_sheet(filepaths[0])
+        # The least recently used ones are evicted
+        assert not import_cache.get(import_cache.fingerprint(filepaths[1]))
+        assert import_cache.get(import_cache.fingerprint(filepaths[0]))
+        adaptor.clear_import_cache()
+        assert import_cache.size == 0
+
+
+class TestStorage:
+    def test_sheets_over_budget_go_to_disk(self, engine_factory):
+        class Sheets(SheetsAdaptor):
+            sheets = SheetRegistry()
+
+        e = engine_factory()
+        adaptor = Sheets(e)
+        first, _ = adaptor.open_sheet(FIXTURES / "cities.csv")
+        assert first.footprint > 0
+        Sheets.MEMORY_BUDGET = first.footprint  # The second does not fit
+        second, _ = adaptor.open_sheet(FIXTURES / "cities.csv")
+        assert not first.on_disk and second.on_disk
+        assert second.footprint > 0
+        databases = {name: file for _, name, file in e.execute("PRAGMA database_list")}
+        assert databases["sheet2"].endswith(".sqlite") and not databases["sheet1"]
+        assert adaptor.number_of_sheets() == 2
+        # Other connections query the sheets wherever they are
+        q = "SELECT count(*) FROM sheet1 JOIN sheet2 ON sheet1.rowid = sheet2.rowid"
+        assert engine_factory().execute(q).fetchone() == (128,)
+        adaptor.remove_sheet(name="sheet2")
+        assert adaptor.number_of_sheets() == 1
+
+    def test_no_disk(self, engine_factory):
+        class Sheets(SheetsAdaptor):
+            sheets = SheetRegistry()
+            MEMORY_BUDGET = 0
+
+        e = EngineFactory(
+            "file:nodisk?mode=memory&cache=shared", disk=False, catalog=False
+        )()
+        sheet, _ = Sheets(e).open_sheet(FIXTURES / "cities.csv")
+        assert not sheet.on_disk
+        assert e.execute("SELECT count(*) FROM main.sheet1").fetchone() == (128,)
+
+    def test_sheet_databases(self, engine_factory):
+        class Sheets(SheetsAdaptor):
+            sheets = SheetRegistry()
+
+        e = engine_factory()
+        adaptor = Sheets(e)
+        adaptor.open_sheet(FIXTURES / "cities.csv")
+        adaptor.open_sheet(FIXTURES / "cities.csv")
+        databases = [name for _, name, _ in e.execute("PRAGMA database_list")]
+        assert {"sheet1", "sheet2"} <= set(databases)
+        q = "SELECT count(*) FROM sheet1 JOIN sheet2 ON sheet1.rowid = sheet2.rowid"
+        assert engine_factory().execute(q).fetchone() == (128,)
+        adaptor.remove_sheet(name="sheet1")
+        assert adaptor.number_of_sheets() == 1
+        databases = [name for _, name, _ in e.execute("PRAGMA database_list")]
+        assert "sheet1" not in databases
+        other = engine_factory()
+        databases = [name for _, name, _ in other.execute("PRAGMA database_list")]
+        assert "sheet1" not in databases and "sheet2" in databases
+        # The name is free again
+        sheet, _ = adaptor.open_sheet(FIXTURES / "cities.csv")
+        assert sheet.name == "sheet1"
+
+    def test_sheets_without_slot_go_to_main(self, engine_factory, monkeypatch):
+        class Sheets(SheetsAdaptor):
+            sheets = SheetRegistry()
+
+        e = engine_factory()
+        monkeypatch.setattr(e.catalog, "slots", 1)
+        adaptor = Sheets(e)
+        adaptor.open_sheet(FIXTURES / "cities.csv")
+        adaptor.open_sheet(FIXTURES / "cities.csv")
+        q = "SELECT name FROM main.sqlite_master WHERE type='table' AND name LIKE 'sheet%'"
+        assert e.execute(q).fetchall() == [("sheet2",)]
+        assert adaptor.number_of_sheets() == 2
+        adaptor.remove_sheet(name="sheet2")
+        assert e.execute(q).fetchall() == []
+
+
+class TestPool:
+    def test_reuse_and_reset(self, engine_factory):
+        session = engine_factory()
+        session.execute("CREATE TABLE t (a)")
+        session.execute("PRAGMA read_uncommitted = 1")
+        session.execute("INSERT INTO t VALUES (1)")
+        assert session.in_transaction
+        session.close()
+        again = engine_factory()
+        assert again is session
+        assert not again.in_transaction
+        assert again.execute("SELECT count(*) FROM t").fetchone() == (0,)
+        assert again.execute("PRAGMA read_uncommitted").fetchone() == (0,)
+        metrics = engine_factory.metrics()
+        assert metrics["checkouts"] == 2
+        assert metrics["connections"] == metrics["open"] == 1
+        assert metrics["idle"] == 0
+
+    def test_overflow(self, engine_factory, monkeypatch, caplog):
+        monkeypatch.setattr(engine_factory.pool, "size", 1)
+        monkeypatch.setattr(engine_factory.pool, "timeout", 0.05)
+        first = engine_factory()
+        second = engine_factory()
+        assert second is not first
+        assert [r.levelname for r in caplog.records] == ["WARNING"]
+        caplog.clear()
+        metrics = engine_factory.metrics()
+        assert metrics["waits"] == metrics["overflows"] == 1
+        assert metrics["max_wait_seconds"] >= 0.05
+        assert metrics["open"] == 2
+        second.close()  # Over the size, so it closes
+        first.close()
+        metrics = engine_factory.metrics()
+        assert metrics["open"] == metrics["idle"] == 1
+        assert engine_factory() is first
+
+    def test_idle_sessions_detach_removed_sheets(self, engine_factory):
+        class Sheets(SheetsAdaptor):
+            sheets = SheetRegistry()
+
+        adaptor = Sheets(engine_factory())
+        adaptor.open_sheet(FIXTURES / "cities.csv")
+        idle = engine_factory()
+        idle.close()
+        adaptor.remove_sheet(name="sheet1")
+        databases = [name for _, name, _ in idle.execute("PRAGMA database_list")]
+        assert "sheet1" not in databases
+        # A new sheet reusing the name is attached on checkout
+        adaptor.open_sheet(FIXTURES / "cities.csv")
+        session = engine_factory()
+        assert session is idle
+        q = "SELECT count(*) FROM sheet1"
+        assert session.execute(q).fetchone() == (128,)
+
+
+class TestIndexes:
+    def test_index_repeated_queries(self, engine_factory):
+        class Sheets(SheetsAdaptor):
+            sheets = SheetRegistry()
+            index_advisor = indexes.Advisor()
+
+        e = engine_factory()
+        adaptor = Sheets(e)
+        sheet, _ = adaptor.open_sheet(FIXTURES / "cities.csv")
+        q = "SELECT * FROM sheet1 WHERE LatM = 5"
+        assert adaptor.advise_indexes(q) == []
+        assert adaptor.advise_indexes(q) == [sheet]
+        assert list(sheet.indexes) == ["LatM"] and sheet.indexes["LatM"] > 0
+        (*_, plan), = e.execute(f"EXPLAIN QUERY PLAN {q}").fetchall()
+        assert "USING INDEX" in plan
+        assert adaptor.advise_indexes(q) == []
+        adaptor.drop_index(name="sheet1", column="LatM")
+        assert sheet.indexes == {}
+        # Sqlite does not prepare again a cached explain when the schema changes
+        (*_, plan), = e.execute(f"EXPLAIN QUERY PLAN {q} ").fetchall()
+        assert plan.startswith("SCAN")
+
+    def test_index_quoted_column(self, engine_factory, tmp_path):
+        class Sheets(SheetsAdaptor):
+            sheets = SheetRegistry()
+            index_advisor = indexes.Advisor()
+
+        file = tmp_path / "quoted.csv"
+        file.write_text('a"b,c\n' + "".join(f"{i},{i % 7}\n" for i in range(100)))
+        adaptor = Sheets(engine_factory())
+        sheet, _ = adaptor.open_sheet(file)
+        q = 'SELECT * FROM sheet1 WHERE "a""b" = 5'
+        adaptor.advise_indexes(q)
+        assert adaptor.advise_indexes(q) == [sheet]
+        assert list(sheet.indexes) == ['a"b']
+        adaptor.drop_index(name="sheet1", column='a"b')
+        assert sheet.indexes == {}
+
+    def test_index_budget(self, engine_factory):
+        class Sheets(SheetsAdaptor):
+            sheets = SheetRegistry()
+            index_advisor = indexes.Advisor()
+            INDEX_BUDGET = 0
+
+        adaptor = Sheets(engine_factory())
+        sheet, _ = adaptor.open_sheet(FIXTURES / "cities.csv")
+        q = "SELECT * FROM sheet1 WHERE LatM = 5"
+        adaptor.advise_indexes(q)
+        assert adaptor.advise_indexes(q) == []
+        assert sheet.indexes == {}
+
+
+class TestStats:
+    def test_stats(self, engine_factory):
+        e = engine_factory()
+        sheet, _ = SheetsAdaptor(e).open_sheet(FIXTURES / "cities.csv")
+        latm = sheet.stats.get("LatM")
+        assert (latm.count, latm.nulls, latm.min, latm.max) == (128, 0, 1, 59)
+        assert 0 < latm.distinct <= 60
+        q = "SELECT stat FROM sheet1.sqlite_stat1 WHERE tbl = 'sheet1' AND idx IS NULL"
+        assert e.execute(q).fetchall() == [("128",)]
+
+    def test_index_stats(self, engine_factory):
+        class Sheets(SheetsAdaptor):
+            sheets = SheetRegistry()
+            index_advisor = indexes.Advisor()
+
+        e = engine_factory()
+        adaptor = Sheets(e)
+        sheet, _ = adaptor.open_sheet(FIXTURES / "cities.csv")
+        q = "SELECT * FROM sheet1 WHERE LatM = 5"
+        adaptor.advise_indexes(q)
+        adaptor.advise_indexes(q)
+        q = "SELECT stat FROM sheet1.sqlite_stat1 WHERE idx = 'sheet1_LatM'"
+        rows_per_value = -(-128 // sheet.stats.get("LatM").distinct)
+        assert e.execute(q).fetchall() == [(f"128 {rows_per_value}",)]
+
+    def test_no_stats(self, engine_factory):
+        class Sheets(SheetsAdaptor):
+            profile_columns = False
+
+        sheet, _ = Sheets(engine_factory()).open_sheet(FIXTURES / "cities.csv")
+        assert sheet.stats is None
+
+
+class TestDerived:
+    def test_derive_and_refresh(self, engine_factory, tmp_path):
+        class Sheets(SheetsAdaptor):
+            sheets = SheetRegistry()
+
+        e = engine_factory()
+        adaptor = Sheets(e)
+        adaptor.open_sheet(FIXTURES / "cities.csv")
+        adaptor.open_sheet(FIXTURES / "cities.csv")
+        q = (
+            "SELECT a.City, a.State, count(*) AS n FROM sheet1 a "
+            "JOIN sheet2 b ON a.City = b.City GROUP BY a.City, a.State"
+        )
+        sheet = adaptor.derive_sheet(q)
+        assert sheet.name == "sheet3"
+        assert sheet.query == q and sheet.sources == ["sheet1", "sheet2"]
+        assert sheet.header == ["City", "State", "n"]
+        assert sheet.num_rows == e.execute(f"SELECT count(*) FROM ({q})").fetchone()[0]
+        assert sheet.rows[0] == list(e.execute(f"{q} LIMIT 1").fetchone())
+        assert sheet.stats.get("State").count == sheet.num_rows
+        assert sheet.footprint > 0
+        assert e.execute("SELECT count(*) FROM sheet3").fetchone() == (sheet.num_rows,)
+
+        with e:
+            e.execute("DELETE FROM sheet1 WHERE State != 'OH'")
+        adaptor.refresh_sheet(name="sheet3")
+        assert sheet.num_rows == e.execute(f"SELECT count(*) FROM ({q})").fetchone()[0]
+        q = "SELECT DISTINCT State FROM sheet3"
+        assert e.execute(q).fetchall() == [("OH",)]
+        with pytest.raises(ValueError):
+            adaptor.refresh_sheet(name="sheet1")
+
+        # Workspaces keep the query of derived sheets
+        filepath = tmp_path / "workspace.bsw"
+        adaptor.save_workspace([], filepath)
+
+        class Loaded(SheetsAdaptor):
+            sheets = SheetRegistry()
+
+        other = EngineFactory("file:derived?mode=memory&cache=shared")()
+        Loaded(other).load_workspace(filepath)
+        loaded = Loaded.sheets.get("sheet3")
+        assert loaded.query == sheet.query and loaded.sources == ["sheet1", "sheet2"]
+        q = "SELECT count(*) FROM sheet3"
+        assert other.execute(q).fetchone() == (sheet.num_rows,)
+
+    def test_wrong_query(self, engine_factory):
+        class Sheets(SheetsAdaptor):
+            sheets = SheetRegistry()
+
+        adaptor = Sheets(engine_factory())
+        adaptor.open_sheet(FIXTURES / "cities.csv")
+        with pytest.raises(sqlite3.OperationalError):
+            adaptor.derive_sheet("SELECT nope FROM sheet1")
+        assert adaptor.number_of_sheets() == 1
+        assert adaptor.derive_sheet("SELECT City FROM sheet1").name == "sheet2"
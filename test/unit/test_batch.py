@@ -0,0 +1,48 @@
+from unittest import mock
+
+import pytest
+
+from bigsheets.adapters.sheets.batch import Batcher, Progress
+
+
+@pytest.mark.parametrize(
+    "seconds,size",
+    [
+        # Each batch has a fixed cost, so bigger batches are faster
+        (lambda rows: 1 + rows / 1000, 1000),
+        # The cost grows faster than the rows, so smaller batches are faster
+        (lambda rows: (rows / 100) ** 2, 10),
+    ],
+)
+def test_batcher_tunes_size(seconds, size):
+    now = 0.0
+    batcher = Batcher(100, 10, 1000)
+    with mock.patch("time.perf_counter", lambda: now):
+        for rows in batcher([] for _ in range(100_000)):
+            now += seconds(len(rows))
+            if batcher.rows > 50_000:
+                break
+    assert batcher.size == size
+
+
+def test_batcher_yields_all_rows():
+    batches = list(Batcher(3, 1, 10)(range(10)))
+    assert sum(batches, []) == list(range(10))
+    assert len(batches[0]) == 3
+
+
+def test_progress_reports_every_interval():
+    now = 0.0
+    report = mock.Mock()
+    with mock.patch("time.monotonic", lambda: now):
+        progress = Progress(report, 1)
+        progress.add(10)
+        now += 0.5
+        progress.add(10)
+        assert not report.called
+        now += 0.5
+        progress.add(10)
+        report.assert_called_once_with(30)
+        progress.add(5)
+        progress.flush()
+    assert report.call_args_list == [mock.call(30), mock.call(5)]
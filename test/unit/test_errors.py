@@ -0,0 +1,45 @@
+import time
+
+from bigsheets.adapters.errors.errors import ErrorsAdapter
+from bigsheets.domain.error import OpeningFileFailed, WrongRows
+
+
+def wrong_rows(sheet_name: str, numbers: range) -> WrongRows:
+    rows = WrongRows("f.csv", sheet_name)
+    for number in numbers:
+        rows.add(number, ["x"] * (number % 3))
+    return rows
+
+
+def test_counts_and_pages():
+    errors = ErrorsAdapter()
+    errors.add(wrong_rows("sheet1", range(1, 6)), OpeningFileFailed("g.csv", OSError()))
+    # The wrong rows of the same sheet are kept together
+    errors.add(wrong_rows("sheet1", range(6, 8)), WrongRows("f.csv", "sheet2"))
+    assert errors.counts() == {"f.csv": 7, "g.csv": 1}
+    assert len(errors.get()["f.csv"]) == 1
+    page = errors.page("f.csv", 1, 3)
+    assert [e["number"] for e in page] == [4, 5, 6]
+    assert page[0] == {
+        "type": "WrongRow",
+        "filename": "f.csv",
+        "sheet_name": "sheet1",
+        "number": 4,
+        "cells": 1,
+        "row": ["x"],
+    }
+    assert errors.page("f.csv", 3, 3) == []
+    assert errors.page("g.csv", 0, 3)[0]["type"] == "OpeningFileFailed"
+
+
+def test_many_wrong_rows():
+    """Adding many wrong rows takes linear time and keeps few samples."""
+    errors = ErrorsAdapter()
+    start = time.perf_counter()
+    for i in range(100):
+        errors.add(wrong_rows("sheet1", range(i * 5000, (i + 1) * 5000)))
+    assert time.perf_counter() - start < 5
+    rows = errors.get()["f.csv"][0]
+    assert len(rows) == 500_000
+    assert len(rows.samples) == WrongRows.SAMPLES
+    assert errors.page("f.csv", 4999, 100)[-1]["row"] is None
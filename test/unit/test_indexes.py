@@ -0,0 +1,48 @@
+import sqlite3
+
+import pytest
+
+from bigsheets.adapters.sheets.indexes import Advisor, candidates
+
+
+@pytest.fixture
+def session():
+    session = sqlite3.connect(":memory:")
+    session.execute("CREATE TABLE sheet1('id' NUMERIC, 'City Name' TEXT, 'key')")
+    session.execute("CREATE TABLE sheet2('key' NUMERIC, 'value')")
+    return session
+
+
+@pytest.mark.parametrize(
+    "q,expected",
+    [
+        ("SELECT * FROM sheet1 WHERE id = 3", {("sheet1", "id")}),
+        ("SELECT * FROM sheet1 WHERE 3 < id", {("sheet1", "id")}),
+        ("SELECT * FROM sheet1 WHERE [City Name] IN ('a')", {("sheet1", "City Name")}),
+        # Values are not columns
+        ("SELECT * FROM sheet1 WHERE \"City Name\" = 'id = 1'", {("sheet1", "City Name")}),
+        (
+            "SELECT * FROM sheet1 a JOIN sheet2 AS b ON a.key = b.key",
+            {("sheet1", "key"), ("sheet2", "key")},
+        ),
+        ("SELECT count(*) FROM sheet1", set()),
+    ],
+)
+def test_candidates(session, q, expected):
+    assert candidates(session, q) == expected
+
+
+def test_no_candidates_for_indexed_columns(session):
+    session.execute("CREATE INDEX sheet1_id ON sheet1(id)")
+    assert candidates(session, "SELECT * FROM sheet1 WHERE id = 3") == set()
+
+
+def test_advisor():
+    advisor = Advisor()
+    assert advisor.observe([("sheet1", "id")]) == []
+    assert advisor.observe([("sheet1", "id")]) == [("sheet1", "id")]
+    # Once returned, the candidate is not returned again
+    assert advisor.observe([("sheet1", "id")]) == []
+    advisor.forget("sheet1")
+    assert advisor.observe([("sheet1", "id")]) == []
+    assert advisor.observe([("sheet1", "id")]) == [("sheet1", "id")]
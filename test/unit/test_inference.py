@@ -0,0 +1,58 @@
+import pytest
+
+from bigsheets.adapters.sheets.inference import Column, Schema
+
+
+@pytest.mark.parametrize(
+    "values,type,date_format",
+    [
+        (["1", "-2", " 3", ""], "INTEGER", None),
+        (["1", "2.5", "1,000.5"], "REAL", None),
+        (["2020-01-01", "2020-12-31"], "DATE", "%Y-%m-%d"),
+        (["31/01/2020", "01/02/2020"], "DATE", "%d/%m/%Y"),
+        (["01/31/2020", "02/01/2020"], "DATE", "%m/%d/%Y"),
+        # Either the 1st of February or the 2nd of January
+        (["01/02/2020", "03/04/2020"], "TEXT", None),
+        (["1_000", "2"], "TEXT", None),
+        (["1.5", "nan"], "TEXT", None),
+        (["1", "inf", "1e999"], "TEXT", None),
+        (["1", "foo"], "TEXT", None),
+        (["007", "010"], "TEXT", None),
+        (["1.5", "00501"], "TEXT", None),
+        (["0", "-0.5", "0.25"], "REAL", None),
+        (["", " "], "TEXT", None),
+    ],
+)
+def test_infer_column(values, type, date_format):
+    column = Column.infer(values)
+    assert column.type == type
+    assert column.date_format == date_format
+
+
+def test_convert():
+    schema = Schema.infer([["1", "31/01/2020 10:00", "x"]], 3)
+    assert schema.types == ["INTEGER", "DATE", "TEXT"]
+    assert schema.convert([["1,000", "01/02/2020 00:00", "y"], ["", "", ""]]) == [
+        [1000, "2020-02-01 00:00:00", "y"],
+        [None, None, ""],
+    ]
+    # Values that do not fit demote the column
+    assert schema.convert([["2.5", "tomorrow", "z"]]) == [[2.5, "tomorrow", "z"]]
+    assert schema.types == ["REAL", "TEXT", "TEXT"]
+    demoted = {i: (c.type, c.date_format) for i, c in schema.demoted.items()}
+    assert demoted == {0: ("INTEGER", None), 1: ("DATE", "%d/%m/%Y %H:%M")}
+
+
+def test_convert_demoted_rows():
+    """All the rows convert into the demoted type, not the ones after
+    the value that demoted the column.
+    """
+    schema = Schema.infer([["31/01/2020"]], 1)
+    rows = [["01/02/2020"], ["tomorrow"], ["03/02/2020"]]
+    assert schema.convert(rows) == rows
+    assert schema.types == ["TEXT"]
+
+
+def test_from_types():
+    schema = Schema.from_types(["DATE", "REAL"])
+    assert schema.convert([["2020-02-01", "1"]]) == [["2020-02-01", 1.0]]
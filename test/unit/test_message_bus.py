@@ -59,6 +59,23 @@ def test_handle_event(bus):
     fake_handler.assert_called_once_with(event)
 
 
+def test_handle_event_synchronously(bus):
+    handled = []
+
+    class SyncHandler(Handler):
+        HANDLES = {FooEvent}
+        SYNC = True
+
+        def __call__(self, message):
+            sleep(0.1)
+            handled.append(message)
+
+    event = FooEvent()
+    bus.start({FooEvent: {SyncHandler()}}, {})
+    bus.handle(event)
+    assert handled == [event]
+
+
 def test_handle_event_with_error(bus, caplog):
     boom = Exception("Boom!")
 
@@ -0,0 +1,53 @@
+import sqlite3
+from unittest.mock import MagicMock
+
+from bigsheets.service import read_model
+from bigsheets.service.prefetch import Prefetcher
+
+
+def reader():
+    def query(q, limit, page, control, session):
+        if q == "wrong":
+            raise sqlite3.OperationalError("no such table")
+        return iter([("a",), *((page * limit + i,) for i in range(limit))])
+
+    return MagicMock(fetch=MagicMock(side_effect=query), timeout=None)
+
+
+def test_prefetch_next_and_previous_pages():
+    prefetcher = Prefetcher(reader(), lambda fn, *args: fn(*args), 2, True, 2 ** 20)
+    assert prefetcher.get("q", 2, 5) is None
+    prefetcher.shown("q", 2, 5, [("a",), (10,), (11,)])
+    assert prefetcher.get("q", 2, 6) == [("a",), (12,), (13,)]
+    assert prefetcher.get("q", 2, 4) == [("a",), (8,), (9,)]
+    prefetcher.shown("q", 2, 7, [("a",), (14,), (15,)])
+    assert prefetcher.get("q", 2, 5) is None, "Far from the shown page"
+    assert sorted(prefetcher._pages) == [6, 7, 8, 9]
+    assert prefetcher.get("q", 3, 8) is None, "Other limit"
+    prefetcher.shown("other q", 2, 8, [("a",)])
+    assert prefetcher.stats() == {
+        "hits": 2,
+        "misses": 3,
+        "pages": 4,
+        "size": read_model.result_size([("a",)]) + 3 * prefetcher._pages[9][1],
+    }
+
+
+def test_budget():
+    page = [("a",), (0,), (1,)]
+    budget = read_model.result_size(page) * 2
+    prefetcher = Prefetcher(reader(), lambda fn, *args: fn(*args), 3, False, budget)
+    prefetcher.shown("q", 2, 0, page)
+    assert sorted(prefetcher._pages) == [0, 1]
+
+
+def test_drop_loading_pages():
+    loads = []
+    prefetcher = Prefetcher(reader(), lambda *args: loads.append(args), 1, False)
+    prefetcher.shown("q", 2, 0, [("a",)])
+    prefetcher.drop()
+    prefetcher._load(*loads[0][1:])
+    assert loads[0][-1].reason() == "The query was cancelled."
+    assert prefetcher.stats()["pages"] == 0
+    prefetcher.shown("wrong", 2, 0, [("a",)])
+    assert prefetcher.get("wrong", 2, 1) is None
@@ -0,0 +1,43 @@
+import random
+
+import pytest
+
+from bigsheets.adapters.sheets.stats import Column, Profile
+
+
+def test_column():
+    column = Column("x")
+    column.add([3, None, 1, "", 3])
+    column.add([2, 3])
+    assert (column.count, column.nulls) == (7, 2)
+    assert (column.min, column.max) == (1, 3)
+    assert column.distinct == 3
+    assert column.top[0] == (3, 3)
+
+
+def test_column_numbers_and_text():
+    column = Column("x")
+    column.add([2, "b", 1.5, "a"])
+    # As sqlite, numbers go before text
+    assert (column.min, column.max) == (1.5, "b")
+
+
+@pytest.mark.parametrize(
+    "distinct,error", [(100, 0), (10_000, 0.1), (200_000, 0.3), (10 ** 9, 0.1)]
+)
+def test_column_estimates_distinct_values(distinct, error):
+    column = Column("x")
+    values = [random.randrange(distinct) for _ in range(500_000)]
+    for i in range(0, len(values), 10_000):
+        column.add(values[i : i + 10_000])
+    assert column.distinct == pytest.approx(len(set(values)), rel=error)
+
+
+def test_profile_to_json():
+    profile = Profile(["a", "b"])
+    profile.add([[1, "x"], [2, "y"], [2, None]])
+    copy = Profile.from_json(profile.to_json())
+    assert copy.summary() == profile.summary()
+    assert copy.rows == 3
+    copy.add([[3, "z"]])
+    assert copy.get("a").max == 3 and copy.get("b").distinct == 3